@@ -1,14 +1,7 @@
 import streamlit as st
 
-st.set_page_config(
-    page_title="Team Document System",
-    page_icon="🏢",
-    layout="wide",
-    initial_sidebar_state="collapsed"
-)
-
 # ===== 自訂 CSS 樣式 (現代專業藍色系 - 修正文字顏色) =====
-st.markdown("""
+PAGE_CSS = """
 <style>
     /* 全域設定 */
     .main {
@@ -186,91 +179,530 @@ st.markdown("""
         overflow: hidden;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+def setup_page():
+    """
+    頁面設定與自訂樣式，由 main() 最先呼叫
+    不放在模組層級：指令列工具 (bulk_import.py) 匯入 app 時不會輸出任何頁面元素
+    """
+    st.set_page_config(
+        page_title="Team Document System",
+        page_icon="🏢",
+        layout="wide",
+        initial_sidebar_state="collapsed"
+    )
+    st.markdown(PAGE_CSS, unsafe_allow_html=True)
 
 import gspread
 from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
 import io
+import sys
 import base64
-from datetime import datetime
-import pandas as pd
+import os
+import time
+import sqlite3
+import threading
+import functools
+import contextlib
+import importlib.util
+import urllib.parse
+import csv
+import json
+import zipfile
+import zlib
+import tempfile
+from collections import ChainMap, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 import hashlib
+import heapq
+import random
+
+def lazy_import(name):
+    """延遲載入模組：第一次存取模組屬性時才真正執行 import"""
+    if name in sys.modules:
+        return sys.modules[name]
+    
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"找不到模組: {name}")
+    
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+# 登入頁用不到 pandas，延遲到第一次使用才載入 (縮短冷啟動時間)
+pd = lazy_import('pandas')
 
-# PDF 轉圖片
-try:
-    import fitz  # PyMuPDF
-    PDF_PREVIEW_AVAILABLE = True
-except ImportError:
-    PDF_PREVIEW_AVAILABLE = False
+# PDF 轉圖片 (PyMuPDF 同樣延遲載入)
+PDF_PREVIEW_AVAILABLE = importlib.util.find_spec('fitz') is not None
+if PDF_PREVIEW_AVAILABLE:
+    fitz = lazy_import('fitz')
 
 SCOPES = [
     'https://www.googleapis.com/auth/spreadsheets',
     'https://www.googleapis.com/auth/drive'
 ]
 
+# OCR 全文另存於獨立工作表，避免每次讀取公文清單都帶回大量文字
+OCR_TEXT_HEADERS = ['ID', 'OCR_Text', 'Updated_At']
+
+# OCR 文字編碼：較長的文字以 zlib 壓縮 + base64 存放，一格放不下時接續寫在 Updated_At 右側的儲存格
+OCR_TEXT_CODEC_PREFIX = '#OCR1:'
+OCR_TEXT_COMPRESS_MIN = 1000     # 超過這個字元數才壓縮
+OCR_TEXT_CELL_LIMIT = 45000      # 每格最多字元數 (Sheets 單一儲存格上限 50,000)
+OCR_TEXT_MAX_PARTS = 20          # 每筆最多分成幾格，超過時截斷文字
+
+# 逐頁辨識：進度工作表、每次處理的時間預算 (秒) 與每份公文最多辨識的頁數 (0 為不限制)
+OCR_CHECKPOINT_TITLE = 'OCR進度'
+OCR_CHECKPOINT_HEADERS = ['Key', 'OCR_Text', 'Updated_At']
+OCR_SLICE_SECONDS = 60
+OCR_MAX_PAGES = 500
+
+# 各頁面需要的公文欄位 (投影讀取，只抓這些欄)
+LISTING_COLUMNS = ['ID', 'Date', 'Type', 'Agency', 'Subject', 'Parent_ID', 'Status', 'OCR_Status']
+HOME_COLUMNS = LISTING_COLUMNS + ['Created_At', 'Created_By']
+OCR_PAGE_COLUMNS = LISTING_COLUMNS + ['Drive_File_ID']
+SEARCH_COLUMNS = LISTING_COLUMNS + ['Drive_File_ID', 'Created_By', 'OCR_Date']
+
+# 本機 SQLite 副本 (Google Sheets 仍為正式資料來源)
+REPLICA_PATH = 'document_replica.sqlite3'
+REPLICA_RECONCILE_INTERVAL = 30  # 背景核對間隔 (秒)
+REPLICA_INDEXES = {
+    'documents': ['ID', 'Parent_ID', 'Root_ID', 'Date', 'Agency', 'Type', 'OCR_Status'],
+    'deleted_documents': ['ID', 'Deleted_At'],
+    'users': ['Username'],
+    'archived_documents': ['ID', 'Root_ID', 'Archive_Year'],
+}
+
+# 上層公文 type-ahead：全文索引欄位與每次最多回傳筆數
+DOCUMENT_INDEX_COLUMNS = ['ID', 'Agency', 'Subject']
+PARENT_PICKER_LIMIT = 20
+
+# 分面統計：顯示名稱與在 documents 上的運算式；彙總表 document_facets 上對應的運算式
+FACET_FIELDS = {
+    'Agency': ('🏢 機關單位', 'Agency'),
+    'Type': ('📋 公文類型', 'Type'),
+    'Year': ('📅 年度', 'substr(Date, 1, 4)'),
+    'Month': ('🗓️ 年月', 'substr(Date, 1, 7)'),
+    'OCR_Status': ('📝 辨識狀態', "substr(OCR_Status, 1, instr(OCR_Status || ' ', ' ') - 1)"),
+}
+FACET_TABLE_EXPRS = {
+    'Agency': 'Agency',
+    'Type': 'Type',
+    'Year': 'substr(Month, 1, 4)',
+    'Month': 'Month',
+    'OCR_Status': 'OCR_Status',
+}
+FACET_OPTION_LIMIT = 20
+
+# 批次匯入：公文類型、中繼資料 CSV 欄位與同時上傳的數量
+DOCUMENT_TYPES = ["發文", "收文", "簽呈", "函"]
+BULK_REQUIRED_COLUMNS = ['filename', 'date', 'type', 'agency', 'subject']
+BULK_OPTIONAL_COLUMNS = ['parent_id', 'doc_id']
+BULK_UPLOAD_WORKERS = 8
+
+# 批次刪除：定位列的重試次數
+DELETE_LOCATE_ATTEMPTS = 3
+
+# Drive 批次要求：每次最多的呼叫數 (API 上限 100)、可重試的狀態碼與退避時間 (秒)
+DRIVE_BATCH_LIMIT = 100
+DRIVE_BATCH_RETRIES = 3
+DRIVE_RETRY_STATUSES = {429, 500, 502, 503, 504}
+DRIVE_RETRY_BASE_DELAY = 1.0
+DRIVE_RETRY_MAX_DELAY = 16.0
+
+# Drive 資料夾：附件依公文日期放在 年/年-月 子資料夾，舊附件背景搬移時每頁列出的檔案數
+DRIVE_MIGRATION_PAGE_SIZE = 1000
+
+# 公文分片：年度分片工作表名稱的前綴、同時讀取的分片數
+DOCUMENT_SHARD_PREFIX = '公文資料_'
+DOCUMENT_SHARD_WORKERS = 4
+
+# 回覆追蹤：需要回覆的公文類型、預設期限 (天)、追蹤頁每區顯示的筆數
+SLA_TRACKED_TYPES = ('發文', '函')
+SLA_DEFAULT_DAYS = 7
+TRACKING_TOP_K = 50
+REPLY_QUEUE_COLUMNS = ['ID', 'Type', 'Parent_ID', 'Date', 'Agency', 'Subject', 'Created_By']
+REPLY_QUEUE_COMPACT_SLACK = 64
+
+# 匯出：欄位 (含對話串結構)、每批筆數與同時下載附件的數量
+EXPORT_COLUMNS = ['ID', 'Root_ID', 'Depth', 'Parent_ID', 'Date', 'Type', 'Agency', 'Subject',
+                  'Status', 'OCR_Status', 'Created_At', 'Created_By', 'Drive_File_ID']
+EXPORT_BATCH_SIZE = 1000
+EXPORT_DOWNLOAD_WORKERS = 8
+EXPORT_MIME_TYPES = {
+    'csv': 'text/csv',
+    'parquet': 'application/octet-stream',
+    'zip': 'application/zip',
+}
+
+# 封存：超過幾年的對話串移到封存、索引工作表、Drive 資料夾與檔名、索引欄位
+ARCHIVE_AFTER_YEARS = 5
+ARCHIVE_INDEX_TITLE = '封存索引'
+ARCHIVE_FOLDER_NAME = '封存公文'
+ARCHIVE_FILE_PREFIX = '公文封存_'
+ARCHIVE_MIME_TYPE = 'application/vnd.apache.parquet'
+ARCHIVE_INDEX_COLUMNS = ['ID', 'Root_ID', 'Depth', 'Parent_ID', 'Date', 'Type', 'Agency', 'Subject',
+                         'Drive_File_ID', 'Archive_Year', 'Archive_File_ID', 'Archived_At']
+ARCHIVE_INDEX_TTL = 600          # 封存索引在副本中的有效時間 (秒)
+ARCHIVE_RESULT_LIMIT = 50        # 查詢封存時最多列出的對話串數
+ARCHIVE_CACHED_FILES = 4         # 同時快取的年度封存檔數
+ARCHIVE_CHECK_INTERVAL = 86400   # 自動封存的間隔 (秒)
+
+# 使用者目錄快取時間 (秒)
+USER_DIRECTORY_TTL = 300
+USER_HEADERS = ['Username', 'Password', 'Display_Name', 'Role', 'Created_At']
+
+# 查詢結果分頁與排序
+SEARCH_PAGE_SIZES = [10, 20, 50, 100]
+SEARCH_SORT_OPTIONS = {
+    "日期 (新→舊)": "Date DESC, CAST(Row_Num AS INTEGER) DESC",
+    "日期 (舊→新)": "Date ASC, CAST(Row_Num AS INTEGER) ASC",
+    "機關單位": "Agency ASC, Date DESC",
+    "公文字號": "ID ASC",
+    "建立順序": "CAST(Row_Num AS INTEGER)",
+}
+
+# 型別化資料框：日期欄位與解析後欄位的對應，以及轉成 category 的欄位
+DATE_COLUMNS = {
+    'Date': 'Date_Parsed',
+    'Created_At': 'Created_At_Parsed',
+    'OCR_Date': 'OCR_Date_Parsed',
+}
+CATEGORY_COLUMNS = ['Type', 'Agency', 'Status', 'OCR_Status']
+
+# 效能量測：每種操作保留的最近耗時樣本數、可匯出的紀錄筆數、API 呼叫數保留的分鐘數
+METRIC_SAMPLE_LIMIT = 2000
+METRIC_LOG_LIMIT = 10000
+API_CALL_HISTORY_MINUTES = 60
+# 各服務每分鐘配額 (可在 secrets 以 API_QUOTAS 覆寫)
+API_QUOTAS_PER_MINUTE = {
+    'sheets': 60,     # Sheets API 每位使用者每分鐘 60 次 (服務帳號即一位使用者)
+    'drive': 12000,   # Drive API 每位使用者每分鐘 12,000 次
+    'vision': 1800,   # Vision API 每分鐘 1,800 次
+    'gemini': 15,     # Gemini 免費層每分鐘 15 次
+}
+
+# 增量同步設定 (秒)
+SYNC_CHECK_INTERVAL = 5        # 兩次檢查版本之間的最短間隔
+SYNC_FULL_RELOAD_INTERVAL = 1800  # 無論如何每隔多久完整重載一次
+SYNC_VERIFY_ROWS = 200         # 增量同步時重讀並比對的已知尾端列數
+
 # ===== 密碼加密 =====
 def hash_password(password):
     """將密碼進行 SHA256 加密"""
     return hashlib.sha256(password.encode()).hexdigest()
 
 # ===== 使用者驗證 =====
-def check_login(users_df, username, password):
-    """驗證使用者登入"""
-    if users_df.empty:
-        return None
-    
-    hashed = hash_password(password)
-    user = users_df[(users_df['Username'] == username) & (users_df['Password'] == hashed)]
+def check_login(user_directory, username, password):
+    """驗證使用者登入 (user_directory 為 {帳號: 使用者資料})"""
+    user = user_directory.get(username)
     
-    if not user.empty:
+    if user and user.get('Password') == hash_password(password):
         return {
-            'username': user.iloc[0]['Username'],
-            'display_name': user.iloc[0]['Display_Name'],
-            'role': user.iloc[0]['Role']
+            'username': user['Username'],
+            'display_name': user['Display_Name'],
+            'role': user['Role']
         }
     return None
 
+def get_setting(name, default=None):
+    """從 Secrets 讀取設定，沒有設定 (或沒有 secrets 檔) 時回傳預設值"""
+    try:
+        return st.secrets[name] if name in st.secrets else default
+    except Exception:
+        return default
+
 def is_admin():
     """檢查目前登入的使用者是否為管理員"""
     if 'user' not in st.session_state:
         return False
     return st.session_state.user.get('role') == 'admin'
 
+# ===== 畫面局部更新 (fragment) =====
+def rerun_fragment():
+    """只重新執行目前的 fragment；若不是在 fragment 重新執行期間 (例如測試環境)，改為整頁重新執行"""
+    try:
+        st.rerun(scope="fragment")
+    except st.errors.StreamlitAPIException:
+        st.rerun()
+
+def record_render_time(name, seconds):
+    """記錄區塊的繪製時間與次數 (存在 session_state，並計入效能量測)"""
+    record_span(f"render.{name}", seconds)
+    timings = st.session_state.setdefault('render_timings', {})
+    previous = timings.get(name, {})
+    timings[name] = {
+        'ms': seconds * 1000,
+        'count': previous.get('count', 0) + 1,
+        'at': datetime.now().strftime('%H:%M:%S'),
+    }
+
+def timed_fragment(name):
+    """把函式包成 st.fragment，並記錄每次繪製的時間"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                record_render_time(name, elapsed)
+                if st.session_state.get('show_render_timing'):
+                    count = st.session_state.render_timings[name]['count']
+                    st.caption(f"⏱️ {name}：{elapsed * 1000:.0f} ms (第 {count} 次繪製)")
+        return st.fragment(wrapper)
+    return decorator
+
+# ===== 效能量測 =====
+@st.cache_resource
+def get_metrics():
+    """
+    行程共用的效能紀錄 (各工作階段與背景執行緒共用)
+    durations 只保留每種操作最近的樣本，log 保留最近的結構化紀錄
+    """
+    return {
+        'lock': threading.Lock(),
+        'durations': {},   # 操作名稱 -> 最近的耗時 (毫秒)
+        'totals': {},      # 操作名稱 -> 累計次數、失敗數、位元組數
+        'api_calls': {},   # 'YYYY-MM-DD HH:MM' -> {服務: 呼叫數}
+        'log': deque(maxlen=METRIC_LOG_LIMIT),
+        'started_at': datetime.now(),
+    }
+
+def record_span(operation, seconds, nbytes=0, outcome='ok', service=None):
+    """記錄一次操作的耗時；service 為 Google API 名稱時同時計入每分鐘呼叫數"""
+    now = datetime.now()
+    entry = {
+        'ts': now.isoformat(timespec='milliseconds'),
+        'operation': operation,
+        'service': service,
+        'duration_ms': round(seconds * 1000, 3),
+        'bytes': int(nbytes or 0),
+        'outcome': outcome,
+    }
+    metrics = get_metrics()
+    with metrics['lock']:
+        samples = metrics['durations'].setdefault(operation, deque(maxlen=METRIC_SAMPLE_LIMIT))
+        samples.append(entry['duration_ms'])
+        totals = metrics['totals'].setdefault(operation, {'service': service, 'count': 0, 'errors': 0, 'bytes': 0})
+        totals['count'] += 1
+        totals['errors'] += outcome != 'ok'
+        totals['bytes'] += entry['bytes']
+        metrics['log'].append(entry)
+        
+        if service:
+            minute = now.strftime('%Y-%m-%d %H:%M')
+            api_calls = metrics['api_calls']
+            counts = api_calls.setdefault(minute, {})
+            counts[service] = counts.get(service, 0) + 1
+            # 依時間順序插入，超過保留分鐘數時移除最舊的
+            while len(api_calls) > API_CALL_HISTORY_MINUTES:
+                api_calls.pop(next(iter(api_calls)))
+
+@contextlib.contextmanager
+def timed_span(operation, service=None, nbytes=0):
+    """
+    量測一段程式的耗時並記錄
+    區塊內可修改 span['bytes'] 與 span['outcome']；發生例外時結果記為 error 並繼續拋出
+    """
+    span = {'bytes': nbytes, 'outcome': 'ok'}
+    start = time.perf_counter()
+    try:
+        yield span
+    except Exception:
+        if span['outcome'] == 'ok':
+            span['outcome'] = 'error'
+        raise
+    except BaseException:
+        # st.rerun / st.stop 以例外中斷執行，不算失敗
+        span['outcome'] = 'interrupted'
+        raise
+    finally:
+        record_span(operation, time.perf_counter() - start, span['bytes'], span['outcome'], service)
+
+def timed_operation(operation):
+    """裝飾器版的 timed_span；第一個參數是 bytes 時記錄其大小"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            nbytes = len(args[0]) if args and isinstance(args[0], (bytes, bytearray)) else 0
+            with timed_span(operation, nbytes=nbytes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def describe_api_request(service, method, url):
+    """由 HTTP 要求推出操作名稱，例如 sheets.batchGet、drive.download、drive.get"""
+    parts = urllib.parse.urlsplit(url)
+    last = parts.path.rstrip('/').rsplit('/', 1)[-1]
+    verb = last.rsplit(':', 1)[1] if ':' in last else ''
+    if verb[:1].islower():
+        action = verb   # Sheets 的 values:batchGet、:append、:batchUpdate (範圍的欄名是大寫)
+    elif 'alt=media' in parts.query:
+        action = 'download'
+    elif '/upload/' in parts.path:
+        action = 'upload'
+    elif parts.path.startswith('/batch'):
+        action = 'batch'
+    elif last == 'files' and method.upper() == 'GET':
+        action = 'list'
+    else:
+        action = method.lower()
+    return f"{service}.{action}"
+
+class InstrumentedHTTPClient(gspread.http_client.HTTPClient):
+    """gspread 的 HTTP 用戶端：每次呼叫 Sheets API 都記錄耗時、回應大小與結果"""
+    
+    def request(self, method, endpoint, params=None, data=None, json=None, files=None, headers=None):
+        with timed_span(describe_api_request('sheets', method, endpoint), service='sheets') as span:
+            try:
+                response = super().request(method, endpoint, params=params, data=data,
+                                           json=json, files=files, headers=headers)
+            except gspread.exceptions.APIError as e:
+                span['outcome'] = f"http_{e.response.status_code}"
+                raise
+            span['bytes'] = len(response.content)
+        return response
+
+class InstrumentedHttp:
+    """包住 httplib2 連線：每次呼叫 Drive API (含上傳、下載) 都記錄耗時、傳輸量與結果"""
+    
+    def __init__(self, http, service):
+        self._http = http
+        self._service = service
+    
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        with timed_span(describe_api_request(self._service, method, uri), service=self._service) as span:
+            resp, content = self._http.request(uri, method, body=body, headers=headers, **kwargs)
+            span['bytes'] = len(content or b'') + (len(body) if isinstance(body, (bytes, str)) else 0)
+            if resp.status >= 400:
+                span['outcome'] = f"http_{resp.status}"
+        return resp, content
+    
+    def __getattr__(self, name):
+        return getattr(self._http, name)
+
+def get_api_quotas():
+    """各服務每分鐘配額 (secrets 的 API_QUOTAS 可覆寫個別服務)"""
+    quotas = dict(API_QUOTAS_PER_MINUTE)
+    quotas.update(get_setting('API_QUOTAS', {}) or {})
+    return quotas
+
+def summarize_metrics():
+    """各操作的次數、失敗數、平均傳輸量與 p50 / p95 / p99 耗時 (毫秒)"""
+    metrics = get_metrics()
+    with metrics['lock']:
+        durations = {operation: list(samples) for operation, samples in metrics['durations'].items()}
+        totals = {operation: dict(values) for operation, values in metrics['totals'].items()}
+    
+    rows = []
+    for operation, samples in durations.items():
+        p50, p95, p99 = pd.Series(samples).quantile([0.5, 0.95, 0.99])
+        total = totals[operation]
+        rows.append({
+            '操作': operation,
+            '服務': total['service'] or '',
+            '次數': total['count'],
+            '失敗': total['errors'],
+            '平均 KB': total['bytes'] / total['count'] / 1024,
+            'p50 (ms)': p50,
+            'p95 (ms)': p95,
+            'p99 (ms)': p99,
+        })
+    if not rows:
+        return pd.DataFrame()
+    return pd.DataFrame(rows).sort_values('p95 (ms)', ascending=False).reset_index(drop=True)
+
+def get_api_calls_per_minute():
+    """每分鐘各服務的 API 呼叫數 (index 為分鐘，沒有呼叫的分鐘補 0)"""
+    metrics = get_metrics()
+    with metrics['lock']:
+        api_calls = {minute: dict(counts) for minute, counts in metrics['api_calls'].items()}
+    if not api_calls:
+        return pd.DataFrame(columns=list(get_api_quotas()))
+    
+    df = pd.DataFrame.from_dict(api_calls, orient='index')
+    df.index = pd.to_datetime(df.index)
+    full_range = pd.date_range(df.index.min(), datetime.now().replace(second=0, microsecond=0), freq='min')
+    return df.reindex(full_range).reindex(columns=list(get_api_quotas())).fillna(0).astype(int)
+
+def export_metrics_log():
+    """最近的量測紀錄，JSON Lines 格式 (每行一筆)"""
+    metrics = get_metrics()
+    with metrics['lock']:
+        entries = list(metrics['log'])
+    return '\n'.join(json.dumps(entry, ensure_ascii=False) for entry in entries) + '\n'
+
+def reset_metrics():
+    """清除所有量測資料"""
+    metrics = get_metrics()
+    with metrics['lock']:
+        metrics['durations'].clear()
+        metrics['totals'].clear()
+        metrics['api_calls'].clear()
+        metrics['log'].clear()
+        metrics['started_at'] = datetime.now()
+
 # ===== Google API 連線設定 =====
+@st.cache_resource
+def get_google_credentials():
+    """讀取服務帳號憑證"""
+    possible_paths = [
+        'credentials.json',
+        os.path.expanduser('~/credentials.json'),
+    ]
+    
+    for path in possible_paths:
+        if os.path.exists(path):
+            return Credentials.from_service_account_file(
+                path,
+                scopes=SCOPES
+            )
+    
+    if 'gcp_service_account' in st.secrets:
+        credentials_dict = dict(st.secrets['gcp_service_account'])
+        return Credentials.from_service_account_info(
+            credentials_dict,
+            scopes=SCOPES
+        )
+    
+    raise FileNotFoundError("找不到憑證檔案")
+
+@st.cache_resource
+def init_sheets_client():
+    """只初始化 Google Sheets 連線 (登入頁只需要這個)"""
+    try:
+        return gspread.authorize(get_google_credentials(), http_client=InstrumentedHTTPClient)
+    except Exception as e:
+        st.error(f"❌ Google API 連線失敗: {str(e)}")
+        st.stop()
+
+def build_drive_service(credentials):
+    """
+    建立 Drive API 服務
+    googleapiclient 延遲到這裡才載入，並使用套件內建的 discovery 文件，不連網抓取；
+    連線包上 InstrumentedHttp，每次呼叫都計入效能量測
+    """
+    from googleapiclient.discovery import build
+    from googleapiclient.http import build_http
+    from google_auth_httplib2 import AuthorizedHttp
+    http = InstrumentedHttp(AuthorizedHttp(credentials, http=build_http()), 'drive')
+    return build('drive', 'v3', http=http, static_discovery=True, cache_discovery=False)
+
 @st.cache_resource
 def init_google_services():
     """初始化 Google Services (Sheets & Drive)"""
     try:
-        import os
-        
-        possible_paths = [
-            'credentials.json',
-            os.path.expanduser('~/credentials.json'),
-        ]
-        
-        credentials = None
-        for path in possible_paths:
-            if os.path.exists(path):
-                credentials = Credentials.from_service_account_file(
-                    path,
-                    scopes=SCOPES
-                )
-                break
-        
-        if not credentials and 'gcp_service_account' in st.secrets:
-            credentials_dict = dict(st.secrets['gcp_service_account'])
-            credentials = Credentials.from_service_account_info(
-                credentials_dict,
-                scopes=SCOPES
-            )
-        
-        if not credentials:
-            raise FileNotFoundError("找不到憑證檔案")
-        
-        gc = gspread.authorize(credentials)
-        drive_service = build('drive', 'v3', credentials=credentials)
+        credentials = get_google_credentials()
+        gc = init_sheets_client()
+        drive_service = build_drive_service(credentials)
         
         return gc, drive_service, credentials
     
@@ -279,10 +711,15 @@ def init_google_services():
         st.stop()
 
 # ===== Google Sheets 操作 =====
+@st.cache_resource
+def open_spreadsheet(_gc, sheet_id):
+    """開啟 Google Spreadsheet (每個行程只開啟一次)"""
+    return _gc.open_by_key(sheet_id)
+
 def get_spreadsheet(gc, sheet_id):
     """取得 Google Spreadsheet"""
     try:
-        return gc.open_by_key(sheet_id)
+        return open_spreadsheet(gc, sheet_id)
     except Exception as e:
         st.error(f"❌ 無法開啟 Google Sheet: {str(e)}")
         return None
@@ -293,18 +730,21 @@ def init_all_sheets(_spreadsheet):
     import time
     
     # 取得所有現有工作表
-    existing_sheets = [ws.title for ws in _spreadsheet.worksheets()]
+    worksheets = _spreadsheet.worksheets()
+    existing_sheets = [ws.title for ws in worksheets]
     
     # 公文資料表
     if '公文資料' not in existing_sheets:
         doc_headers = ['ID', 'Date', 'Type', 'Agency', 'Subject', 'Parent_ID', 
                        'Drive_File_ID', 'Created_At', 'Created_By', 'Status',
-                       'OCR_Text', 'OCR_Status', 'OCR_Date']
+                       'OCR_Text', 'OCR_Status', 'OCR_Date', 'Root_ID', 'Depth']
         docs_sheet = _spreadsheet.add_worksheet(title='公文資料', rows=1000, cols=20)
         docs_sheet.append_row(doc_headers)
         time.sleep(0.5)  # 減少等待時間
     else:
         docs_sheet = _spreadsheet.worksheet('公文資料')
+        # 已分片時改用 ShardedWorksheet，欄位檢查與回填會套用到每個分片
+        docs_sheet = open_document_shards(_spreadsheet, docs_sheet, worksheets)
         # 檢查是否有 OCR 欄位,沒有就新增
         try:
             headers = docs_sheet.row_values(1)
@@ -314,8 +754,20 @@ def init_all_sheets(_spreadsheet):
                 docs_sheet.update_cell(1, next_col, 'OCR_Text')
                 docs_sheet.update_cell(1, next_col + 1, 'OCR_Status')
                 docs_sheet.update_cell(1, next_col + 2, 'OCR_Date')
+                get_sheet_headers.clear()
         except:
             pass
+        # 對話串欄位：新增後一次回填既有公文
+        try:
+            headers = docs_sheet.row_values(1)
+            if 'Root_ID' not in headers:
+                next_col = len(headers) + 1
+                docs_sheet.update_cell(1, next_col, 'Root_ID')
+                docs_sheet.update_cell(1, next_col + 1, 'Depth')
+                get_sheet_headers.clear()
+                backfill_thread_columns(docs_sheet)
+        except Exception as e:
+            print(f"回填對話串欄位失敗: {str(e)}")
     
     # 刪除紀錄表
     if '刪除紀錄' not in existing_sheets:
@@ -345,12 +797,28 @@ def init_all_sheets(_spreadsheet):
         users_sheet.append_row(default_admin)
     else:
         users_sheet = _spreadsheet.worksheet('使用者')
-    
-    return docs_sheet, deleted_sheet, users_sheet
 
-def get_all_documents(worksheet):
-    """從工作表讀取所有公文資料"""
+    # OCR 文字表（全文另存，公文資料表只保留狀態欄位）
+    if 'OCR文字' not in existing_sheets:
+        text_sheet = _spreadsheet.add_worksheet(title='OCR文字', rows=1000, cols=5)
+        text_sheet.append_row(OCR_TEXT_HEADERS)
+        time.sleep(0.5)  # 減少等待時間
+
+        # 第一次建立時，把公文資料表內既有的 OCR 文字搬過來
+        migrate_ocr_text_to_sidecar(docs_sheet, text_sheet)
+    else:
+        text_sheet = _spreadsheet.worksheet('OCR文字')
+
+    return docs_sheet, deleted_sheet, users_sheet, text_sheet
+
+def get_all_documents(worksheet, years=None):
+    """
+    從工作表讀取所有公文資料
+    years 為年度清單時，分片的公文資料只讀取這些年度的分片 (與日期無法解析的公文)
+    """
     try:
+        if years is not None and isinstance(worksheet, ShardedWorksheet):
+            worksheet = worksheet.for_years([''] + [str(year) for year in years])
         values = worksheet.get_all_values()
         if not values or len(values) <= 1:
             return pd.DataFrame(columns=['ID', 'Date', 'Type', 'Agency', 'Subject', 
@@ -366,248 +834,3251 @@ def get_all_documents(worksheet):
         st.error(f"讀取資料失敗: {str(e)}")
         return pd.DataFrame()
 
-def get_all_users(worksheet):
-    """從工作表讀取所有使用者"""
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_sheet_headers(_worksheet, worksheet_id):
+    """取得工作表標題列 (快取，worksheet_id 用來區分不同工作表)"""
+    return _worksheet.row_values(1)
+
+@functools.lru_cache(maxsize=None)
+def compact_string_dtype():
+    """
+    文字欄位使用的 dtype：以 Arrow 連續儲存，不必每格保留一個 Python 字串物件
+    pandas 3 的預設 str 已是 Arrow 字串；較舊版本明確指定 string[pyarrow]
+    """
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return 'str'
+    return 'string[pyarrow]'
+
+def read_document_rows(worksheet, columns, start_row=2):
+    """
+    用一次 batch_get 讀取指定欄位，從 start_row 列讀到最後一列
+    不過濾已刪除資料，列順序與工作表相同
+    """
+    present, ranges = _document_ranges(worksheet, columns, start_row)
+    results = worksheet.batch_get(ranges) if present else []
+    return _document_frame(columns, present, results)
+
+def _document_ranges(worksheet, columns, start_row):
+    """工作表中有的欄位與各欄從 start_row 讀到最後的範圍，回傳 (欄位串列, 範圍串列)"""
+    headers = get_sheet_headers(worksheet, worksheet.id)
+    present = [col for col in columns if col in headers]
+    ranges = []
+    for col in present:
+        letter = column_letter(headers.index(col) + 1)
+        ranges.append(f"{letter}{start_row}:{letter}")
+    return present, ranges
+
+def _document_frame(columns, present, results):
+    """把 batch_get 讀回的各欄組成資料框，工作表沒有的欄位補空字串"""
+    if not present:
+        return pd.DataFrame(columns=list(columns))
+    
+    # 各欄尾端的空白會被省略，補齊到相同長度
+    row_count = max((len(value_range) for value_range in results), default=0)
+    data = {}
+    for col, value_range in zip(present, results):
+        values = [row[0] if row else '' for row in value_range]
+        values += [''] * (row_count - len(values))
+        data[col] = values
+    
+    df = pd.DataFrame(data, columns=present, dtype=compact_string_dtype())
+    for col in columns:
+        if col not in df.columns:
+            df[col] = pd.Series([''] * len(df), dtype=compact_string_dtype())
+    return df[list(columns)]
+
+def get_documents(worksheet, columns):
+    """
+    依欄位投影讀取公文資料
+    只用一次 batch_get 抓取指定欄位，不傳輸其他欄位
+    """
     try:
-        values = worksheet.get_all_values()
-        if not values or len(values) <= 1:
-            return pd.DataFrame(columns=['Username', 'Password', 'Display_Name', 'Role', 'Created_At'])
-        headers = values[0]
-        data = values[1:]
-        return pd.DataFrame(data, columns=headers)
+        # 需要 Status 欄才能排除已刪除的公文
+        wanted = list(dict.fromkeys(list(columns) + ['Status']))
+        df = read_document_rows(worksheet, wanted)
+        
+        # 只顯示未刪除的資料
+        return df[df['Status'] != 'deleted']
     except Exception as e:
-        st.error(f"讀取使用者失敗: {str(e)}")
+        st.error(f"讀取資料失敗: {str(e)}")
         return pd.DataFrame()
 
-def generate_document_id(worksheet, date_str, is_reply, parent_id):
-    """生成流水號"""
+# ===== 公文分片 (依年度) =====
+def shard_title(year):
+    """年度分片工作表的名稱 (日期無法解析的公文留在 公文資料)"""
+    return f"{DOCUMENT_SHARD_PREFIX}{year}"
+
+def shard_year(date_value):
+    """公文日期所屬的分片年度 (YYYY)，日期無法解析時回傳空字串"""
     try:
-        df = get_all_documents(worksheet)
-        
-        if df.empty or 'ID' not in df.columns:
-            if not is_reply:
-                date_code = date_str.replace('-', '')
-                return f"金展詢{date_code}001"
+        return datetime.strptime(str(date_value)[:10], '%Y-%m-%d').strftime('%Y')
+    except ValueError:
+        return ''
+
+def shard_year_from_id(doc_id):
+    """由文號內的日期 (金展詢YYYYMMDD...、金展回NN金展詢YYYYMMDD...) 推測分片年度，推測不到時回傳空字串"""
+    for token in ''.join(ch if ch.isdigit() else ' ' for ch in str(doc_id)).split():
+        if len(token) >= 8 and shard_year(f"{token[:4]}-{token[4:6]}-{token[6:8]}"):
+            return token[:4]
+    return ''
+
+def delete_worksheet_rows(worksheet, row_nums):
+    """用一次 batch_update 刪除多列：相鄰的列合併成一個範圍，由下往上刪除 (上面的列號才不會位移)"""
+    ranges = []
+    for row_num in sorted(set(row_nums), reverse=True):
+        if ranges and ranges[-1][0] == row_num + 1:
+            ranges[-1][0] = row_num
+        else:
+            ranges.append([row_num, row_num])
+    if not ranges:
+        return
+    worksheet.spreadsheet.batch_update({'requests': [
+        {
+            'deleteDimension': {
+                'range': {
+                    'sheetId': worksheet.id,
+                    'dimension': 'ROWS',
+                    'startIndex': start - 1,
+                    'endIndex': end,
+                }
+            }
+        }
+        for start, end in ranges
+    ]})
+
+def delete_document_rows(docs_sheet, row_nums):
+    """刪除公文資料表的多列 (分片時依分片分組刪除)"""
+    if isinstance(docs_sheet, ShardedWorksheet):
+        docs_sheet.delete_rows_at(row_nums)
+    else:
+        delete_worksheet_rows(docs_sheet, row_nums)
+
+class ShardedWorksheet:
+    """
+    把依年度分片的公文工作表 (公文資料 + 公文資料_YYYY) 當成一張工作表使用
+    - 列號為各分片資料列依序串接的虛擬列號 (第 1 列為標題列，各分片的標題列相同)
+    - 讀取多個分片時平行讀取；新增的公文依日期寫入該年度的分片 (沒有時自動建立)
+    - 分片可以放在其他試算表 (Secrets 的 DOCUMENT_SHARD_SPREADSHEETS {年度: 試算表 ID})
+    只實作公文資料表用到的 gspread Worksheet 方法。各分片的列數記在 _counts，讀取整欄時順便更新；
+    增量同步則依分片各自記錄列數、比對尾端 (新增到較早年度的分片不會使後面的分片被判定為位移)
+    """
+
+    def __init__(self, base, shards, spreadsheets=None):
+        self.base = base
+        self.id = base.id
+        self.title = base.title
+        self.spreadsheet = base.spreadsheet
+        self.spreadsheet_id = base.spreadsheet_id
+        self._spreadsheets = dict(spreadsheets or {})   # {年度: 分片所在的試算表}
+        self._shards = [('', base)] + sorted(shards.items())
+        self._counts = None
+        self._lock = threading.RLock()
+
+    @property
+    def shards(self):
+        """[(年度, 工作表)]，日期無法解析的 公文資料 在最前面"""
+        return list(self._shards)
+
+    @property
+    def spreadsheet_ids(self):
+        """分片所在的所有試算表 ID (用來取得資料版本)"""
+        return list(dict.fromkeys([self.spreadsheet_id] + [ws.spreadsheet_id for _, ws in self._shards]))
+
+    def for_years(self, years):
+        """只包含指定年度分片的檢視 (依日期範圍讀取時只讀相關分片)，僅供讀取"""
+        years = set(years)
+        view = ShardedWorksheet(self.base, {year: ws for year, ws in self._shards[1:] if year in years},
+                                self._spreadsheets)
+        if '' not in years:
+            view._shards = view._shards[1:]
+        return view
+
+    # ----- 分片配置 -----
+    def _fan_out(self, func, indexes):
+        """對多個分片平行呼叫 func(分片索引)，回傳與 indexes 對應的結果"""
+        indexes = list(indexes)
+        if len(indexes) <= 1:
+            return [func(i) for i in indexes]
+        with ThreadPoolExecutor(max_workers=min(len(indexes), DOCUMENT_SHARD_WORKERS)) as executor:
+            return list(executor.map(func, indexes))
+
+    def _worksheet(self, index):
+        return self._shards[index][1]
+
+    def _id_column(self):
+        return get_sheet_headers(self.base, self.id).index('ID') + 1
+
+    def refresh_layout(self):
+        """重新讀取各分片的資料列數 (每個分片讀一次 ID 欄)"""
+        id_col = self._id_column()
+        lengths = self._fan_out(lambda i: len(self._worksheet(i).col_values(id_col)), range(len(self._shards)))
+        with self._lock:
+            self._counts = [max(length - 1, 0) for length in lengths]
+            return list(self._counts)
+
+    def _layout(self):
+        with self._lock:
+            if self._counts is not None:
+                return list(self._counts)
+        return self.refresh_layout()
+
+    def _set_count(self, index, count):
+        with self._lock:
+            if self._counts is not None:
+                self._counts[index] = max(count, 0)
+
+    @staticmethod
+    def _offsets(counts):
+        """各分片的位移：分片本地列號 r (r >= 2) 對應虛擬列號 offset + r - 1"""
+        offsets = []
+        offset = 1
+        for count in counts:
+            offsets.append(offset)
+            offset += count
+        return offsets
+
+    def _spans(self, start, end=None):
+        """
+        虛擬列 start..end (end 為 None 時到最後，start >= 2) 對應到各分片的
+        [(分片索引, 本地起始列, 本地結束列或 None, 對應的第一個虛擬列)]，超出已知列數的部分歸到最後一個分片
+        """
+        if start == 2 and end is None:
+            # 從第一筆資料讀到最後：每個分片都整段讀取，不需要知道列數
+            return [(i, 2, None, None) for i in range(len(self._shards))]
+        counts = self._layout()
+        offsets = self._offsets(counts)
+        last = len(counts) - 1
+        spans = []
+        for i, (offset, count) in enumerate(zip(offsets, counts)):
+            first, final = offset + 1, offset + count
+            if i != last and start > final:
+                continue
+            if end is not None and end < first:
+                break
+            virtual_start = max(start, first)
+            if end is None:
+                local_end = None
             else:
+                local_end = (end if i == last else min(end, final)) - offset + 1
+            spans.append((i, virtual_start - offset + 1, local_end, virtual_start))
+        return spans
+
+    def _shard_index(self, year, create=False):
+        """取得年度分片的索引；沒有時 create=True 就建立 (標題列同 公文資料)，否則回傳 None"""
+        with self._lock:
+            for i, (key, _) in enumerate(self._shards):
+                if key == year:
+                    return i
+            if not create:
                 return None
-        
-        if is_reply and parent_id:
-            # 計算該 parent_id 的回覆數量
-            reply_count = len(df[df['Parent_ID'].astype(str) == str(parent_id)])
-            new_reply_number = str(reply_count + 2).zfill(2)
-            doc_id = f"金展回{new_reply_number}{parent_id}"
-        else:
-            # 新發文:金展詢 + 日期 + 流水號
-            date_code = date_str.replace('-', '')
-            # 找出同一天所有以「金展詢+日期」開頭的公文
-            same_day_docs = df[
-                df['ID'].astype(str).str.startswith(f"金展詢{date_code}")
-            ]
-            next_serial = str(len(same_day_docs) + 1).zfill(3)
-            doc_id = f"金展詢{date_code}{next_serial}"
-        
-        return doc_id
-    except Exception as e:
-        date_code = date_str.replace('-', '')
-        return f"金展詢{date_code}001"
+            headers = get_sheet_headers(self.base, self.id)
+            spreadsheet = self._spreadsheets.get(year) or self.spreadsheet
+            try:
+                worksheet = spreadsheet.worksheet(shard_title(year))
+            except gspread.WorksheetNotFound:
+                worksheet = spreadsheet.add_worksheet(title=shard_title(year), rows=1000, cols=max(len(headers), 20))
+                worksheet.append_row(headers)
+            self._shards = sorted(self._shards + [(year, worksheet)], key=lambda item: item[0])
+            self._counts = None   # 分片順序改變，下次使用時重新讀取列數
+            return [key for key, _ in self._shards].index(year)
 
-def add_document_to_sheet(worksheet, doc_data):
-    """新增公文資料"""
-    try:
-        row = [
-            doc_data['id'],
-            doc_data['date'],
-            doc_data['type'],
-            doc_data['agency'],
-            doc_data['subject'],
-            doc_data['parent_id'] or '',
-            doc_data['drive_file_id'] or '',
-            doc_data['created_at'],
-            doc_data['created_by'],
-            'active',
-            '',  # OCR_Text (空白,稍後填入)
-            'pending',  # OCR_Status (待辨識)
-            ''  # OCR_Date (辨識完成後填入)
-        ]
-        worksheet.append_row(row)
-        return True
-    except Exception as e:
-        st.error(f"寫入失敗: {str(e)}")
-        return False
+    @staticmethod
+    def _parse(range_name):
+        """解析 A1 範圍，回傳 (起始列, 結束列或 None, 起始欄或 None, 結束欄或 None)，列與欄皆從 1 起算"""
+        grid = gspread.utils.a1_range_to_grid_range(range_name)
+        start_col = grid.get('startColumnIndex')
+        end_col = grid.get('endColumnIndex')
+        return (
+            grid.get('startRowIndex', 0) + 1,
+            grid.get('endRowIndex'),
+            start_col + 1 if start_col is not None else None,
+            end_col,
+        )
 
-def add_user_to_sheet(worksheet, user_data):
-    """新增使用者"""
-    try:
-        row = [
-            user_data['username'],
-            hash_password(user_data['password']),
-            user_data['display_name'],
-            user_data['role'],
-            datetime.now().isoformat()
+    @staticmethod
+    def _local_range(start_col, end_col, local_start, local_end):
+        if start_col is None:
+            return f"{local_start}:{local_end if local_end is not None else local_start}"
+        return (f"{column_letter(start_col)}{local_start}:"
+                f"{column_letter(end_col or start_col)}{local_end if local_end is not None else ''}")
+
+    def _split(self, range_name):
+        """把虛擬範圍拆成 [(分片索引, 本地範圍, 對應的第一個虛擬列)]；標題列套用到每個分片"""
+        start, end, start_col, end_col = self._parse(range_name)
+        if start == 1:
+            if end is not None and end > 1:
+                raise ValueError(f"不支援同時包含標題列與資料列的範圍: {range_name}")
+            return [(i, range_name, 1) for i in range(len(self._shards))]
+        return [
+            (i, self._local_range(start_col, end_col, local_start, local_end), virtual_start)
+            for i, local_start, local_end, virtual_start in self._spans(start, end)
         ]
-        worksheet.append_row(row)
-        return True
-    except Exception as e:
-        st.error(f"新增使用者失敗: {str(e)}")
-        return False
 
-def delete_user_from_sheet(worksheet, username):
-    """刪除使用者"""
-    try:
-        cell = worksheet.find(username)
-        if cell:
-            worksheet.delete_rows(cell.row)
-            return True
-        return False
-    except Exception as e:
-        st.error(f"刪除使用者失敗: {str(e)}")
-        return False
+    def _split_values(self, range_name, values):
+        """把要寫入虛擬範圍的值拆成 [(分片索引, 本地範圍, 該分片的值)]"""
+        start = self._parse(range_name)[0]
+        parts = []
+        for i, local, virtual_start in self._split(range_name):
+            rows = values if start == 1 else values[virtual_start - start:]
+            local_start, local_end = self._parse(local)[:2]
+            if local_end is not None:
+                rows = rows[:local_end - local_start + 1]
+            if rows:
+                parts.append((i, local, rows))
+        return parts
 
-def soft_delete_document(docs_sheet, deleted_sheet, doc_id, deleted_by):
-    """軟刪除公文（移到刪除紀錄）"""
-    try:
-        # 找到該筆資料
-        cell = docs_sheet.find(doc_id)
-        if not cell:
-            return False
-        
-        # 取得該列資料
-        row_data = docs_sheet.row_values(cell.row)
-        
-        # 新增到刪除紀錄表
-        deleted_row = row_data[:9] + [datetime.now().isoformat(), deleted_by]
-        deleted_sheet.append_row(deleted_row)
+    # ----- 讀取 -----
+    def row_values(self, row, **kwargs):
+        if row == 1:
+            return self.base.row_values(1, **kwargs)
+        (i, local_start, _, _), = self._spans(row, row)
+        return self._shards[i][1].row_values(local_start, **kwargs)
+
+    def col_values(self, col, **kwargs):
+        """各分片的整欄串接 (平行讀取)；讀的是 ID 欄時一併更新各分片列數"""
+        counts = self._layout()
+        results = self._fan_out(lambda i: self._worksheet(i).col_values(col, **kwargs), range(len(self._shards)))
+        is_id = col == self._id_column()
+        values = [results[0][0] if results and results[0] else '']
+        for i, result in enumerate(results):
+            data = list(result[1:])
+            if is_id:
+                self._set_count(i, len(data))
+            elif i < len(results) - 1:
+                data += [''] * (counts[i] - len(data))
+            values.extend(data)
+        while len(values) > 1 and values[-1] == '':
+            values.pop()
+        return values
+
+    def get_all_values(self, **kwargs):
+        """各分片的所有資料串接 (平行讀取)，並更新各分片列數"""
+        results = self._fan_out(lambda i: self._worksheet(i).get_all_values(**kwargs), range(len(self._shards)))
+        values = [results[0][0]] if results and results[0] else []
+        for i, result in enumerate(results):
+            self._set_count(i, len(result) - 1)
+            values.extend(result[1:])
+        return values
+
+    def batch_get(self, ranges, **kwargs):
+        """
+        讀取多個範圍：每個相關分片各一次 batch_get (平行)
+        整欄範圍 (例如 E2:E) 只讀取起始列之後的分片，並附帶讀取 ID 欄來對齊各分片的列數
+        """
+        id_letter = column_letter(self._id_column())
+        plans = []          # 每個範圍：[(分片索引, 資料在該分片請求中的位置, ID 欄的位置或 None, 本地起始列, 應有列數)]
+        requests = {}       # {分片索引: [本地範圍]}
+        for range_name in ranges:
+            start, end, start_col, end_col = self._parse(range_name)
+            parts = []
+            if start == 1:
+                # 標題列從 公文資料 讀取，其餘列照常分到各分片
+                local = requests.setdefault(0, [])
+                local.append(self._local_range(start_col, end_col, 1, 1))
+                parts.append((0, len(local) - 1, None, 1, 1))
+                start = 2
+                if end == 1:
+                    plans.append(parts)
+                    continue
+            for i, local_start, local_end, _ in self._spans(start, end):
+                local = requests.setdefault(i, [])
+                local.append(self._local_range(start_col, end_col, local_start, local_end))
+                position = len(local) - 1
+                align = None
+                if end is None:
+                    local.append(f"{id_letter}{local_start}:{id_letter}")
+                    align = len(local) - 1
+                expected = local_end - local_start + 1 if local_end is not None else None
+                parts.append((i, position, align, local_start, expected))
+            plans.append(parts)
+        
+        indexes = sorted(requests)
+        fetched = dict(zip(indexes, self._fan_out(
+            lambda i: self._worksheet(i).batch_get(requests[i], **kwargs), indexes
+        )))
+        
+        output = []
+        for parts in plans:
+            rows = []
+            for n, (i, position, align, local_start, expected) in enumerate(parts):
+                piece = [list(row) for row in fetched[i][position]]
+                if align is not None:
+                    expected = len(fetched[i][align])
+                    self._set_count(i, local_start - 2 + expected)
+                if n < len(parts) - 1:
+                    piece += [[] for _ in range(expected - len(piece))]
+                rows.extend(piece)
+            while rows and not rows[-1]:
+                rows.pop()
+            output.append(rows)
+        return output
+
+    def find(self, query, in_column=None, in_row=None, **kwargs):
+        """
+        在各分片尋找儲存格，回傳虛擬列號的 Cell
+        先找文號推測的年度分片，找不到再平行搜尋其餘分片
+        """
+        if in_row is not None:
+            raise ValueError("分片工作表不支援 in_row")
+        counts = self._layout()
+        hinted = self._shard_index(shard_year_from_id(query))
+        order = ([hinted] if hinted is not None else []) + [i for i in range(len(self._shards)) if i != hinted]
+        if not order:
+            return None
         
-        # 從公文資料表刪除該列
-        docs_sheet.delete_rows(cell.row)
+        def search(i):
+            return self._worksheet(i).find(query, in_column=in_column, **kwargs)
         
-        return True
-    except Exception as e:
-        st.error(f"刪除公文失敗: {str(e)}")
-        return False
+        for batch in ([order[0]], order[1:]):
+            for i, cell in zip(batch, self._fan_out(search, batch)):
+                if cell is not None and cell.row > 1:
+                    if cell.row - 1 > counts[i]:
+                        # 分片在這段期間變長了，重新讀取列數
+                        counts = self.refresh_layout()
+                    return gspread.cell.Cell(self._offsets(counts)[i] + cell.row - 1, cell.col, cell.value)
+        return None
 
-def get_deleted_documents(worksheet):
-    """從工作表讀取刪除紀錄"""
-    try:
-        values = worksheet.get_all_values()
-        if not values or len(values) <= 1:
-            return pd.DataFrame()
-        headers = values[0]
-        data = values[1:]
-        return pd.DataFrame(data, columns=headers)
-    except Exception as e:
-        st.error(f"讀取刪除紀錄失敗: {str(e)}")
-        return pd.DataFrame()
+    # ----- 寫入 -----
+    def update(self, values=None, range_name=None, **kwargs):
+        """更新範圍：跨分片時拆成各分片的 update"""
+        for i, local, rows in self._split_values(range_name, values):
+            self._worksheet(i).update(values=rows, range_name=local, **kwargs)
+
+    def update_cell(self, row, col, value):
+        self.update([[value]], gspread.utils.rowcol_to_a1(row, col))
+
+    def batch_update(self, data, **kwargs):
+        """批次更新多個範圍：每個分片一次 batch_update"""
+        requests = {}
+        for item in data:
+            for i, local, rows in self._split_values(item['range'], item['values']):
+                requests.setdefault(i, []).append({'range': local, 'values': rows})
+        for i, items in sorted(requests.items()):
+            self._worksheet(i).batch_update(items, **kwargs)
+
+    def batch_clear(self, ranges):
+        """清除多個範圍：每個分片一次 batch_clear"""
+        requests = {}
+        for range_name in ranges:
+            for i, local, _ in self._split(range_name):
+                requests.setdefault(i, []).append(local)
+        for i, local_ranges in sorted(requests.items()):
+            self._worksheet(i).batch_clear(local_ranges)
+
+    def append_row(self, values, **kwargs):
+        self.append_rows([values], **kwargs)
+
+    def append_rows(self, values, **kwargs):
+        """依 Date 欄把新列寫入各年度分片 (每個分片一次 append_rows)"""
+        date_index = get_sheet_headers(self.base, self.id).index('Date')
+        groups = {}
+        for row in values:
+            year = shard_year(row[date_index]) if len(row) > date_index else ''
+            groups.setdefault(year, []).append(row)
+        for year, rows in sorted(groups.items()):
+            i = self._shard_index(year, create=True)
+            self._worksheet(i).append_rows(rows, **kwargs)
+            with self._lock:
+                if self._counts is not None:
+                    self._counts[i] += len(rows)
+
+    def delete_rows_at(self, row_nums):
+        """刪除多個虛擬列：依分片分組，每個分片一次 batch_update"""
+        counts = self._layout()
+        groups = {}
+        for row_num in row_nums:
+            (i, local_row, _, _), = self._spans(row_num, row_num)
+            groups.setdefault(i, []).append(local_row)
+        for i, local_rows in groups.items():
+            delete_worksheet_rows(self._worksheet(i), local_rows)
+            self._set_count(i, counts[i] - len(set(local_rows)))
+
+def open_document_shards(spreadsheet, docs_sheet, worksheets):
+    """
+    公文資料已分片 (有 公文資料_YYYY 工作表、設定了 DOCUMENT_SHARD_SPREADSHEETS 或 DOCUMENT_SHARDING)
+    時回傳 ShardedWorksheet，否則直接回傳 公文資料 工作表
+    """
+    external = {str(year): sheet_id for year, sheet_id in (get_setting('DOCUMENT_SHARD_SPREADSHEETS', {}) or {}).items()}
+    shards = {}
+    for worksheet in worksheets:
+        year = worksheet.title[len(DOCUMENT_SHARD_PREFIX):]
+        if worksheet.title.startswith(DOCUMENT_SHARD_PREFIX) and len(year) == 4 and year.isdigit():
+            shards[year] = worksheet
+    
+    spreadsheets = {}
+    for year, sheet_id in external.items():
+        spreadsheets[year] = open_spreadsheet(init_sheets_client(), sheet_id)
+        try:
+            shards[year] = spreadsheets[year].worksheet(shard_title(year))
+        except gspread.WorksheetNotFound:
+            pass   # 第一次寫入該年度時建立
+    
+    if not shards and not external and not get_setting('DOCUMENT_SHARDING', False):
+        return docs_sheet
+    return ShardedWorksheet(docs_sheet, shards, spreadsheets)
+
+def get_documents_revision(drive_service, docs_sheet):
+    """公文資料的版本：分片在多個試算表時合併各試算表的版本，任一取得失敗時回傳 None"""
+    spreadsheet_ids = getattr(docs_sheet, 'spreadsheet_ids', [docs_sheet.spreadsheet_id])
+    revisions = [get_sheet_revision(drive_service, spreadsheet_id) for spreadsheet_id in spreadsheet_ids]
+    if any(revision is None for revision in revisions):
+        return None
+    return ','.join(revisions)
+
+def migrate_documents_to_shards(docs_sheet):
+    """
+    把 公文資料 內日期可解析的公文搬到各年度分片 (公文資料_YYYY，依設定可放在其他試算表)
+    先寫入分片 (分片中已有的文號以 公文資料 的內容覆寫)，全部寫入後重新定位、確認內容沒變才從 公文資料 刪除，
+    中途失敗或期間有人修改時可以重新執行
+    回傳 {年度: 搬移筆數}
+    """
+    base = docs_sheet.base if isinstance(docs_sheet, ShardedWorksheet) else docs_sheet
+    if isinstance(docs_sheet, ShardedWorksheet):
+        sharded = docs_sheet
+    else:
+        worksheets = base.spreadsheet.worksheets()
+        sharded = open_document_shards(base.spreadsheet, base, worksheets)
+        if not isinstance(sharded, ShardedWorksheet):
+            sharded = ShardedWorksheet(base, {})
+    
+    values = base.get_all_values()
+    if len(values) <= 1:
+        return {}
+    headers = values[0]
+    id_index = headers.index('ID')
+    date_index = headers.index('Date')
+    
+    groups = {}
+    for row_num, row in enumerate(values[1:], start=2):
+        year = shard_year(row[date_index]) if len(row) > date_index else ''
+        if year:
+            groups.setdefault(year, []).append((row_num, row))
+    
+    moved = {}
+    for year, items in sorted(groups.items()):
+        index = sharded._shard_index(year, create=True)
+        worksheet = sharded.shards[index][1]
+        existing = {
+            value: row_num for row_num, value in enumerate(worksheet.col_values(id_index + 1), start=1) if row_num > 1
+        }
+        rows, updates = [], []
+        for _, row in items:
+            row = row + [''] * (len(headers) - len(row))
+            if row[id_index] in existing:
+                shard_row = existing[row[id_index]]
+                updates.append({'range': f"A{shard_row}:{column_letter(len(headers))}{shard_row}", 'values': [row]})
+            else:
+                rows.append(row)
+        if updates:
+            worksheet.batch_update(updates, value_input_option='RAW')
+        if rows:
+            worksheet.append_rows(rows, value_input_option='RAW')
+        moved[year] = len(items)
+    
+    # 寫入分片期間列號可能已位移，刪除前重新定位並確認內容沒變
+    located = {row[id_index]: (row_num, row) for items in groups.values() for row_num, row in items}
+    delete_worksheet_rows(base, relocate_document_rows(base, located))
+    
+    # 工作表結構改變：重新開啟工作表，下次同步完整重載
+    # (背景核對副本與自動封存每次都透過 init_all_sheets 取得工作表，下一輪起就會使用分片)
+    init_all_sheets.clear()
+    get_sheet_headers.clear()
+    state = get_document_sync_state()
+    with state['lock']:
+        state['df'] = None
+    return moved
+
+# ===== 公文資料增量同步 =====
+@st.cache_resource
+def get_document_sync_state():
+    """
+    行程共用的公文同步狀態
+    df 保留工作表的原始列順序 (含已刪除列)，第 i 筆對應工作表第 i + 2 列；
+    分片工作表依分片順序串接，segments 記錄各分片在 df 中的列數
+    """
+    return {
+        'lock': threading.Lock(),
+        'df': None,
+        'columns': None,
+        'revision': None,     # Drive 檔案版本
+        'local_edits': 0,     # 本行程寫入造成、已套用到 df 的修改次數
+        'sheet_writes': 0,    # 本行程寫入其他工作表 (使用者、OCR文字…) 的次數
+        'generation': 0,      # 完整重載的次數 (副本據此判斷是否要整表重建)
+        'segments': None,     # [(分片年度, 列數)]，一般工作表只有一段
+        'appended_ids': [],   # 上次完整重載後，增量同步合併進 df 的文號 (依合併順序)
+        'checked_at': 0.0,
+        'loaded_at': 0.0,
+        'typed': None,        # 由 df 建立的型別化資料框 (僅未刪除的公文)
+        'typed_source': None, # typed 是由哪一份 df 建立的
+    }
+
+def get_sheet_revision(drive_service, spreadsheet_id):
+    """取得試算表在 Drive 上的版本號 (任何修改都會遞增)，失敗時回傳 None"""
+    try:
+        file = drive_service.files().get(
+            fileId=spreadsheet_id,
+            fields='version',
+            supportsAllDrives=True
+        ).execute()
+        return file.get('version')
+    except Exception as e:
+        print(f"取得試算表版本失敗: {str(e)}")
+        return None
+
+def document_segments(docs_sheet):
+    """增量同步的區段：分片工作表為各分片 [(年度, 工作表)]，一般工作表只有一段"""
+    if isinstance(docs_sheet, ShardedWorksheet):
+        return docs_sheet.shards
+    return [('', docs_sheet)]
+
+def read_document_segments(docs_sheet, columns, start_rows):
+    """
+    從各區段的 start_rows (本地列號) 讀到最後，回傳各區段的資料框
+    分片時平行讀取；資料框在目前的執行緒建立 (延遲載入的 pandas 不能在多個執行緒同時第一次載入)
+    """
+    segments = document_segments(docs_sheet)
+    plans = [_document_ranges(worksheet, columns, start) for (_, worksheet), start in zip(segments, start_rows)]
+    
+    def fetch(index):
+        present, ranges = plans[index]
+        return segments[index][1].batch_get(ranges) if present else []
+    
+    if isinstance(docs_sheet, ShardedWorksheet):
+        results = docs_sheet._fan_out(fetch, range(len(segments)))
+    else:
+        results = [fetch(0)]
+    return [_document_frame(columns, present, result) for (present, _), result in zip(plans, results)]
+
+def _full_reload(state, docs_sheet, columns, revision):
+    """完整重載 (各區段從第 2 列讀起)"""
+    segments = document_segments(docs_sheet)
+    frames = read_document_segments(docs_sheet, columns, [2] * len(segments))
+    state['segments'] = [(key, len(frame)) for (key, _), frame in zip(segments, frames)]
+    _reset_sync_state(state, pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0],
+                      columns, revision)
+
+def _reset_sync_state(state, df, columns, revision):
+    """完整重載後更新同步狀態"""
+    state['df'] = df.reset_index(drop=True)
+    state['columns'] = columns
+    state['revision'] = revision
+    state['local_edits'] = 0
+    state['sheet_writes'] = 0
+    state['generation'] += 1
+    state['appended_ids'] = []
+    state['checked_at'] = time.time()
+    state['loaded_at'] = time.time()
+
+def _same_rows(left, right):
+    """比對兩段公文列的內容是否相同 (缺值視為空字串)"""
+    if len(left) != len(right):
+        return False
+    left = left.fillna('').astype(str).reset_index(drop=True)
+    right = right[left.columns].fillna('').astype(str).reset_index(drop=True)
+    return bool((left.values == right.values).all())
+
+def note_sheet_write():
+    """本行程寫入公文資料以外的工作表後呼叫，讓同步時可以解釋版本號的變動"""
+    state = get_document_sync_state()
+    with state['lock']:
+        state['sheet_writes'] += 1
+
+def sync_documents(docs_sheet, drive_service, force_full=False):
+    """
+    增量同步公文資料表，回傳快取的原始資料框 (含已刪除列)
+    
+    - 版本沒變：直接使用快取 (一次 Drive 查詢)
+    - 版本有變：每個區段 (分片) 重讀已知的最後 SYNC_VERIFY_ROWS 列加上新增的列，
+      重讀的列與快取完全相同時只合併新增的列 (新增到較早年度的分片也不必重載)
+    - 重讀的列對不上 (有列被刪除、插入或修改)，或版本變了卻沒有新列、
+      本行程也沒有寫入 (有人直接修改較舊的儲存格)，才完整重載
+    - 本行程寫入其他工作表也會改變版本，只要比對通過就不重載
+    """
+    state = get_document_sync_state()
+    
+    with state['lock']:
+        now = time.time()
+        headers = get_sheet_headers(docs_sheet, docs_sheet.id)
+        # OCR 文字另存於 OCR文字 表，不納入同步
+        columns = [col for col in headers if col and col != 'OCR_Text']
+        cached = state['df']
+        
+        needs_full = (
+            force_full
+            or cached is None
+            or state['columns'] != columns
+            or now - state['loaded_at'] > SYNC_FULL_RELOAD_INTERVAL
+        )
+        
+        if not needs_full and now - state['checked_at'] < SYNC_CHECK_INTERVAL:
+            return cached
+        
+        revision = get_documents_revision(drive_service, docs_sheet)
+        
+        segments = document_segments(docs_sheet)
+        if not needs_full and [key for key, _ in segments] != [key for key, _ in state['segments']]:
+            needs_full = True   # 分片增加或改變
+        
+        if needs_full:
+            _full_reload(state, docs_sheet, columns, revision)
+            return state['df']
+        
+        state['checked_at'] = now
+        if revision is not None and revision == state['revision']:
+            return cached
+        
+        # 每個區段從已知尾端往前 verify 列開始讀 (第 1 列是標題，至少從第 2 列開始)
+        counts = [count for _, count in state['segments']]
+        verifies = [min(count, SYNC_VERIFY_ROWS) for count in counts]
+        tails = read_document_segments(
+            docs_sheet, columns, [count - verify + 2 for count, verify in zip(counts, verifies)]
+        )
+        
+        anchor_ok = True
+        pieces = []
+        added = []
+        offset = 0
+        for count, verify, tail in zip(counts, verifies, tails):
+            window = tail.iloc[:verify]
+            expected = cached.iloc[offset + count - verify:offset + count]
+            anchor_ok = anchor_ok and len(window) == verify and _same_rows(window, expected)
+            pieces.append(cached.iloc[offset:offset + count])
+            pieces.append(tail.iloc[verify:])
+            added.append(len(tail) - verify)
+            offset += count
+        
+        writes = state['local_edits'] + state['sheet_writes']
+        explained = sum(added) > 0 or writes > 0 or revision is None
+        if not anchor_ok or not explained:
+            _full_reload(state, docs_sheet, columns, revision)
+            return state['df']
+        
+        if sum(added) > 0:
+            if not any(added[:-1]):
+                # 只有最後一個區段有新列：直接接在快取後面
+                state['df'] = pd.concat([cached, pieces[-1]], ignore_index=True)
+            else:
+                state['df'] = pd.concat(pieces, ignore_index=True)
+            state['segments'] = [(key, count + extra) for (key, count), extra in zip(state['segments'], added)]
+            state['appended_ids'] = state['appended_ids'] + [
+                doc_id for piece in pieces[1::2] for doc_id in piece['ID']
+            ]
+        state['revision'] = revision
+        state['local_edits'] = 0
+        state['sheet_writes'] = 0
+        return state['df']
+
+def get_synced_documents(docs_sheet, drive_service, columns):
+    """
+    從增量同步的快取取出指定欄位 (排除已刪除的公文)
+    回傳型別化資料框：要求的日期欄位會一併附上解析後的 *_Parsed 欄位
+    """
+    try:
+        df = get_typed_documents(docs_sheet, drive_service)
+        wanted = list(dict.fromkeys(list(columns) + ['Status']))
+        wanted += [DATE_COLUMNS[col] for col in wanted if col in DATE_COLUMNS]
+        for col in wanted:
+            if col not in df.columns:
+                df = df.assign(**{col: ''})
+        return df[wanted]
+    except Exception as e:
+        st.error(f"讀取資料失敗: {str(e)}")
+        return pd.DataFrame()
+
+# ===== 型別化公文資料框 =====
+def build_typed_documents(df):
+    """
+    把工作表讀出的字串資料框轉成型別化資料框
+    - 日期欄位解析一次，存成 datetime 的 *_Parsed 欄位 (原字串欄位保留供顯示)
+    - 類型、機關、狀態等重複值多的欄位轉成 category
+    - Parent_ID 統一為去除空白的字串 (沒有上層公文時為空字串)
+    其餘欄位不複製，與傳入的資料框共用同一份 Arrow 字串資料
+    """
+    typed = df if df.index.equals(pd.RangeIndex(len(df))) else df.reset_index(drop=True)
+    new_columns = {}
+    
+    for col, parsed_col in DATE_COLUMNS.items():
+        if col in typed.columns:
+            new_columns[parsed_col] = pd.to_datetime(typed[col], errors='coerce', format='ISO8601')
+    
+    for col in CATEGORY_COLUMNS:
+        if col in typed.columns:
+            new_columns[col] = typed[col].fillna('').astype(compact_string_dtype()).astype('category')
+    
+    if 'Parent_ID' in typed.columns:
+        new_columns['Parent_ID'] = typed['Parent_ID'].fillna('').astype(compact_string_dtype()).str.strip()
+    
+    return typed.assign(**new_columns)
+
+def get_typed_documents(docs_sheet, drive_service):
+    """取得目前快照的型別化資料框 (排除已刪除的公文)，每份快照只建立一次"""
+    df = sync_documents(docs_sheet, drive_service)
+    state = get_document_sync_state()
+    
+    with state['lock']:
+        if state['typed_source'] is not df:
+            # 刪除的公文通常已從工作表移除，沒有標記刪除的列時不必另外篩出一份副本
+            active = df
+            if 'Status' in df.columns:
+                deleted_mask = df['Status'] == 'deleted'
+                if deleted_mask.any():
+                    active = df[~deleted_mask]
+            state['typed'] = build_typed_documents(active)
+            state['typed_source'] = df
+        return state['typed']
+
+def days_since(value, today=None):
+    """計算距今天數，value 可為解析後的日期或 YYYY-MM-DD 字串，無法解析時回傳 None"""
+    if not isinstance(value, (datetime, pd.Timestamp)):
+        value = pd.to_datetime(value, errors='coerce', format='ISO8601')
+    if pd.isna(value):
+        return None
+    return ((today or datetime.now()) - value).days
+
+def note_document_write(doc_id=None, updates=None, deleted=False, row=None):
+    """
+    本行程寫入公文資料表後呼叫，把修改套用到同步快取與本機副本
+    新增列 (row) 不需更新同步快取 (下次同步會從尾端讀到)；修改或刪除則直接更新快取，
+    讓版本號的變動可以被解釋，不必完整重載
+    """
+    if row is not None:
+        replica_insert('documents', row)
+        note_reply_queue_added(row)
+    elif deleted:
+        removed = get_document_replica(doc_id)
+        replica_delete('documents', 'ID', doc_id)
+        if removed:
+            note_reply_queue_removed(removed)
+    elif doc_id is not None and updates:
+        tracked = set(updates) & set(REPLY_QUEUE_COLUMNS)
+        previous = get_document_replica(doc_id) if tracked else None
+        replica_update('documents', 'ID', doc_id, updates)
+        if previous:
+            note_reply_queue_removed(previous)
+            note_reply_queue_added(get_document_replica(doc_id) or {**previous, **updates})
+    
+    state = get_document_sync_state()
+    with state['lock']:
+        df = state['df']
+        state['checked_at'] = 0.0
+        if df is None or doc_id is None:
+            return
+        
+        matches = df.index[df['ID'] == doc_id]
+        if len(matches) == 0:
+            return
+        
+        if deleted:
+            position = df.index.get_loc(matches[0])
+            df = df.drop(matches[:1]).reset_index(drop=True)
+            # 被刪除的列所在的區段少一列
+            segments = list(state['segments'] or [])
+            start = 0
+            for i, (key, count) in enumerate(segments):
+                if position < start + count:
+                    segments[i] = (key, count - 1)
+                    break
+                start += count
+            state['segments'] = segments
+        elif updates:
+            # 只複製被修改的欄位，其餘欄位與舊快照共用
+            df = df.copy(deep=False)
+            position = df.index.get_loc(matches[0])
+            for col, value in updates.items():
+                if col in df.columns:
+                    column = df[col].copy()
+                    column.iloc[position] = value
+                    df[col] = column
+        
+        state['df'] = df
+        state['local_edits'] += 1
+
+# ===== 本機 SQLite 副本 =====
+@st.cache_resource
+def get_replica():
+    """
+    開啟本機 SQLite 副本 (公文資料、刪除紀錄、使用者)
+    所有存取都透過 lock，同一個連線可在背景執行緒共用
+    """
+    path = get_setting('REPLICA_PATH', REPLICA_PATH)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return {
+        'conn': conn,
+        'lock': threading.Lock(),
+        'docs_source': None,   # 上次寫入副本的同步資料框
+        'docs_generation': None,  # docs_source 屬於第幾次完整重載
+        'docs_appended': 0,    # 已寫入副本的增量新列數
+        'revision': None,      # 上次核對刪除紀錄、使用者時的試算表版本
+        'synced_at': 0.0,
+    }
+
+def _quote(name):
+    """SQLite 欄位名稱加上引號"""
+    return '"' + name.replace('"', '""') + '"'
+
+def _replace_table(conn, table, df):
+    """以資料框整個取代副本中的資料表並重建索引 (需在 lock 內呼叫)"""
+    columns = [col for col in df.columns if col]
+    with conn:
+        if table == 'documents':
+            conn.execute('DROP TABLE IF EXISTS documents_index')
+            conn.execute('DROP TABLE IF EXISTS document_facets')
+        conn.execute(f'DROP TABLE IF EXISTS {table}')
+        if not columns:
+            return
+        conn.execute(f'CREATE TABLE {table} ({", ".join(_quote(col) + " TEXT" for col in columns)})')
+        if not df.empty:
+            placeholders = ', '.join('?' for _ in columns)
+            conn.executemany(
+                f'INSERT INTO {table} VALUES ({placeholders})',
+                df[columns].astype(str).itertuples(index=False, name=None)
+            )
+        for col in REPLICA_INDEXES.get(table, []):
+            if col in columns:
+                conn.execute(f'CREATE INDEX idx_{table}_{col.lower()} ON {table} ({_quote(col)})')
+        # 沒有統計資訊時，查詢規劃器可能選擇只有幾種值的 Type 索引而非 Parent_ID 索引
+        # (待回覆查詢在十萬筆時會變成逐筆掃描)
+        conn.execute(f'ANALYZE {table}')
+        if table == 'documents':
+            _create_document_index(conn, columns)
+            _create_facet_table(conn, columns)
+
+def _create_document_index(conn, columns):
+    """
+    建立公文的全文索引 (FTS5 trigram，可查詢任意子字串)
+    以觸發程序跟著 documents 的新增、修改、刪除同步更新，不需要重建
+    SQLite 未編入 FTS5 時略過，查詢會改用 LIKE
+    """
+    indexed = [col for col in DOCUMENT_INDEX_COLUMNS if col in columns]
+    if len(indexed) != len(DOCUMENT_INDEX_COLUMNS):
+        return
+    
+    fields = ', '.join(indexed)
+    new_values = ', '.join(f'new.{col}' for col in indexed)
+    old_values = ', '.join(f'old.{col}' for col in indexed)
+    try:
+        conn.execute(
+            f"CREATE VIRTUAL TABLE documents_index USING fts5({fields}, "
+            f"content='documents', tokenize='trigram')"
+        )
+    except sqlite3.OperationalError as e:
+        print(f"無法建立全文索引: {str(e)}")
+        return
+    
+    conn.execute(
+        f"CREATE TRIGGER documents_index_insert AFTER INSERT ON documents BEGIN "
+        f"INSERT INTO documents_index(rowid, {fields}) VALUES (new.rowid, {new_values}); END"
+    )
+    conn.execute(
+        f"CREATE TRIGGER documents_index_delete AFTER DELETE ON documents BEGIN "
+        f"INSERT INTO documents_index(documents_index, rowid, {fields}) "
+        f"VALUES ('delete', old.rowid, {old_values}); END"
+    )
+    conn.execute(
+        f"CREATE TRIGGER documents_index_update AFTER UPDATE ON documents BEGIN "
+        f"INSERT INTO documents_index(documents_index, rowid, {fields}) "
+        f"VALUES ('delete', old.rowid, {old_values}); "
+        f"INSERT INTO documents_index(rowid, {fields}) VALUES (new.rowid, {new_values}); END"
+    )
+    conn.execute("INSERT INTO documents_index(documents_index) VALUES ('rebuild')")
+
+def _create_facet_table(conn, columns):
+    """
+    建立分面統計的彙總表：每種 (機關, 類型, 年月, 辨識狀態, 是否為原始公文) 組合的公文數
+    以觸發程序隨 documents 的新增、修改、刪除增減，不必重新掃描
+    """
+    if not {'Agency', 'Type', 'Date', 'OCR_Status', 'Parent_ID'} <= set(columns):
+        return
+    
+    def key_values(prefix):
+        return (
+            f"COALESCE({prefix}.Agency, ''), COALESCE({prefix}.Type, ''), "
+            f"substr(COALESCE({prefix}.Date, ''), 1, 7), "
+            f"substr(COALESCE({prefix}.OCR_Status, ''), 1, instr(COALESCE({prefix}.OCR_Status, '') || ' ', ' ') - 1), "
+            f"(COALESCE({prefix}.Parent_ID, '') = '')"
+        )
+    
+    def add(prefix):
+        return (
+            f"INSERT INTO document_facets VALUES ({key_values(prefix)}, 1) "
+            f"ON CONFLICT (Agency, Type, Month, OCR_Status, Is_Root) "
+            f"DO UPDATE SET Doc_Count = Doc_Count + 1;"
+        )
+    
+    def remove(prefix):
+        return (
+            f"UPDATE document_facets SET Doc_Count = Doc_Count - 1 "
+            f"WHERE (Agency, Type, Month, OCR_Status, Is_Root) = ({key_values(prefix)}); "
+            f"DELETE FROM document_facets WHERE Doc_Count <= 0;"
+        )
+    
+    conn.execute(
+        'CREATE TABLE document_facets (Agency TEXT, Type TEXT, Month TEXT, OCR_Status TEXT, '
+        'Is_Root INTEGER, Doc_Count INTEGER, UNIQUE (Agency, Type, Month, OCR_Status, Is_Root))'
+    )
+    conn.execute(
+        f'INSERT INTO document_facets SELECT {key_values("d")}, COUNT(*) FROM documents d '
+        f'GROUP BY 1, 2, 3, 4, 5'
+    )
+    conn.execute(f'CREATE TRIGGER document_facets_insert AFTER INSERT ON documents BEGIN {add("new")} END')
+    conn.execute(f'CREATE TRIGGER document_facets_delete AFTER DELETE ON documents BEGIN {remove("old")} END')
+    conn.execute(
+        f'CREATE TRIGGER document_facets_update AFTER UPDATE OF Agency, Type, Date, OCR_Status, Parent_ID '
+        f'ON documents BEGIN {remove("old")} {add("new")} END'
+    )
+
+def _table_columns(conn, table):
+    """取得副本資料表的欄位 (資料表不存在時回傳空串列)"""
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+def replica_insert(table, row):
+    """寫入一筆資料到副本 (只寫入副本已有的欄位)"""
+    replica = get_replica()
+    with replica['lock']:
+        conn = replica['conn']
+        columns = [col for col in _table_columns(conn, table) if col in row]
+        if not columns:
+            return
+        if table == 'documents' and 'Row_Num' in _table_columns(conn, table):
+            next_row = conn.execute('SELECT COALESCE(MAX(CAST(Row_Num AS INTEGER)), -1) + 1 FROM documents').fetchone()[0]
+            row = {**row, 'Row_Num': str(next_row)}
+            columns.append('Row_Num')
+        with conn:
+            conn.execute(
+                f'INSERT INTO {table} ({", ".join(_quote(col) for col in columns)}) '
+                f'VALUES ({", ".join("?" for _ in columns)})',
+                [str(row[col]) for col in columns]
+            )
+
+def replica_upsert(table, key_col, df):
+    """把多筆資料寫入副本，同 key 的舊資料先刪除 (只寫入副本已有的欄位)"""
+    if df.empty:
+        return
+    replica = get_replica()
+    with replica['lock']:
+        conn = replica['conn']
+        existing = _table_columns(conn, table)
+        columns = [col for col in df.columns if col in existing]
+        if key_col not in columns:
+            return
+        values = df[columns].astype(str)
+        with conn:
+            conn.executemany(f'DELETE FROM {table} WHERE {_quote(key_col)} = ?', ((key,) for key in values[key_col]))
+            conn.executemany(
+                f'INSERT INTO {table} ({", ".join(_quote(col) for col in columns)}) '
+                f'VALUES ({", ".join("?" for _ in columns)})',
+                values.itertuples(index=False, name=None)
+            )
+
+def replica_update(table, key_col, key, updates):
+    """更新副本中的一筆資料"""
+    replica = get_replica()
+    with replica['lock']:
+        conn = replica['conn']
+        existing = _table_columns(conn, table)
+        columns = [col for col in updates if col in existing]
+        if not columns:
+            return
+        with conn:
+            conn.execute(
+                f'UPDATE {table} SET {", ".join(_quote(col) + " = ?" for col in columns)} '
+                f'WHERE {_quote(key_col)} = ?',
+                [str(updates[col]) for col in columns] + [key]
+            )
+
+def replica_delete(table, key_col, key):
+    """從副本刪除資料"""
+    replica = get_replica()
+    with replica['lock']:
+        conn = replica['conn']
+        if key_col not in _table_columns(conn, table):
+            return
+        with conn:
+            conn.execute(f'DELETE FROM {table} WHERE {_quote(key_col)} = ?', [key])
+
+def query_replica(sql, params=()):
+    """在副本上執行查詢，回傳 DataFrame"""
+    replica = get_replica()
+    with replica['lock']:
+        cursor = replica['conn'].execute(sql, params)
+        columns = [desc[0] for desc in cursor.description]
+        rows = cursor.fetchall()
+    return pd.DataFrame(rows, columns=columns)
+
+def _sheet_values_to_frame(values):
+    """get_all_values 的結果轉成 DataFrame"""
+    if not values:
+        return pd.DataFrame()
+    return pd.DataFrame(values[1:], columns=values[0])
+
+def _active_documents(docs_df):
+    """副本只保留未刪除的公文，Row_Num 記錄在工作表中的順序"""
+    active = docs_df.assign(Row_Num=docs_df.index.astype(str))
+    return active[active['Status'] != 'deleted']
+
+def refresh_replica(docs_sheet, deleted_sheet, users_sheet, drive_service):
+    """
+    核對副本與 Google Sheets
+    公文資料透過增量同步取得：完整重載後才整表重寫，
+    否則只寫入增量同步合併的新列 (本行程的修改已由 note_document_write 直接套用)；
+    刪除紀錄與使用者只在試算表版本變動時重新讀取
+    """
+    replica = get_replica()
+    state = get_document_sync_state()
+    sync_documents(docs_sheet, drive_service)
+    with state['lock']:
+        docs_df, revision = state['df'], state['revision']
+        generation, appended_ids = state['generation'], state['appended_ids']
+    
+    if docs_df is not replica['docs_source']:
+        if replica['docs_source'] is None or generation != replica['docs_generation']:
+            previous = replica['docs_source']
+            active = _active_documents(docs_df)
+            with replica['lock']:
+                _replace_table(replica['conn'], 'documents', active)
+            reconcile_reply_queue(None if previous is None else _active_documents(previous), active)
+        else:
+            added = set(appended_ids[replica['docs_appended']:])
+            if added:
+                # 從目前的資料框取出 (已在本行程刪除的不會再寫回)，Row_Num 為目前的位置
+                rows = _active_documents(docs_df[docs_df['ID'].isin(added)])
+                replica_upsert('documents', 'ID', rows)
+                for record in rows.to_dict('records'):
+                    note_reply_queue_added(record)
+        replica['docs_source'] = docs_df
+        replica['docs_generation'] = generation
+        replica['docs_appended'] = len(appended_ids)
+    
+    if revision is None or revision != replica['revision']:
+        deleted_df = _sheet_values_to_frame(deleted_sheet.get_all_values())
+        users_df = _sheet_values_to_frame(users_sheet.get_all_values())
+        with replica['lock']:
+            _replace_table(replica['conn'], 'deleted_documents', deleted_df)
+            _replace_table(replica['conn'], 'users', users_df)
+            replica['revision'] = revision
+    
+    replica['synced_at'] = time.time()
+
+@st.cache_resource
+def start_replica_reconciler(_spreadsheet, _drive_service):
+    """
+    啟動背景執行緒，定期核對副本 (每個行程只啟動一次)
+    每次核對前重新取得工作表 (init_all_sheets)，搬移到年度分片後會改用分片工作表
+    """
+    def reconcile_loop():
+        while True:
+            time.sleep(REPLICA_RECONCILE_INTERVAL)
+            try:
+                docs_sheet, deleted_sheet, users_sheet, _ = init_all_sheets(_spreadsheet)
+                refresh_replica(docs_sheet, deleted_sheet, users_sheet, _drive_service)
+            except Exception as e:
+                print(f"核對本機副本失敗: {str(e)}")
+    
+    thread = threading.Thread(target=reconcile_loop, name='replica-reconciler', daemon=True)
+    thread.start()
+    return thread
+
+def ensure_replica(docs_sheet, deleted_sheet, users_sheet, drive_service):
+    """確保副本已載入 (行程第一次使用時同步載入)，並啟動背景核對"""
+    replica = get_replica()
+    if not replica['synced_at']:
+        try:
+            refresh_replica(docs_sheet, deleted_sheet, users_sheet, drive_service)
+        except Exception as e:
+            st.error(f"建立本機副本失敗: {str(e)}")
+    start_replica_reconciler(docs_sheet.spreadsheet, drive_service)
+
+def _like_pattern(text):
+    """LIKE 查詢用的樣式 (跳脫 % 與 _)"""
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+def _facet_clauses(facets, exprs, skip=None):
+    """分面篩選的條件 (skip 指定的分面不套用)，回傳 (條件串列, 參數)"""
+    clauses = []
+    params = []
+    for name, value in (facets or {}).items():
+        if value and name != skip:
+            clauses.append(f'{exprs[name]} = ?')
+            params.append(value)
+    return clauses, params
+
+def _search_conditions(date_start=None, date_end=None, agency=None, doc_type=None,
+                       keyword=None, roots_only=False, facets=None, ids=None):
+    """組合查詢條件 (facets 為分面篩選 {分面: 值}；ids 限定文號)，回傳 (WHERE 子句, 參數)"""
+    clauses, params = _facet_clauses(
+        facets, {name: expr for name, (_, expr) in FACET_FIELDS.items()}
+    )
+    if date_start:
+        clauses.append('Date >= ?')
+        params.append(str(date_start))
+    if date_end:
+        clauses.append('Date <= ?')
+        params.append(str(date_end))
+    if agency:
+        clauses.append("Agency LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(agency))
+    if doc_type:
+        clauses.append('Type = ?')
+        params.append(doc_type)
+    if keyword:
+        clauses.append("Subject LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(keyword))
+    if roots_only:
+        clauses.append("(Parent_ID IS NULL OR Parent_ID = '')")
+    if ids is not None:
+        clauses.append('ID IN (SELECT value FROM json_each(?))')
+        params.append(json.dumps(list(ids)))
+    
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    return where, params
+
+def search_documents_replica(columns=None, order_by=None, limit=None, offset=0, threads=False, **conditions):
+    """
+    在副本上依條件查詢公文
+    columns 為要取回的欄位 (預設全部)；order_by 為 SEARCH_SORT_OPTIONS 的值；
+    limit / offset 用於分頁；threads 為 True 時改為回傳有公文符合條件的對話串的原始公文
+    """
+    where, params = _search_conditions(**conditions)
+    if threads:
+        # 命中的公文 (含回覆) 經 Root_ID 對應到所屬對話串的原始公文
+        where = f'WHERE ID IN (SELECT Root_ID FROM documents {where})'
+
+    select = ', '.join(_quote(col) for col in columns) if columns else '*'
+    order = order_by or 'CAST(Row_Num AS INTEGER)'
+    sql = f'SELECT {select} FROM documents {where} ORDER BY {order}'
+    if limit is not None:
+        sql += ' LIMIT ? OFFSET ?'
+        params = params + [int(limit), int(offset)]
+    return query_replica(sql, params)
+
+def _has_replica_table(name):
+    """副本中是否有指定的資料表"""
+    replica = get_replica()
+    with replica['lock']:
+        return bool(replica['conn'].execute(
+            'SELECT 1 FROM sqlite_master WHERE name = ?', (name,)
+        ).fetchone())
+
+def get_search_facets(facets=None, threads=False, **conditions):
+    """
+    取得查詢結果的總數與各分面的筆數，回傳 (總數, {分面: DataFrame(value, n)})
+    沒有日期區間與關鍵字時直接加總 document_facets 彙總表，不掃描公文；
+    否則在 documents 上依索引篩選後 GROUP BY
+    每個分面的筆數不套用該分面自己的篩選，方便切換到其他值
+    threads 為 True 時總數為對話串數 (同 search_documents_replica)，分面仍為符合的公文數
+    """
+    facets = facets or {}
+    from_summary = (
+        not conditions.get('date_start') and not conditions.get('date_end')
+        and not conditions.get('keyword') and _has_replica_table('document_facets')
+    )
+    
+    if from_summary:
+        table = 'document_facets'
+        exprs = FACET_TABLE_EXPRS
+        count_expr = 'SUM(Doc_Count)'
+        base_clauses = []
+        base_params = []
+        if conditions.get('agency'):
+            base_clauses.append("Agency LIKE ? ESCAPE '\\'")
+            base_params.append(_like_pattern(conditions['agency']))
+        if conditions.get('doc_type'):
+            base_clauses.append('Type = ?')
+            base_params.append(conditions['doc_type'])
+        if conditions.get('roots_only'):
+            base_clauses.append('Is_Root = 1')
+    else:
+        table = 'documents'
+        exprs = {name: expr for name, (_, expr) in FACET_FIELDS.items()}
+        count_expr = 'COUNT(*)'
+        where, base_params = _search_conditions(**conditions)
+        base_clauses = [where[len('WHERE '):]] if where else []
+    
+    def run(select, suffix='', skip=None):
+        clauses, params = _facet_clauses(facets, exprs, skip)
+        clauses = base_clauses + clauses
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        return query_replica(f'SELECT {select} FROM {table} {where} {suffix}', base_params + params)
+    
+    if threads:
+        where, params = _search_conditions(facets=facets, **conditions)
+        total = count_documents_replica(f'WHERE ID IN (SELECT Root_ID FROM documents {where})', params)
+    else:
+        total = int(run(f'COALESCE({count_expr}, 0) AS n')['n'].iloc[0])
+    counts = {}
+    for name, expr in exprs.items():
+        # 年度、年月依時間新到舊，其他分面依筆數多到少
+        order = 'value DESC' if name in ('Year', 'Month') else 'n DESC, value'
+        counts[name] = run(
+            f'{expr} AS value, {count_expr} AS n',
+            f'GROUP BY value HAVING n > 0 ORDER BY {order} LIMIT {FACET_OPTION_LIMIT}',
+            skip=name
+        )
+    
+    return total, counts
+
+def get_frame_facets(df, facets=None):
+    """
+    全文搜尋結果 (資料框) 的分面統計，格式同 get_search_facets
+    另外回傳套用分面篩選後的資料框
+    """
+    facets = facets or {}
+    values = {
+        'Agency': df['Agency'],
+        'Type': df['Type'],
+        'Year': df['Date'].str[:4],
+        'Month': df['Date'].str[:7],
+        'OCR_Status': df['OCR_Status'].map(ocr_status_kind),
+    }
+    
+    def facet_mask(skip=None):
+        mask = pd.Series(True, index=df.index)
+        for name, value in facets.items():
+            if value and name != skip:
+                mask &= values[name] == value
+        return mask
+    
+    counts = {}
+    for name, series in values.items():
+        counted = series[facet_mask(skip=name)].value_counts().rename_axis('value').reset_index(name='n')
+        if name in ('Year', 'Month'):
+            counted = counted.sort_values('value', ascending=False)
+        counts[name] = counted.head(FACET_OPTION_LIMIT)
+    
+    filtered = df[facet_mask()]
+    return len(filtered), counts, filtered
+
+def get_document_replica(doc_id):
+    """從副本取得單一公文，找不到時回傳 None"""
+    df = query_replica('SELECT * FROM documents WHERE ID = ? LIMIT 1', (doc_id,))
+    return None if df.empty else df.iloc[0].to_dict()
+
+def get_conversation_thread_replica(root_id, max_depth=50):
+    """
+    取得對話串 (格式同 get_conversation_thread)
+    以 Root_ID 索引一次取出整個對話串，再依 Parent_ID 排成樹狀順序，不需遞迴查詢
+    """
+    df = query_replica(
+        'SELECT * FROM documents WHERE Root_ID = ? ORDER BY CAST(Row_Num AS INTEGER)', (root_id,)
+    )
+    return order_thread_records(df.to_dict('records'), root_id, max_depth)
+
+def order_thread_records(records, root_id, max_depth=50):
+    """把同一對話串的公文 (依工作表順序) 依 Parent_ID 排成樹狀順序，回傳 [{'doc', 'level', 'id'}]"""
+    children = {}
+    for record in records:
+        parent_id = None if record['ID'] == root_id else (record['Parent_ID'] or '').strip()
+        children.setdefault(parent_id, []).append(record)
+    
+    conversation = []
+    stack = [(record, 0) for record in reversed(children.get(None, []))]
+    while stack:
+        record, level = stack.pop()
+        conversation.append({'doc': record, 'level': level, 'id': record['ID']})
+        if level < max_depth:
+            stack.extend((child, level + 1) for child in reversed(children.get(record['ID'], [])))
+    return conversation
+
+def search_parent_candidates(text, limit=PARENT_PICKER_LIMIT):
+    """
+    上層公文 type-ahead 查詢 (涵蓋所有年份)，最多回傳 limit 筆
+    文號前綴相符的排在前面，其次是文號、機關或主旨包含關鍵字的公文 (新到舊)
+    沒有輸入時回傳最近的公文
+    """
+    columns = ', '.join(f'd.{col}' for col in ['ID', 'Date', 'Type', 'Agency', 'Subject'])
+    text = (text or '').strip()
+    
+    if not text:
+        return query_replica(
+            f'SELECT {columns} FROM documents d ORDER BY d.Date DESC LIMIT ?', [limit]
+        )
+    
+    # 文號前綴：以範圍查詢走 ID 索引
+    prefix = query_replica(
+        f'SELECT {columns} FROM documents d WHERE d.ID >= ? AND d.ID < ? ORDER BY d.ID LIMIT ?',
+        [text, text + '\U0010ffff', limit]
+    )
+    remaining = limit - len(prefix)
+    if remaining <= 0:
+        return prefix
+    
+    exclude = prefix['ID'].tolist()
+    not_in = f"AND d.ID NOT IN ({', '.join('?' for _ in exclude)})" if exclude else ''
+    
+    with get_replica()['lock']:
+        has_index = bool(get_replica()['conn'].execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'documents_index'"
+        ).fetchone())
+    
+    if has_index and len(text) >= 3:
+        # trigram 索引需要至少 3 個字
+        phrase = '"' + text.replace('"', '""') + '"'
+        contains = query_replica(
+            f'SELECT {columns} FROM documents_index f JOIN documents d ON d.rowid = f.rowid '
+            f'WHERE documents_index MATCH ? {not_in} ORDER BY d.Date DESC LIMIT ?',
+            [phrase] + exclude + [remaining]
+        )
+    else:
+        # 較短的關鍵字沿著日期索引由新到舊掃描，湊滿筆數就停止
+        pattern = _like_pattern(text)
+        contains = query_replica(
+            f"SELECT {columns} FROM documents d "
+            f"WHERE (d.ID LIKE ? ESCAPE '\\' OR d.Agency LIKE ? ESCAPE '\\' OR d.Subject LIKE ? ESCAPE '\\') "
+            f"{not_in} ORDER BY d.Date DESC LIMIT ?",
+            [pattern, pattern, pattern] + exclude + [remaining]
+        )
+    
+    if prefix.empty:
+        return contains
+    return pd.concat([prefix, contains], ignore_index=True)
+
+def count_documents_replica(where='', params=()):
+    """計算副本中符合條件的公文數"""
+    sql = f'SELECT COUNT(*) AS n FROM documents {where}'
+    return int(query_replica(sql, params)['n'].iloc[0])
+
+# ===== 回覆追蹤佇列 (SLA) =====
+def get_sla_days(agency, doc_type):
+    """
+    公文的回覆期限天數：機關設定優先，其次是公文類型，都沒有時用 SLA_DEFAULT_DAYS
+    在 Secrets 以 SLA_DAYS_BY_AGENCY / SLA_DAYS_BY_TYPE 設定 {名稱: 天數}
+    """
+    by_agency = get_setting('SLA_DAYS_BY_AGENCY', {}) or {}
+    by_type = get_setting('SLA_DAYS_BY_TYPE', {}) or {}
+    if agency in by_agency:
+        return int(by_agency[agency])
+    if doc_type in by_type:
+        return int(by_type[doc_type])
+    return SLA_DEFAULT_DAYS
+
+def _sla_settings_key():
+    """期限設定的快照，設定變動時重建佇列"""
+    return json.dumps([get_setting('SLA_DAYS_BY_AGENCY', {}) or {}, get_setting('SLA_DAYS_BY_TYPE', {}) or {},
+                       SLA_DEFAULT_DAYS], sort_keys=True, ensure_ascii=False, default=dict)
+
+@st.cache_resource
+def get_reply_queue():
+    """
+    行程共用的待回覆佇列：未收到收文回覆的發文 / 函，依回覆期限排序
+    - entries：{文號: 公文資訊}；每筆有 token，heap 中 token 不符的項目視為已移除 (延遲刪除)
+    - waiting / overdue：兩個 (期限, token, 文號) 的 min-heap；期限過了才從 waiting 移到 overdue，
+      每筆公文只移動一次
+    新增、回覆、刪除都是 O(log n)，讀取前 k 筆為 O(k log k)，與公文總數無關
+    """
+    return {
+        'lock': threading.Lock(),
+        'entries': {},
+        'waiting': [],
+        'overdue': [],
+        'overdue_count': 0,
+        'next_token': 0,
+        'today': None,
+        'settings': None,
+        'ready': False,
+    }
+
+def _date_ordinal(value):
+    """YYYY-MM-DD 開頭的日期轉成序數，無法解析時回傳 None"""
+    try:
+        return datetime.strptime(str(value)[:10], '%Y-%m-%d').toordinal()
+    except ValueError:
+        return None
+
+def _queue_push(queue, doc):
+    """把公文放進佇列 (已在佇列中的會被取代)，需在 lock 內呼叫"""
+    sent = _date_ordinal(doc.get('Date'))
+    if sent is None:
+        return
+    _queue_discard(queue, doc['ID'])
+    sla_days = get_sla_days(doc.get('Agency'), doc.get('Type'))
+    token = queue['next_token']
+    queue['next_token'] += 1
+    entry = {
+        'id': doc['ID'],
+        'date': doc.get('Date', ''),
+        'agency': doc.get('Agency', ''),
+        'subject': doc.get('Subject', ''),
+        'created_by': doc.get('Created_By') or '未知',
+        'sent': sent,
+        'sla_days': sla_days,
+        'due': sent + sla_days,
+        'token': token,
+        'overdue': sent + sla_days < queue['today'],
+    }
+    queue['entries'][doc['ID']] = entry
+    if entry['overdue']:
+        queue['overdue_count'] += 1
+        heapq.heappush(queue['overdue'], (entry['due'], token, doc['ID']))
+    else:
+        heapq.heappush(queue['waiting'], (entry['due'], token, doc['ID']))
+
+def _queue_discard(queue, doc_id):
+    """從佇列移除公文 (heap 中的項目留待之後略過)，需在 lock 內呼叫"""
+    entry = queue['entries'].pop(doc_id, None)
+    if entry and entry['overdue']:
+        queue['overdue_count'] -= 1
+
+def _queue_is_live(queue, item):
+    entry = queue['entries'].get(item[2])
+    return entry is not None and entry['token'] == item[1]
+
+def _queue_compact(queue, name):
+    """heap 中已移除的項目超過一半時重建 (攤銷後每次操作 O(1))"""
+    heap = queue[name]
+    if len(heap) > 2 * len(queue['entries']) + REPLY_QUEUE_COMPACT_SLACK:
+        queue[name] = [item for item in heap if _queue_is_live(queue, item)]
+        heapq.heapify(queue[name])
+
+def _queue_advance(queue, today):
+    """日期變動時，把已過期限的公文從 waiting 移到 overdue，需在 lock 內呼叫"""
+    queue['today'] = today
+    waiting = queue['waiting']
+    while waiting and waiting[0][0] < today:
+        item = heapq.heappop(waiting)
+        if not _queue_is_live(queue, item):
+            continue
+        queue['entries'][item[2]]['overdue'] = True
+        queue['overdue_count'] += 1
+        heapq.heappush(queue['overdue'], item)
+
+def _queue_top(queue, name, k):
+    """不取出元素，依序走訪 heap 取得前 k 筆仍有效的公文 (O(k log k))"""
+    heap = queue[name]
+    frontier = [(heap[0], 0)] if heap else []
+    top = []
+    while frontier and len(top) < k:
+        item, index = heapq.heappop(frontier)
+        if _queue_is_live(queue, item):
+            top.append(queue['entries'][item[2]])
+        for child in (2 * index + 1, 2 * index + 2):
+            if child < len(heap):
+                heapq.heappush(frontier, (heap[child], child))
+    return top
+
+def _has_reply(doc_id):
+    """副本中是否已有這份公文的收文回覆 (走 Parent_ID 索引)"""
+    return count_documents_replica(
+        "WHERE Parent_ID = ? AND Type = '收文'", (doc_id,)
+    ) > 0
+
+def _apply_document_added(queue, doc):
+    """新增公文：待回覆的發文 / 函放進佇列；收文回覆把上層公文移出佇列"""
+    doc_type = doc.get('Type')
+    parent_id = (doc.get('Parent_ID') or '').strip()
+    if doc_type in SLA_TRACKED_TYPES and not _has_reply(doc['ID']):
+        _queue_push(queue, doc)
+    if doc_type == '收文' and parent_id:
+        _queue_discard(queue, parent_id)
+
+def _apply_document_removed(queue, doc):
+    """刪除公文：移出佇列；被刪除的是收文回覆時，上層公文若已沒有其他回覆就重新放回佇列"""
+    _queue_discard(queue, doc['ID'])
+    parent_id = (doc.get('Parent_ID') or '').strip()
+    if doc.get('Type') == '收文' and parent_id and not _has_reply(parent_id):
+        parent = get_document_replica(parent_id)
+        if parent and parent.get('Type') in SLA_TRACKED_TYPES:
+            _queue_push(queue, parent)
+
+def rebuild_reply_queue():
+    """由副本重建整個佇列 (第一次使用或期限設定變動時)"""
+    queue = get_reply_queue()
+    placeholders = ', '.join('?' for _ in SLA_TRACKED_TYPES)
+    df = query_replica(
+        f"""
+        SELECT d.ID, d.Date, d.Type, d.Agency, d.Subject, d.Created_By
+        FROM documents d
+        WHERE d.Type IN ({placeholders})
+          AND NOT EXISTS (
+              SELECT 1 FROM documents r WHERE r.Parent_ID = d.ID AND r.Type = '收文'
+          )
+        """,
+        list(SLA_TRACKED_TYPES)
+    )
+    with queue['lock']:
+        queue.update(entries={}, waiting=[], overdue=[], overdue_count=0,
+                     today=datetime.now().toordinal(), settings=_sla_settings_key())
+        for doc in df.to_dict('records'):
+            _queue_push(queue, doc)
+        queue['ready'] = True
+
+def note_reply_queue_added(doc):
+    """本行程新增公文後呼叫 (副本已寫入)"""
+    queue = get_reply_queue()
+    if not queue['ready']:
+        return
+    with queue['lock']:
+        _apply_document_added(queue, doc)
+
+def note_reply_queue_removed(doc):
+    """本行程刪除公文後呼叫 (副本已刪除)，doc 為刪除前的公文資料"""
+    queue = get_reply_queue()
+    if not queue['ready']:
+        return
+    with queue['lock']:
+        _apply_document_removed(queue, doc)
+
+def reconcile_reply_queue(previous, current):
+    """
+    副本重新載入後，依前後兩份公文資料框的差異更新佇列
+    新增、刪除或追蹤欄位有變動的公文才逐筆處理；本行程已套用過的變動重複套用也不影響結果
+    """
+    queue = get_reply_queue()
+    if not queue['ready']:
+        return
+    if previous is None:
+        rebuild_reply_queue()
+        return
+    
+    columns = [col for col in REPLY_QUEUE_COLUMNS if col in current.columns and col in previous.columns]
+    before = previous[columns].drop_duplicates('ID').astype(str)
+    after = current[columns].drop_duplicates('ID').astype(str)
+    merged = after.merge(before, on='ID', how='outer', suffixes=('', '_old'), indicator=True)
+    changed = merged['_merge'] != 'both'
+    for col in columns[1:]:
+        changed |= (merged['_merge'] == 'both') & (merged[col] != merged[f'{col}_old'])
+    merged = merged[changed]
+    
+    with queue['lock']:
+        for record in merged.to_dict('records'):
+            if record['_merge'] != 'left_only':
+                _apply_document_removed(queue, {'ID': record['ID'], **{col: record[f'{col}_old'] for col in columns[1:]}})
+        for record in merged.to_dict('records'):
+            if record['_merge'] != 'right_only':
+                _apply_document_added(queue, {col: record[col] for col in columns})
+
+def get_reply_queue_view(k=TRACKING_TOP_K):
+    """
+    取得待回覆佇列的前 k 筆，回傳 {'total', 'overdue_count', 'urgent', 'normal'}
+    urgent 為已超過期限的公文 (最早到期的在前)，normal 為尚未到期的公文 (最快到期的在前)
+    """
+    queue = get_reply_queue()
+    if not queue['ready'] or queue['settings'] != _sla_settings_key():
+        rebuild_reply_queue()
+    
+    today = datetime.now().toordinal()
+    with queue['lock']:
+        if queue['today'] != today:
+            _queue_advance(queue, today)
+        _queue_compact(queue, 'waiting')
+        _queue_compact(queue, 'overdue')
+        view = {
+            'total': len(queue['entries']),
+            'overdue_count': queue['overdue_count'],
+            'urgent': _queue_top(queue, 'overdue', k),
+            'normal': _queue_top(queue, 'waiting', k),
+        }
+    
+    for name in ('urgent', 'normal'):
+        view[name] = [
+            {
+                'id': entry['id'],
+                'date': entry['date'],
+                'agency': entry['agency'],
+                'subject': entry['subject'],
+                'created_by': entry['created_by'],
+                'days_waiting': today - entry['sent'],
+                'sla_days': entry['sla_days'],
+                'due_date': datetime.fromordinal(entry['due']).strftime('%Y-%m-%d'),
+                'days_left': entry['due'] - today,
+            }
+            for entry in view[name]
+        ]
+    return view
+
+@st.cache_resource(ttl=300)
+def get_users_sheet(_spreadsheet):
+    """登入前只需要使用者工作表 (快取，避免每次重新執行都列出所有工作表)"""
+    existing_sheets = [ws.title for ws in _spreadsheet.worksheets()]
+    if '使用者' not in existing_sheets:
+        # 如果沒有使用者表,才完整初始化
+        return init_all_sheets(_spreadsheet)[2]
+    return _spreadsheet.worksheet('使用者')
+
+@st.cache_data(ttl=USER_DIRECTORY_TTL, show_spinner=False)
+def get_user_directory(_worksheet):
+    """
+    讀取使用者目錄 (行程共用快取)，回傳 {帳號: 使用者資料}
+    新增、刪除使用者或修改密碼時會清除快取
+    """
+    values = _worksheet.get_all_values()
+    if not values or len(values) <= 1:
+        return {}
+    
+    headers = values[0]
+    directory = {}
+    for row in values[1:]:
+        user = dict(zip(headers, row + [''] * (len(headers) - len(row))))
+        if user.get('Username'):
+            directory[user['Username']] = user
+    return directory
+
+def get_all_users(worksheet):
+    """從工作表讀取所有使用者"""
+    try:
+        values = worksheet.get_all_values()
+        if not values or len(values) <= 1:
+            return pd.DataFrame(columns=['Username', 'Password', 'Display_Name', 'Role', 'Created_At'])
+        headers = values[0]
+        data = values[1:]
+        return pd.DataFrame(data, columns=headers)
+    except Exception as e:
+        st.error(f"讀取使用者失敗: {str(e)}")
+        return pd.DataFrame()
+
+def generate_document_id(worksheet, date_str, is_reply, parent_id):
+    """生成流水號"""
+    try:
+        if isinstance(worksheet, ShardedWorksheet) and not is_reply:
+            # 新發文只需要同一天的文號：只讀該年度分片 (與尚未搬移的 公文資料)
+            worksheet = worksheet.for_years(['', shard_year(date_str)])
+        df = get_documents(worksheet, ['ID', 'Parent_ID'])
+        
+        if df.empty or 'ID' not in df.columns:
+            if not is_reply:
+                date_code = date_str.replace('-', '')
+                return f"金展詢{date_code}001"
+            else:
+                return None
+        
+        if is_reply and parent_id:
+            # 計算該 parent_id 的回覆數量
+            reply_count = len(df[df['Parent_ID'].astype(str) == str(parent_id)])
+            new_reply_number = str(reply_count + 2).zfill(2)
+            doc_id = f"金展回{new_reply_number}{parent_id}"
+        else:
+            # 新發文:金展詢 + 日期 + 流水號
+            date_code = date_str.replace('-', '')
+            # 找出同一天所有以「金展詢+日期」開頭的公文
+            same_day_docs = df[
+                df['ID'].astype(str).str.startswith(f"金展詢{date_code}")
+            ]
+            next_serial = str(len(same_day_docs) + 1).zfill(3)
+            doc_id = f"金展詢{date_code}{next_serial}"
+        
+        return doc_id
+    except Exception as e:
+        date_code = date_str.replace('-', '')
+        return f"金展詢{date_code}001"
+
+def build_document_row(doc_data):
+    """組成公文資料表的一列 (欄位順序同工作表)"""
+    return [
+        doc_data['id'],
+        doc_data['date'],
+        doc_data['type'],
+        doc_data['agency'],
+        doc_data['subject'],
+        doc_data['parent_id'] or '',
+        doc_data['drive_file_id'] or '',
+        doc_data['created_at'],
+        doc_data['created_by'],
+        'active',
+        '',  # OCR_Text (空白,稍後填入)
+        'pending',  # OCR_Status (待辨識)
+        '',  # OCR_Date (辨識完成後填入)
+        doc_data.get('root_id') or doc_data['id'],
+        str(doc_data.get('depth', 0))
+    ]
+
+def add_document_to_sheet(worksheet, doc_data):
+    """新增公文資料 (Root_ID / Depth 依上層公文設定)"""
+    try:
+        root_id, depth = get_thread_position(doc_data['id'], doc_data['parent_id'])
+        row = build_document_row({**doc_data, 'root_id': root_id, 'depth': depth})
+        worksheet.append_row(row)
+        note_document_write(row=dict(zip(get_sheet_headers(worksheet, worksheet.id), row)))
+        return True
+    except Exception as e:
+        st.error(f"寫入失敗: {str(e)}")
+        return False
+
+def add_user_to_sheet(worksheet, user_data):
+    """新增使用者"""
+    try:
+        row = [
+            user_data['username'],
+            hash_password(user_data['password']),
+            user_data['display_name'],
+            user_data['role'],
+            datetime.now().isoformat()
+        ]
+        worksheet.append_row(row)
+        note_sheet_write()
+        replica_insert('users', dict(zip(get_sheet_headers(worksheet, worksheet.id), row)))
+        get_user_directory.clear()
+        return True
+    except Exception as e:
+        st.error(f"新增使用者失敗: {str(e)}")
+        return False
+
+def delete_user_from_sheet(worksheet, username):
+    """刪除使用者"""
+    try:
+        cell = worksheet.find(username)
+        if cell:
+            worksheet.delete_rows(cell.row)
+            note_sheet_write()
+            replica_delete('users', 'Username', username)
+            get_user_directory.clear()
+            return True
+        return False
+    except Exception as e:
+        st.error(f"刪除使用者失敗: {str(e)}")
+        return False
+
+def locate_document_rows(docs_sheet, doc_ids):
+    """
+    找出公文所在的列並讀取整列資料，回傳 {ID: (列號, 列資料)}，找不到的 ID 不會出現
+    只用兩次 API 呼叫 (讀 ID 欄、batch_get 各列)；讀回的列 ID 不符 (期間有人刪除或插入列) 時重新定位
+    """
+    headers = get_sheet_headers(docs_sheet, docs_sheet.id)
+    id_index = headers.index('ID')
+    wanted = list(dict.fromkeys(doc_ids))
+    
+    for _ in range(DELETE_LOCATE_ATTEMPTS):
+        ids = docs_sheet.col_values(id_index + 1)
+        positions = {}
+        for row_num, value in enumerate(ids, start=1):
+            if row_num > 1 and value in wanted and value not in positions:
+                positions[value] = row_num
+        if not positions:
+            return {}
+        
+        fetched = docs_sheet.batch_get([f"{row_num}:{row_num}" for row_num in positions.values()])
+        located = {}
+        for (doc_id, row_num), value_range in zip(positions.items(), fetched):
+            row_data = list(value_range[0]) if value_range else []
+            if len(row_data) > id_index and row_data[id_index] == doc_id:
+                located[doc_id] = (row_num, row_data)
+        if len(located) == len(positions):
+            return located
+    
+    raise RuntimeError("公文資料表的列持續變動，無法定位要刪除的公文，請稍後再試")
+
+def relocate_document_rows(docs_sheet, located):
+    """
+    刪除前重新定位先前找到的公文 ({ID: (列號, 列資料)})，期間有人刪除或插入列時列號會位移
+    回傳最新的列號；有公文已不在表上或內容被修改時抛出 RuntimeError，呼叫端不應刪除任何列
+    """
+    current, changed = find_changed_documents(docs_sheet, located)
+    if changed:
+        raise RuntimeError(f"公文在處理期間被刪除或修改，已停止刪除：{', '.join(changed)}")
+    return [current[doc_id][0] for doc_id in located]
+
+def find_changed_documents(docs_sheet, located):
+    """
+    重新定位先前找到的公文 ({ID: (列號, 列資料)})
+    回傳 (最新的 {ID: (列號, 列資料)}, 已不在表上或內容被修改的 ID 串列)
+    """
+    current = locate_document_rows(docs_sheet, list(located))
+    changed = [
+        doc_id for doc_id, (_, row_data) in located.items()
+        if doc_id not in current or _trim_row(current[doc_id][1]) != _trim_row(row_data)
+    ]
+    return current, changed
+
+def _trim_row(row_data):
+    """去掉列尾的空白格 (batch_get 會省略，get_all_values 會補齊)"""
+    row_data = list(row_data)
+    while row_data and row_data[-1] == '':
+        row_data.pop()
+    return row_data
+
+def soft_delete_documents(docs_sheet, deleted_sheet, doc_ids, deleted_by):
+    """
+    批次軟刪除公文（移到刪除紀錄）
+    不論筆數都是固定的 API 呼叫：定位列、一次 batch_update 由下往上刪除各列
+    (先刪下面的列，上面的列號才不會位移)、一次 append_rows 寫入刪除紀錄
+    定位後立刻刪除 (中間沒有其他寫入，列號來不及位移)；刪除成功後才寫入刪除紀錄，
+    刪除失敗時不會留下紀錄，重試也不會重複寫入
+    回傳 {ID: 原始列資料 dict}，只包含實際刪除的公文
+    """
+    try:
+        located = locate_document_rows(docs_sheet, doc_ids)
+        if not located:
+            return {}
+        
+        delete_document_rows(docs_sheet, [row_num for row_num, _ in located.values()])
+        
+        for doc_id in located:
+            note_document_write(doc_id, deleted=True)
+        
+        headers = get_sheet_headers(docs_sheet, docs_sheet.id)
+        result = {doc_id: dict(zip(headers, row_data)) for doc_id, (_, row_data) in located.items()}
+        
+        deleted_at = datetime.now().isoformat()
+        deleted_rows = [row_data[:9] + [deleted_at, deleted_by] for _, row_data in located.values()]
+        try:
+            deleted_sheet.append_rows(deleted_rows, value_input_option='RAW')
+        except Exception as e:
+            # 公文已經刪除：把原始資料留在伺服器紀錄，之後可以手動補回刪除紀錄
+            print(f"寫入刪除紀錄失敗，已刪除的公文: {json.dumps(deleted_rows, ensure_ascii=False)}")
+            st.error(f"公文已刪除，但寫入刪除紀錄失敗: {str(e)}")
+            return result
+        note_sheet_write()
+        deleted_headers = get_sheet_headers(deleted_sheet, deleted_sheet.id)
+        for deleted_row in deleted_rows:
+            replica_insert('deleted_documents', dict(zip(deleted_headers, deleted_row)))
+        
+        return result
+    except Exception as e:
+        st.error(f"刪除公文失敗: {str(e)}")
+        return {}
+
+def soft_delete_document(docs_sheet, deleted_sheet, doc_id, deleted_by):
+    """軟刪除公文（移到刪除紀錄）"""
+    return doc_id in soft_delete_documents(docs_sheet, deleted_sheet, [doc_id], deleted_by)
+
+def get_deleted_documents(worksheet):
+    """從工作表讀取刪除紀錄"""
+    try:
+        values = worksheet.get_all_values()
+        if not values or len(values) <= 1:
+            return pd.DataFrame()
+        headers = values[0]
+        data = values[1:]
+        return pd.DataFrame(data, columns=headers)
+    except Exception as e:
+        st.error(f"讀取刪除紀錄失敗: {str(e)}")
+        return pd.DataFrame()
+
+# ===== 對話串欄位 (Root_ID / Depth) =====
+def get_thread_position(doc_id, parent_id, known=None, replica=True):
+    """
+    新公文在對話串中的位置，回傳 (Root_ID, Depth)
+    沿用上層公文的 Root_ID、Depth 加一；上層公文先查 known ({文號: (Root_ID, Depth)}，
+    同一批新增的公文)，再查副本 (replica=False 時不查)。沒有上層公文或找不到時自己就是原始公文
+    """
+    parent_id = (parent_id or '').strip()
+    if not parent_id:
+        return doc_id, 0
+    if known and parent_id in known:
+        root_id, depth = known[parent_id]
+        return root_id, depth + 1
+    if not replica:
+        return doc_id, 0
+    parent = get_document_replica(parent_id)
+    if parent is None:
+        return doc_id, 0
+    return parent.get('Root_ID') or parent_id, int(parent.get('Depth') or 0) + 1
+
+def thread_positions_from_frame(df):
+    """由公文資料框 (ID、Root_ID、Depth 欄) 建立 {文號: (Root_ID, Depth)}，Root_ID 空白時為自己"""
+    if df.empty:
+        return {}
+    roots = df['Root_ID'].fillna('').astype(str)
+    roots = roots.where(roots != '', df['ID'].astype(str))
+    depths = pd.to_numeric(df['Depth'], errors='coerce').fillna(0).astype(int)
+    return dict(zip(df['ID'].astype(str), zip(roots, depths)))
+
+def compute_thread_positions(parents):
+    """
+    由 {文號: 上層文號} 計算每筆公文的 (Root_ID, Depth)
+    沿上層公文往上找到最上層仍存在的公文；上層公文不存在或形成循環時，自己就是原始公文
+    """
+    positions = {}
+    for doc_id in parents:
+        path = []
+        current = doc_id
+        while current not in positions:
+            parent_id = parents.get(current, '')
+            if current in path or not parent_id or parent_id not in parents:
+                positions[current] = (current, 0)
+                break
+            path.append(current)
+            current = parent_id
+        for node in reversed(path):
+            if node in positions:
+                continue
+            root_id, depth = positions[parents[node]]
+            positions[node] = (root_id, depth + 1)
+    return positions
+
+def backfill_thread_columns(docs_sheet):
+    """
+    重新計算所有公文的 Root_ID / Depth，有變動時用一次 batch_update 寫回兩欄
+    新增欄位時執行一次；之後由新增公文時設定，可在資料維護頁重新執行
+    回傳更新的列數
+    """
+    headers = get_sheet_headers(docs_sheet, docs_sheet.id)
+    if 'Root_ID' not in headers or 'Depth' not in headers:
+        return 0
+    
+    df = read_document_rows(docs_sheet, ['ID', 'Parent_ID', 'Root_ID', 'Depth'])
+    parents = dict(zip(df['ID'], df['Parent_ID'].fillna('').str.strip()))
+    positions = compute_thread_positions(parents)
+    
+    roots = [positions[doc_id][0] for doc_id in df['ID']]
+    depths = [str(positions[doc_id][1]) for doc_id in df['ID']]
+    changed = int(((df['Root_ID'] != pd.Series(roots)) | (df['Depth'] != pd.Series(depths))).sum())
+    if changed:
+        root_col = column_letter(headers.index('Root_ID') + 1)
+        depth_col = column_letter(headers.index('Depth') + 1)
+        last_row = len(df) + 1
+        docs_sheet.batch_update([
+            {'range': f"{root_col}2:{root_col}{last_row}", 'values': [[value] for value in roots]},
+            {'range': f"{depth_col}2:{depth_col}{last_row}", 'values': [[value] for value in depths]},
+        ])
+    return changed
+
+# ===== OCR 文字存放 (OCR文字 工作表) =====
+def column_letter(col_num):
+    """將欄位編號 (1 起算) 轉成 A1 表示法的欄位字母"""
+    return gspread.utils.rowcol_to_a1(1, col_num)[:-1]
+
+def _split_cells(payload, codec):
+    """把編碼後的內容切成儲存格，第一格加上 '#OCR1:<編碼>:<格數>:' 標頭"""
+    parts = [payload[i:i + OCR_TEXT_CELL_LIMIT] for i in range(0, len(payload), OCR_TEXT_CELL_LIMIT)] or ['']
+    parts[0] = f"{OCR_TEXT_CODEC_PREFIX}{codec}:{len(parts)}:{parts[0]}"
+    return parts
+
+def encode_text_cells(text):
+    """
+    把文字編成一或多個儲存格的值 (第一格寫在 OCR_Text 欄，其餘接在 Updated_At 右側)
+    短文字原樣存放；較長的文字以 zlib 壓縮後 base64 (中文約可少傳一半的位元組)，
+    壓縮後沒有比較小時原樣分段。超過 OCR_TEXT_MAX_PARTS 格時截斷文字
+    """
+    text = text or ''
+    while True:
+        raw = text.encode('utf-8')
+        if len(text) <= OCR_TEXT_COMPRESS_MIN and not text.startswith(OCR_TEXT_CODEC_PREFIX):
+            return [text]
+
+        packed = base64.b64encode(zlib.compress(raw, 9)).decode('ascii')
+        if len(packed) < len(raw):
+            cells = _split_cells(packed, 'z')
+        elif len(text) <= OCR_TEXT_CELL_LIMIT and not text.startswith(OCR_TEXT_CODEC_PREFIX):
+            return [text]
+        else:
+            cells = _split_cells(text, 'p')
+
+        if len(cells) <= OCR_TEXT_MAX_PARTS:
+            return cells
+        keep = int(len(text) * OCR_TEXT_MAX_PARTS / len(cells) * 0.95)
+        text = text[:keep] + "\n\n...(文字過長,已截斷)"
+
+def decode_text_cells(cells):
+    """還原 encode_text_cells 編碼的儲存格 (沒有標頭的舊資料直接回傳第一格)"""
+    first = cells[0] if cells else ''
+    if not first.startswith(OCR_TEXT_CODEC_PREFIX):
+        return first
+
+    codec, count, payload = first[len(OCR_TEXT_CODEC_PREFIX):].split(':', 2)
+    rest = list(cells[1:int(count)])
+    if len(rest) < int(count) - 1:
+        raise ValueError(f"OCR 文字只有 {len(rest) + 1}/{count} 格")
+    payload += ''.join(rest)
+    if codec == 'z':
+        return zlib.decompress(base64.b64decode(payload)).decode('utf-8')
+    return payload
+
+def decode_text_row(row):
+    """從 OCR文字 表的一列 (ID, 第一格, Updated_At, 接續的格...) 還原文字"""
+    return decode_text_cells(list(row[1:2]) + list(row[3:]))
+
+def read_text_row(row):
+    """還原一列的文字；內容損壞 (缺少接續格、無法解壓縮) 時記錄 ID 並改用第一格的原始內容"""
+    try:
+        return decode_text_row(row)
+    except (ValueError, zlib.error) as e:
+        print(f"OCR 文字無法還原 ({row[0]}): {str(e)}")
+        return row[1] if len(row) > 1 else ''
+
+def build_text_row(doc_id, text, updated_at):
+    """組成 OCR文字 表的一列"""
+    cells = encode_text_cells(text)
+    return [doc_id, cells[0], updated_at] + cells[1:]
+
+def ensure_sheet_columns(worksheet, count):
+    """工作表的欄數不足 count 時加欄 (寫入超出範圍的儲存格會失敗)"""
+    current = getattr(worksheet, 'col_count', count)
+    if current < count:
+        worksheet.add_cols(count - current)
+
+def migrate_ocr_text_to_sidecar(docs_sheet, text_sheet):
+    """
+    一次性搬移：把公文資料表內的 OCR_Text 移到 OCR文字 表，並清空原欄位
+    已搬過的 ID 會略過，可以重複執行
+    """
+    try:
+        values = docs_sheet.get_all_values()
+        if not values or len(values) <= 1:
+            return 0
+
+        headers = values[0]
+        if 'ID' not in headers or 'OCR_Text' not in headers:
+            return 0
+
+        id_idx = headers.index('ID')
+        text_idx = headers.index('OCR_Text')
+
+        # 已經在 OCR文字 表的 ID 不重複搬移
+        existing_ids = set(text_sheet.col_values(1)[1:])
+        now = datetime.now().isoformat()
+
+        rows = []
+        for row in values[1:]:
+            if len(row) > text_idx and row[text_idx] and row[id_idx] not in existing_ids:
+                rows.append(build_text_row(row[id_idx], row[text_idx], now))
+
+        if rows:
+            ensure_sheet_columns(text_sheet, max(len(row) for row in rows))
+            text_sheet.append_rows(rows)
+
+        # 清空原本的 OCR_Text 欄 (保留欄位本身，避免其他欄位位移)
+        col = column_letter(text_idx + 1)
+        docs_sheet.batch_clear([f"{col}2:{col}"])
+        note_sheet_write()
+
+        get_ocr_texts_by_ids.clear()
+        get_all_ocr_texts.clear()
+        return len(rows)
+    except Exception as e:
+        print(f"搬移 OCR 文字失敗: {str(e)}")
+        return 0
+
+@st.cache_data(ttl=600, show_spinner=False)
+def get_ocr_texts_by_ids(_text_sheet, doc_ids):
+    """
+    依公文 ID 讀取 OCR 文字 (只讀取需要的列)
+    doc_ids 需為 tuple，回傳 {ID: 文字}
+    """
+    try:
+        ids = _text_sheet.col_values(1)
+        row_of = {doc_id: idx + 1 for idx, doc_id in enumerate(ids) if idx > 0}
+
+        wanted = [doc_id for doc_id in doc_ids if doc_id in row_of]
+        if not wanted:
+            return {}
+
+        # 整列讀取：壓縮後的長文字會接續在 Updated_At 右側的儲存格
+        results = _text_sheet.batch_get([f"{row_of[doc_id]}:{row_of[doc_id]}" for doc_id in wanted])
+
+        texts = {}
+        for doc_id, value_range in zip(wanted, results):
+            texts[doc_id] = read_text_row(value_range[0]) if value_range and value_range[0] else ''
+        return texts
+    except Exception as e:
+        print(f"讀取 OCR 文字失敗: {str(e)}")
+        return {}
+
+def get_ocr_text(text_sheet, doc_id):
+    """讀取單一公文的 OCR 文字"""
+    return get_ocr_texts_by_ids(text_sheet, (doc_id,)).get(doc_id, '')
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_all_ocr_texts(_text_sheet):
+    """讀取全部 OCR 文字 (全文搜尋用)，回傳 {ID: 文字}"""
+    try:
+        values = _text_sheet.get_all_values()
+        # 逐列還原：一列損壞不影響其他公文
+        return {row[0]: read_text_row(row) for row in values[1:] if len(row) > 1}
+    except Exception as e:
+        print(f"讀取 OCR 文字失敗: {str(e)}")
+        return {}
+
+def save_ocr_text(text_sheet, doc_id, ocr_text):
+    """寫入 (或覆蓋) 單一公文的 OCR 文字 (長文字壓縮後可能佔用多格)"""
+    now = datetime.now().isoformat()
+    row = build_text_row(doc_id, ocr_text, now)
+    ensure_sheet_columns(text_sheet, len(row))
+
+    cell = text_sheet.find(doc_id, in_column=1)
+    if cell:
+        # 補空白到目前的欄寬，清掉舊文字較長時留下的接續格
+        row += [''] * (getattr(text_sheet, 'col_count', len(row)) - len(row))
+        text_sheet.update(range_name=f"B{cell.row}:{column_letter(len(row))}{cell.row}", values=[row[1:]])
+    else:
+        text_sheet.append_row(row)
+    note_sheet_write()
+
+    get_ocr_texts_by_ids.clear()
+    get_all_ocr_texts.clear()
 
 # ===== Google Drive 操作 =====
-def get_or_create_subfolder(drive_service, parent_folder_id, folder_name):
-    """在指定資料夾內取得或建立子資料夾"""
+def create_drive_file(drive_service, file_bytes, filename, folder_id, mimetype='application/pdf'):
+    """上傳檔案 (預設為 PDF) 到 Google Drive 並回傳檔案 ID (失敗時拋出例外)"""
+    from googleapiclient.http import MediaIoBaseUpload
+    
+    file_metadata = {
+        'name': filename,
+        'parents': [folder_id]
+    }
+    
+    media = MediaIoBaseUpload(
+        io.BytesIO(file_bytes),
+        mimetype=mimetype,
+        resumable=True
+    )
+    
+    file = drive_service.files().create(
+        body=file_metadata,
+        media_body=media,
+        fields='id',
+        supportsAllDrives=True
+    ).execute()
+    
+    return file.get('id')
+
+def replace_drive_file(drive_service, file_id, file_bytes, mimetype):
+    """覆寫 Google Drive 檔案的內容 (檔案 ID 不變，失敗時拋出例外)"""
+    from googleapiclient.http import MediaIoBaseUpload
+    
+    media = MediaIoBaseUpload(io.BytesIO(file_bytes), mimetype=mimetype, resumable=True)
+    drive_service.files().update(
+        fileId=file_id,
+        media_body=media,
+        fields='id',
+        supportsAllDrives=True
+    ).execute()
+
+def create_document_file(drive_service, file_bytes, filename, root_folder_id, doc_date):
+    """
+    把公文附件上傳到 年/年-月 資料夾 (失敗時拋出例外)
+    快取的資料夾已不存在 (404) 時，清除快取重新解析一次
+    """
+    folder_id = get_document_folder(drive_service, root_folder_id, doc_date)
     try:
-        # 先搜尋是否已存在
-        query = f"name='{folder_name}' and '{parent_folder_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false"
-        results = drive_service.files().list(
-            q=query,
-            spaces='drive',
-            fields='files(id, name)',
-            supportsAllDrives=True,
-            includeItemsFromAllDrives=True
-        ).execute()
-        
-        files = results.get('files', [])
-        
-        if files:
-            # 已存在，回傳 ID
-            return files[0]['id']
-        
-        # 不存在，建立新資料夾
-        folder_metadata = {
-            'name': folder_name,
-            'mimeType': 'application/vnd.google-apps.folder',
-            'parents': [parent_folder_id]
-        }
-        
-        folder = drive_service.files().create(
-            body=folder_metadata,
-            fields='id',
-            supportsAllDrives=True
-        ).execute()
-        
-        return folder.get('id')
+        return create_drive_file(drive_service, file_bytes, filename, folder_id)
     except Exception as e:
-        st.error(f"建立資料夾失敗: {str(e)}")
-        return None
+        names = document_folder_keys(root_folder_id, doc_date)
+        if _drive_error_status(e) != 404 or not names:
+            raise
+        year_key = (root_folder_id, names[0])
+        year_id = get_drive_folder_cache()['folders'].get(year_key)
+        forget_drive_folders([year_key, (year_id, names[1])])
+        folder_id = get_document_folder(drive_service, root_folder_id, doc_date)
+        return create_drive_file(drive_service, file_bytes, filename, folder_id)
 
-def upload_to_drive(drive_service, file_bytes, filename, folder_id):
-    """上傳檔案到 Google Drive"""
+def upload_to_drive(drive_service, file_bytes, filename, folder_id, doc_date=None):
+    """上傳檔案到 Google Drive (有公文日期時放到 年/年-月 子資料夾)"""
     try:
-        file_metadata = {
-            'name': filename,
-            'parents': [folder_id]
-        }
-        
-        media = MediaIoBaseUpload(
-            io.BytesIO(file_bytes),
-            mimetype='application/pdf',
-            resumable=True
-        )
-        
-        file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id',
-            supportsAllDrives=True
-        ).execute()
-        
-        return file.get('id')
+        if doc_date:
+            return create_document_file(drive_service, file_bytes, filename, folder_id, doc_date)
+        return create_drive_file(drive_service, file_bytes, filename, folder_id)
     except Exception as e:
         st.error(f"上傳失敗: {str(e)}")
         return None
 
-def move_file_to_folder(drive_service, file_id, dest_folder_id):
-    """移動檔案到另一個資料夾"""
+def fetch_drive_file(drive_service, file_id):
+    """從 Google Drive 下載檔案內容 (失敗時拋出例外)"""
+    from googleapiclient.http import MediaIoBaseDownload
+    
+    request = drive_service.files().get_media(
+        fileId=file_id,
+        supportsAllDrives=True
+    )
+    file_bytes = io.BytesIO()
+    downloader = MediaIoBaseDownload(file_bytes, request)
+    
+    done = False
+    while not done:
+        status, done = downloader.next_chunk()
+    
+    file_bytes.seek(0)
+    return file_bytes.read()
+
+def download_from_drive(drive_service, file_id):
+    """從 Google Drive 下載檔案"""
     try:
-        # 取得檔案目前的父資料夾
-        file = drive_service.files().get(
-            fileId=file_id,
-            fields='parents',
-            supportsAllDrives=True
-        ).execute()
+        return fetch_drive_file(drive_service, file_id)
+    except Exception as e:
+        st.error(f"下載失敗: {str(e)}")
+        return None
+
+@st.cache_data(ttl=600, max_entries=20, show_spinner=False)
+def get_pdf_bytes(_drive_service, file_id):
+    """下載 PDF (快取，同一份檔案在 fragment 重新執行時不重複下載)"""
+    pdf_bytes = download_from_drive(_drive_service, file_id)
+    if pdf_bytes is None:
+        # 下載失敗不快取
+        raise IOError(f"無法下載檔案 {file_id}")
+    return pdf_bytes
+
+# ===== Drive 資料夾 (年 / 年-月) =====
+@st.cache_resource
+def get_drive_folder_cache():
+    """
+    行程共用的 Drive 資料夾 ID 快取 {(上層資料夾 ID, 名稱): 資料夾 ID}
+    同時存在本機副本的 drive_folders 表，重新啟動後不必再查詢 Drive
+    """
+    replica = get_replica()
+    with replica['lock']:
+        conn = replica['conn']
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS drive_folders '
+                '(Parent_ID TEXT, Name TEXT, Folder_ID TEXT, PRIMARY KEY (Parent_ID, Name))'
+            )
+        rows = conn.execute('SELECT Parent_ID, Name, Folder_ID FROM drive_folders').fetchall()
+    return {
+        'lock': threading.Lock(),
+        'folders': {(parent_id, name): folder_id for parent_id, name, folder_id in rows},
+    }
+
+def _find_drive_folders(drive_service, parent_folder_id, folder_name):
+    """列出上層資料夾內指定名稱的子資料夾 ID (最早建立的在前)"""
+    escaped = folder_name.replace('\\', '\\\\').replace("'", "\\'")
+    query = (
+        f"name='{escaped}' and '{parent_folder_id}' in parents "
+        f"and mimeType='application/vnd.google-apps.folder' and trashed=false"
+    )
+    results = drive_service.files().list(
+        q=query,
+        spaces='drive',
+        orderBy='createdTime',
+        fields='files(id, name)',
+        supportsAllDrives=True,
+        includeItemsFromAllDrives=True
+    ).execute()
+    return [file['id'] for file in results.get('files', [])]
+
+def resolve_drive_folder(drive_service, parent_folder_id, folder_name):
+    """
+    取得上層資料夾內的子資料夾 ID，不存在時建立 (失敗時拋出例外)
+    先查行程快取，沒有才查詢 Drive；查詢與建立都在 lock 內，同時開始的工作階段不會重複建立。
+    其他行程同時建立同名資料夾時，一律使用最早建立的，多建的移到垃圾桶
+    """
+    cache = get_drive_folder_cache()
+    key = (parent_folder_id, folder_name)
+    folder_id = cache['folders'].get(key)
+    if folder_id:
+        return folder_id
+    
+    with cache['lock']:
+        folder_id = cache['folders'].get(key)
+        if folder_id:
+            return folder_id
         
-        previous_parents = ",".join(file.get('parents', []))
+        existing = _find_drive_folders(drive_service, parent_folder_id, folder_name)
+        if existing:
+            folder_id = existing[0]
+        else:
+            created = drive_service.files().create(
+                body={
+                    'name': folder_name,
+                    'mimeType': 'application/vnd.google-apps.folder',
+                    'parents': [parent_folder_id]
+                },
+                fields='id',
+                supportsAllDrives=True
+            ).execute()['id']
+            folder_id = (_find_drive_folders(drive_service, parent_folder_id, folder_name) or [created])[0]
+            if folder_id != created:
+                drive_service.files().update(fileId=created, body={'trashed': True}, supportsAllDrives=True).execute()
+        
+        cache['folders'][key] = folder_id
+        replica = get_replica()
+        with replica['lock'], replica['conn']:
+            replica['conn'].execute(
+                'INSERT OR REPLACE INTO drive_folders (Parent_ID, Name, Folder_ID) VALUES (?, ?, ?)',
+                (parent_folder_id, folder_name, folder_id)
+            )
+    return folder_id
+
+def forget_drive_folders(keys):
+    """從快取移除資料夾 (例如資料夾已被手動刪除)，下次使用時重新查詢或建立"""
+    cache = get_drive_folder_cache()
+    replica = get_replica()
+    with cache['lock']:
+        for key in keys:
+            cache['folders'].pop(key, None)
+        with replica['lock'], replica['conn']:
+            replica['conn'].executemany(
+                'DELETE FROM drive_folders WHERE Parent_ID = ? AND Name = ?', list(keys)
+            )
+
+def document_folder_keys(root_folder_id, doc_date):
+    """
+    公文附件所在資料夾的名稱：根資料夾 / YYYY / YYYY-MM
+    回傳 (年資料夾名稱, 月資料夾名稱)，日期無法解析時回傳 None (放在根資料夾)
+    """
+    try:
+        parsed = datetime.strptime(str(doc_date)[:10], '%Y-%m-%d')
+    except ValueError:
+        return None
+    return parsed.strftime('%Y'), parsed.strftime('%Y-%m')
+
+def get_document_folder(drive_service, root_folder_id, doc_date):
+    """取得 (必要時建立) 公文日期對應的 年/年-月 資料夾 ID"""
+    names = document_folder_keys(root_folder_id, doc_date)
+    if not names:
+        return root_folder_id
+    year_name, month_name = names
+    year_id = resolve_drive_folder(drive_service, root_folder_id, year_name)
+    return resolve_drive_folder(drive_service, year_id, month_name)
+
+def get_or_create_subfolder(drive_service, parent_folder_id, folder_name):
+    """在指定資料夾內取得或建立子資料夾"""
+    try:
+        return resolve_drive_folder(drive_service, parent_folder_id, folder_name)
+    except Exception as e:
+        st.error(f"建立資料夾失敗: {str(e)}")
+        return None
+
+@st.cache_resource
+def get_drive_migration_state():
+    """背景搬移舊附件到 年/年-月 資料夾的進度 (行程共用)"""
+    return {
+        'status': 'idle',
+        'moved': 0,
+        'failed': 0,
+        'skipped': 0,
+        'started_at': None,
+        'finished_at': None,
+        'error': None,
+    }
+
+def list_root_drive_files(drive_service, root_folder_id):
+    """列出根資料夾內 (不含子資料夾) 的所有檔案 ID"""
+    file_ids = []
+    page_token = None
+    while True:
+        response = drive_service.files().list(
+            q=(f"'{root_folder_id}' in parents and trashed=false "
+               f"and mimeType!='application/vnd.google-apps.folder'"),
+            spaces='drive',
+            fields='nextPageToken, files(id)',
+            pageSize=DRIVE_MIGRATION_PAGE_SIZE,
+            pageToken=page_token,
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True
+        ).execute()
+        file_ids.extend(file['id'] for file in response.get('files', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return file_ids
+
+def migrate_drive_files_to_date_folders(drive_service, root_folder_id, state):
+    """
+    把根資料夾內的舊附件依公文日期搬到 年/年-月 資料夾
+    先列完根資料夾再搬移，避免邊搬邊分頁漏掉檔案；找不到對應公文或日期的檔案留在原處
+    """
+    file_ids = list_root_drive_files(drive_service, root_folder_id)
+    dates = query_replica(
+        "SELECT Drive_File_ID, Date FROM documents WHERE Drive_File_ID != ''"
+    ).set_index('Drive_File_ID')['Date'].to_dict()
+    
+    groups = {}
+    for file_id in file_ids:
+        names = document_folder_keys(root_folder_id, dates.get(file_id, ''))
+        if not names:
+            state['skipped'] += 1
+            continue
+        groups.setdefault(names, []).append(file_id)
+    
+    for names, group in groups.items():
+        folder_id = get_document_folder(drive_service, root_folder_id, f"{names[1]}-01")
+        results = move_files_to_folder(drive_service, group, folder_id, root_folder_id)
+        moved = sum(1 for result in results.values() if result['ok'])
+        state['moved'] += moved
+        state['failed'] += len(results) - moved
+
+@st.cache_resource
+def start_drive_folder_migration(_credentials, root_folder_id):
+    """啟動背景執行緒搬移舊附件 (每個行程、每個根資料夾只執行一次)"""
+    state = get_drive_migration_state()
+    
+    def migrate():
+        state.update(status='running', started_at=time.time())
+        try:
+            migrate_drive_files_to_date_folders(build_drive_service(_credentials), root_folder_id, state)
+            state['status'] = 'done'
+        except Exception as e:
+            state.update(status='failed', error=str(e))
+            print(f"搬移附件到日期資料夾失敗: {str(e)}")
+        state['finished_at'] = time.time()
+    
+    thread = threading.Thread(target=migrate, name='drive-folder-migration', daemon=True)
+    thread.start()
+    return thread
+
+# ===== Drive 批次操作 =====
+def _drive_error_status(exception):
+    """取得 Drive 錯誤的 HTTP 狀態碼 (不是 HTTP 錯誤時回傳 None)"""
+    resp = getattr(exception, 'resp', None)
+    return getattr(resp, 'status', None)
+
+def _is_retryable_drive_error(exception):
+    """配額 (429、403 rateLimitExceeded) 與伺服器錯誤可以重試，其餘 (如 404) 直接視為失敗"""
+    status = _drive_error_status(exception)
+    if status is None:
+        return True   # 連線中斷等非 HTTP 錯誤
+    if status == 403:
+        content = getattr(exception, 'content', b'') or b''
+        return b'rateLimitExceeded' in content or b'userRateLimitExceeded' in content
+    return status in DRIVE_RETRY_STATUSES
+
+def run_drive_batch(drive_service, requests, retries=DRIVE_BATCH_RETRIES):
+    """
+    用 Drive 的批次 HTTP 端點執行多個呼叫，每 DRIVE_BATCH_LIMIT 個合併成一次 HTTP 要求
+    requests 為 {key: HttpRequest}，key 用來對應結果 (例如檔案 ID)
+    部分失敗時只重試可重試的項目 (指數退避)，回傳每個 key 的結果：
+    {'ok': True, 'response': 回應} 或 {'ok': False, 'error': 訊息, 'status': HTTP 狀態碼}
+    """
+    results = {}
+    pending = dict(requests)
+    
+    for attempt in range(retries + 1):
+        retry = {}
+        keys = list(pending)
+        for start in range(0, len(keys), DRIVE_BATCH_LIMIT):
+            chunk = keys[start:start + DRIVE_BATCH_LIMIT]
+            
+            def on_response(request_id, response, exception, chunk=chunk):
+                key = chunk[int(request_id)]
+                if exception is None:
+                    results[key] = {'ok': True, 'response': response}
+                elif attempt < retries and _is_retryable_drive_error(exception):
+                    retry[key] = pending[key]
+                else:
+                    results[key] = {'ok': False, 'error': str(exception), 'status': _drive_error_status(exception)}
+            
+            batch = drive_service.new_batch_http_request(callback=on_response)
+            for index, key in enumerate(chunk):
+                batch.add(pending[key], request_id=str(index))
+            try:
+                batch.execute()
+            except Exception as e:
+                # 整批失敗 (例如批次端點本身回傳錯誤)：尚未有結果的項目一起重試或記為失敗
+                for key in chunk:
+                    if key in results or key in retry:
+                        continue
+                    if attempt < retries and _is_retryable_drive_error(e):
+                        retry[key] = pending[key]
+                    else:
+                        results[key] = {'ok': False, 'error': str(e), 'status': _drive_error_status(e)}
         
-        # 移動到新資料夾
-        drive_service.files().update(
+        if not retry:
+            break
+        pending = retry
+        time.sleep(min(DRIVE_RETRY_BASE_DELAY * 2 ** attempt, DRIVE_RETRY_MAX_DELAY) + random.uniform(0, 0.5))
+    
+    return {key: results[key] for key in requests}
+
+def get_drive_files_metadata(drive_service, file_ids, fields='id, name, parents, mimeType, size'):
+    """批次取得多個檔案的中繼資料，回傳每個檔案 ID 的結果 (格式同 run_drive_batch)"""
+    return run_drive_batch(drive_service, {
+        file_id: drive_service.files().get(fileId=file_id, fields=fields, supportsAllDrives=True)
+        for file_id in dict.fromkeys(file_ids) if file_id
+    })
+
+def move_files_to_folder(drive_service, file_ids, dest_folder_id, source_folder_id=None):
+    """
+    把多個檔案批次移到另一個資料夾，回傳每個檔案 ID 的結果 (格式同 run_drive_batch)
+    source_folder_id 為檔案目前所在的資料夾；不知道時先批次查詢各檔案的父資料夾
+    """
+    file_ids = list(dict.fromkeys(file_id for file_id in file_ids if file_id))
+    results = {}
+    if source_folder_id:
+        parents = {file_id: source_folder_id for file_id in file_ids}
+    else:
+        parents = {}
+        for file_id, result in get_drive_files_metadata(drive_service, file_ids, fields='id, parents').items():
+            if result['ok']:
+                parents[file_id] = ','.join(result['response'].get('parents', []))
+            else:
+                results[file_id] = result
+    
+    results.update(run_drive_batch(drive_service, {
+        file_id: drive_service.files().update(
             fileId=file_id,
             addParents=dest_folder_id,
             removeParents=previous_parents,
             supportsAllDrives=True,
             fields='id, parents'
-        ).execute()
-        
-        return True
-    except Exception as e:
-        st.error(f"移動檔案失敗: {str(e)}")
+        )
+        for file_id, previous_parents in parents.items()
+    }))
+    for file_id, result in results.items():
+        if not result['ok']:
+            print(f"移動檔案失敗 {file_id}: {result['error']}")
+    return results
+
+def move_file_to_folder(drive_service, file_id, dest_folder_id):
+    """移動檔案到另一個資料夾"""
+    result = move_files_to_folder(drive_service, [file_id], dest_folder_id).get(file_id)
+    if not result or not result['ok']:
+        st.error(f"移動檔案失敗: {result['error'] if result else '找不到檔案'}")
         return False
+    return True
 
-def download_from_drive(drive_service, file_id):
-    """從 Google Drive 下載檔案"""
-    try:
-        request = drive_service.files().get_media(
+def set_drive_permissions(drive_service, file_ids, permission, send_notification=False):
+    """
+    批次為多個檔案新增同一個權限 (例如 {'type': 'user', 'role': 'reader', 'emailAddress': ...})
+    回傳每個檔案 ID 的結果 (格式同 run_drive_batch)
+    """
+    return run_drive_batch(drive_service, {
+        file_id: drive_service.permissions().create(
             fileId=file_id,
-            supportsAllDrives=True
+            body=permission,
+            sendNotificationEmail=send_notification,
+            supportsAllDrives=True,
+            fields='id'
         )
-        file_bytes = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_bytes, request)
-        
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
+        for file_id in dict.fromkeys(file_ids) if file_id
+    })
+
+# ===== 批次匯入 =====
+def read_bulk_manifest(csv_source):
+    """
+    讀取批次匯入的中繼資料 CSV (bytes 或檔案路徑)
+    必要欄位：filename, date (YYYY-MM-DD), type, agency, subject；選填：parent_id, doc_id
+    回傳 (資料列串列, 錯誤訊息串列)
+    """
+    if isinstance(csv_source, (bytes, bytearray)):
+        text = bytes(csv_source).decode('utf-8-sig')
+    else:
+        with open(csv_source, encoding='utf-8-sig') as f:
+            text = f.read()
+    
+    reader = csv.DictReader(io.StringIO(text))
+    missing = [col for col in BULK_REQUIRED_COLUMNS if col not in (reader.fieldnames or [])]
+    if missing:
+        return [], [f"CSV 缺少欄位: {', '.join(missing)}"]
+    
+    entries = []
+    errors = []
+    for line_no, record in enumerate(reader, start=2):
+        entry = {col: (record.get(col) or '').strip() for col in BULK_REQUIRED_COLUMNS + BULK_OPTIONAL_COLUMNS}
+        empty = [col for col in BULK_REQUIRED_COLUMNS if not entry[col]]
+        if empty:
+            errors.append(f"第 {line_no} 列缺少 {', '.join(empty)}")
+            continue
+        try:
+            datetime.strptime(entry['date'], '%Y-%m-%d')
+        except ValueError:
+            errors.append(f"第 {line_no} 列日期格式錯誤 (需為 YYYY-MM-DD): {entry['date']}")
+            continue
+        if entry['type'] not in DOCUMENT_TYPES:
+            errors.append(f"第 {line_no} 列公文類型不正確: {entry['type']}")
+            continue
+        entries.append(entry)
+    
+    return entries, errors
+
+def open_bulk_files(source):
+    """
+    列出 ZIP (bytes、檔案物件或路徑) 或資料夾中的 PDF，回傳 {檔名: 讀取函式}
+    上傳時才讀取各檔內容，不會一次把整批檔案載入記憶體
+    CSV 只用檔名對應檔案：不同子資料夾中有同名的 PDF 時抛出 ValueError，不猜測要用哪一個
+    """
+    files = {}
+    paths = {}
+    
+    def add(name, path, reader):
+        if name in files:
+            raise ValueError(f"有多個同名的 PDF，請改名後再匯入: {name} ({paths[name]}、{path})")
+        files[name] = reader
+        paths[name] = path
+    
+    if isinstance(source, str) and os.path.isdir(source):
+        def read_path(path):
+            with open(path, 'rb') as f:
+                return f.read()
+        
+        for root, _, names in os.walk(source):
+            for name in names:
+                if name.lower().endswith('.pdf'):
+                    path = os.path.join(root, name)
+                    add(name, path, lambda path=path: read_path(path))
+        return files
+    
+    archive = zipfile.ZipFile(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    lock = threading.Lock()
+    
+    def read_member(member):
+        with lock:
+            return archive.read(member)
+    
+    for member in archive.namelist():
+        if member.lower().endswith('.pdf') and not member.endswith('/'):
+            add(os.path.basename(member), member, lambda member=member: read_member(member))
+    return files
+
+def reserve_document_ids(worksheet, entries, df=None):
+    """
+    一次讀取現有文號，為整批公文配發文號 (規則同 generate_document_id)
+    有填 doc_id 的沿用；有 parent_id 的產生回覆文號；其餘依日期產生流水號
+    df 為已讀取的公文資料 (需含 ID、Parent_ID 欄)，沒給時從工作表讀取
+    回傳與 entries 對應的文號串列，文號重複時該筆為 None
+    """
+    if df is None:
+        df = get_documents(worksheet, ['ID', 'Parent_ID'])
+    ids = df['ID'].astype(str) if not df.empty else pd.Series([], dtype=str)
+    taken = set(ids)
+    reply_counts = df['Parent_ID'].astype(str).value_counts().to_dict() if not df.empty else {}
+    day_counts = ids[ids.str.startswith('金展詢')].str[3:11].value_counts().to_dict()
+    
+    reserved = []
+    for entry in entries:
+        if entry.get('doc_id'):
+            doc_id = entry['doc_id'] if entry['doc_id'] not in taken else None
+        elif entry.get('parent_id'):
+            parent_id = entry['parent_id']
+            while True:
+                reply_counts[parent_id] = reply_counts.get(parent_id, 0) + 1
+                doc_id = f"金展回{str(reply_counts[parent_id] + 1).zfill(2)}{parent_id}"
+                if doc_id not in taken:
+                    break
+        else:
+            date_code = entry['date'].replace('-', '')
+            while True:
+                day_counts[date_code] = day_counts.get(date_code, 0) + 1
+                doc_id = f"金展詢{date_code}{str(day_counts[date_code]).zfill(3)}"
+                if doc_id not in taken:
+                    break
         
-        file_bytes.seek(0)
-        return file_bytes.read()
+        if doc_id:
+            taken.add(doc_id)
+        reserved.append(doc_id)
+    
+    return reserved
+
+def _handle_bulk_append_failure(docs_sheet, credentials, jobs, uploaded, rows, error, failed):
+    """
+    append_rows 失敗後的處理，回傳實際已寫入的列
+    重新讀取 ID 欄確認哪些列已寫入 (分片時可能只寫入部分分片，或寫入成功但回應逾時)；
+    只把沒寫入的公文的檔案移到垃圾桶，移不掉的列出檔案 ID 供手動刪除
+    無法確認時不刪除任何檔案，只回報
+    """
+    indexes = sorted(uploaded)
+    try:
+        present = set(docs_sheet.col_values(get_sheet_headers(docs_sheet, docs_sheet.id).index('ID') + 1)[1:])
     except Exception as e:
-        st.error(f"下載失敗: {str(e)}")
-        return None
+        print(f"無法確認批次匯入寫入了哪些公文: {str(e)}")
+        for index in indexes:
+            failed.append((
+                jobs[index][0]['filename'],
+                f"寫入試算表失敗: {error}；無法確認公文 {jobs[index][1]} 是否已寫入，"
+                f"已上傳的檔案 {uploaded[index]} 保留，請確認後手動處理"
+            ))
+        return []
+    
+    written = [row for row in rows if row[0] in present]
+    missing = [index for index in indexes if jobs[index][1] not in present]
+    trashed = {}
+    if missing:
+        drive_service = build_drive_service(credentials)
+        trashed = run_drive_batch(drive_service, {
+            uploaded[index]: drive_service.files().update(
+                fileId=uploaded[index], body={'trashed': True}, supportsAllDrives=True
+            )
+            for index in missing
+        })
+    for index in missing:
+        reason = f"寫入試算表失敗: {error}"
+        if not trashed.get(uploaded[index], {}).get('ok'):
+            reason += f"；已上傳的檔案 {uploaded[index]} 未能移到垃圾桶，請手動刪除"
+        failed.append((jobs[index][0]['filename'], reason))
+    return written
+
+def run_bulk_import(docs_sheet, credentials, folder_id, entries, files, created_by,
+                    workers=BULK_UPLOAD_WORKERS, progress=None):
+    """
+    批次匯入公文
+    - 文號一次配發；對話串位置依上傳前讀取的公文資料計算 (不依賴本機副本)
+    - PDF 以多個執行緒同時上傳 (每個執行緒各自建立 Drive 服務，避免共用連線)
+    - 整批只呼叫一次 append_rows；OCR_Status 為 pending，會排入辨識佇列
+    - 上層公文須已存在或是同一批中較前面的公文；寫入試算表失敗時把沒寫入的公文的檔案移到垃圾桶
+    progress(完成數, 總數) 用來回報上傳進度
+    回傳 {'imported': 文號串列, 'failed': [(檔名, 原因)], 'seconds': 秒數, 'per_minute': 每分鐘筆數}
+    """
+    start = time.perf_counter()
+    failed = []
+    
+    existing = get_documents(docs_sheet, ['ID', 'Parent_ID', 'Root_ID', 'Depth'])
+    known = thread_positions_from_frame(existing)
+    
+    jobs = []
+    batch_ids = set()
+    for entry, doc_id in zip(entries, reserve_document_ids(docs_sheet, entries, existing)):
+        parent_id = entry.get('parent_id', '')
+        if doc_id is None:
+            failed.append((entry['filename'], f"文號 {entry.get('doc_id')} 已存在"))
+        elif parent_id and parent_id not in known and parent_id not in batch_ids:
+            failed.append((entry['filename'], f"上層公文 {parent_id} 不存在"))
+        elif entry['filename'] not in files:
+            failed.append((entry['filename'], "ZIP 或資料夾中找不到此檔案"))
+        else:
+            jobs.append((entry, doc_id))
+            batch_ids.add(doc_id)
+    
+    def plan_positions(indexes):
+        # 依 CSV 順序計算 (上層公文可以是同一批中較前面的公文)
+        positions = {}
+        for index in indexes:
+            entry, doc_id = jobs[index]
+            positions[doc_id] = get_thread_position(
+                doc_id, entry.get('parent_id', ''), ChainMap(positions, known), replica=False
+            )
+        return positions
+    
+    positions = plan_positions(range(len(jobs)))
+    
+    local = threading.local()
+    
+    def upload(entry, doc_id):
+        if not hasattr(local, 'drive_service'):
+            local.drive_service = build_drive_service(credentials)
+        file_bytes = files[entry['filename']]()
+        filename = f"{doc_id}_{entry['agency']}_{entry['subject']}.pdf"
+        return create_document_file(local.drive_service, file_bytes, filename, folder_id, entry['date'])
+    
+    uploaded = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(upload, entry, doc_id): index for index, (entry, doc_id) in enumerate(jobs)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            index = futures[future]
+            try:
+                uploaded[index] = future.result()
+            except Exception as e:
+                failed.append((jobs[index][0]['filename'], f"上傳失敗: {str(e)}"))
+            if progress:
+                progress(done, len(jobs))
+    
+    # 有上傳失敗時重新計算，上層公文沒匯入的回覆自成對話串
+    if len(uploaded) < len(jobs):
+        positions = plan_positions(sorted(uploaded))
+    
+    # 依 CSV 順序寫入
+    created_at = datetime.now().isoformat()
+    rows = []
+    imported = []
+    for index in sorted(uploaded):
+        entry, doc_id = jobs[index]
+        rows.append(build_document_row({
+            'id': doc_id,
+            'date': entry['date'],
+            'type': entry['type'],
+            'agency': entry['agency'],
+            'subject': entry['subject'],
+            'parent_id': entry.get('parent_id', ''),
+            'drive_file_id': uploaded[index],
+            'created_at': created_at,
+            'created_by': created_by,
+            'root_id': positions[doc_id][0],
+            'depth': positions[doc_id][1],
+        }))
+        imported.append(doc_id)
+    
+    written = rows
+    if rows:
+        try:
+            docs_sheet.append_rows(rows)
+        except Exception as e:
+            written = _handle_bulk_append_failure(docs_sheet, credentials, jobs, uploaded, rows, str(e), failed)
+            imported = [row[0] for row in written]
+    
+    # 本機副本與佇列的更新失敗不影響已寫入的公文，背景核對副本時會補上
+    try:
+        headers = get_sheet_headers(docs_sheet, docs_sheet.id)
+        for row in written:
+            note_document_write(row=dict(zip(headers, row)))
+    except Exception as e:
+        print(f"批次匯入後更新本機副本失敗: {str(e)}")
+    
+    seconds = time.perf_counter() - start
+    return {
+        'imported': imported,
+        'failed': failed,
+        'seconds': seconds,
+        'per_minute': len(imported) / seconds * 60 if seconds > 0 else 0.0,
+    }
+
+# ===== 匯出 =====
+def open_replica_reader():
+    """另外開一個唯讀連線讀取副本 (匯出時間長，不佔用共用連線的 lock)"""
+    path = get_setting('REPLICA_PATH', REPLICA_PATH)
+    return sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+
+def export_root_filter(conditions=None, facets=None, root_ids=None):
+    """
+    匯出範圍 (原始公文的 WHERE 子句與參數)
+    root_ids 直接指定原始公文 (全文搜尋結果)；conditions / facets 同查詢條件，
+    範圍為有公文符合條件的對話串；都沒給時為全部公文
+    """
+    if root_ids is not None:
+        return 'WHERE ID IN (SELECT value FROM json_each(?))', [json.dumps(list(root_ids))]
+    if conditions or facets:
+        # 有公文符合條件的對話串 (同查詢結果)
+        where, params = _search_conditions(facets=facets, **(conditions or {}))
+        return f'WHERE ID IN (SELECT Root_ID FROM documents {where})', params
+    return "WHERE (Parent_ID IS NULL OR Parent_ID = '' OR Parent_ID NOT IN (SELECT ID FROM documents))", []
+
+def iter_export_rows(root_where='', root_params=(), batch_size=EXPORT_BATCH_SIZE):
+    """
+    逐批產生要匯出的公文 (EXPORT_COLUMNS 順序的 tuple 串列)
+    每個原始公文之後接著它的對話串，Root_ID / Depth 記錄在對話串中的位置
+    使用獨立的唯讀連線與 fetchmany，記憶體只保留一批
+    """
+    conn = open_replica_reader()
+    try:
+        cursor = conn.execute(
+            f"""
+            WITH RECURSIVE tree(ID, Root_ID, Depth, path) AS (
+                SELECT ID, ID, 0, printf('%010d', CAST(Row_Num AS INTEGER))
+                FROM documents {root_where}
+                UNION ALL
+                SELECT d.ID, t.Root_ID, t.Depth + 1,
+                       t.path || '/' || printf('%010d', CAST(d.Row_Num AS INTEGER))
+                FROM documents d JOIN tree t ON d.Parent_ID = t.ID
+                WHERE t.Depth < 50
+            )
+            SELECT tree.Root_ID AS Root_ID, tree.Depth AS Depth, d.*
+            FROM tree JOIN documents d ON d.ID = tree.ID
+            ORDER BY tree.path
+            """,
+            list(root_params)
+        )
+        names = [desc[0] for desc in cursor.description]
+        positions = [names.index(col) if col in names else None for col in EXPORT_COLUMNS]
+        
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [
+                tuple('' if pos is None or row[pos] is None else row[pos] for pos in positions)
+                for row in rows
+            ]
+    finally:
+        conn.close()
+
+def write_export_csv(batches, stream):
+    """把匯出資料逐批寫成 CSV (UTF-8 BOM，Excel 可直接開啟)，回傳筆數"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    writer = csv.writer(text)
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for batch in batches:
+        writer.writerows(batch)
+        count += len(batch)
+    text.flush()
+    text.detach()
+    return count
+
+def write_export_parquet(batches, stream):
+    """把匯出資料逐批寫成 Parquet (每批一個 row group)，回傳筆數"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    schema = pa.schema([
+        (col, pa.int32() if col == 'Depth' else pa.string()) for col in EXPORT_COLUMNS
+    ])
+    count = 0
+    with pq.ParquetWriter(stream, schema, compression='zstd') as writer:
+        for batch in batches:
+            columns = list(zip(*batch))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            ))
+            count += len(batch)
+    return count
+
+def iter_attachments(credentials, items, workers=EXPORT_DOWNLOAD_WORKERS):
+    """
+    同時下載多個附件，依原順序產生 (文號, 檔案內容, 錯誤訊息)
+    進行中的下載最多 workers * 2 個，記憶體不隨附件總數增加
+    """
+    local = threading.local()
+    
+    def fetch(file_id):
+        if not hasattr(local, 'drive_service'):
+            local.drive_service = build_drive_service(credentials)
+        return fetch_drive_file(local.drive_service, file_id)
+    
+    def result(doc_id, future):
+        try:
+            return doc_id, future.result(), None
+        except Exception as e:
+            return doc_id, None, str(e)
+    
+    window = deque()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for doc_id, file_id in items:
+            window.append((doc_id, executor.submit(fetch, file_id)))
+            if len(window) >= workers * 2:
+                yield result(*window.popleft())
+        while window:
+            yield result(*window.popleft())
+
+def export_documents(stream, fmt='csv', include_attachments=False, credentials=None,
+                     root_where='', root_params=(), progress=None):
+    """
+    匯出公文與對話串結構
+    - fmt: 'csv' 或 'parquet'
+    - include_attachments: 輸出 ZIP，內含資料檔與 attachments/ 下的 PDF
+    progress(階段, 已完成數) 用來回報進度
+    回傳 {'documents': 筆數, 'attachments': 附件數, 'failed': [(文號, 原因)]}
+    """
+    writer = write_export_parquet if fmt == 'parquet' else write_export_csv
+    
+    def batches():
+        done = 0
+        for batch in iter_export_rows(root_where, root_params):
+            done += len(batch)
+            if progress:
+                progress('公文', done)
+            yield batch
+    
+    if not include_attachments:
+        return {'documents': writer(batches(), stream), 'attachments': 0, 'failed': []}
+    
+    result = {'documents': 0, 'attachments': 0, 'failed': []}
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        with archive.open(f'documents.{fmt}', 'w', force_zip64=True) as data_file:
+            result['documents'] = writer(batches(), data_file)
+        
+        # 再掃一次取得附件清單 (不把整份清單留在記憶體)
+        file_col = EXPORT_COLUMNS.index('Drive_File_ID')
+        items = (
+            (row[0], row[file_col])
+            for batch in iter_export_rows(root_where, root_params)
+            for row in batch if row[file_col]
+        )
+        for doc_id, content, error in iter_attachments(credentials, items):
+            if error:
+                result['failed'].append((doc_id, error))
+                continue
+            safe_name = str(doc_id).replace('/', '_').replace('\\', '_')
+            archive.writestr(f'attachments/{safe_name}.pdf', content, compress_type=zipfile.ZIP_STORED)
+            result['attachments'] += 1
+            if progress:
+                progress('附件', result['attachments'])
+    
+    return result
+
+# ===== 封存 (冷資料) =====
+@st.cache_resource
+def get_archive_index_sheet(_spreadsheet):
+    """封存索引工作表 (沒有時建立)；只在搜尋封存或執行封存時讀取，不影響一般頁面"""
+    try:
+        return _spreadsheet.worksheet(ARCHIVE_INDEX_TITLE)
+    except gspread.WorksheetNotFound:
+        index_sheet = _spreadsheet.add_worksheet(title=ARCHIVE_INDEX_TITLE, rows=1000, cols=len(ARCHIVE_INDEX_COLUMNS))
+        index_sheet.append_row(ARCHIVE_INDEX_COLUMNS)
+        return index_sheet
+
+@st.cache_resource
+def get_archive_state():
+    """封存的行程共用狀態：執行中的 lock、索引載入時間、上次封存結果"""
+    return {
+        'lock': threading.Lock(),
+        'index_loaded_at': 0.0,
+        'last_run': None,
+    }
+
+def load_archive_index(index_sheet, force=False):
+    """把封存索引載入副本的 archived_documents 表 (超過 ARCHIVE_INDEX_TTL 或 force 時重新讀取)"""
+    state = get_archive_state()
+    now = time.time()
+    if not force and now - state['index_loaded_at'] < ARCHIVE_INDEX_TTL:
+        return
+    index_df = _sheet_values_to_frame(index_sheet.get_all_values())
+    if index_df.empty:
+        index_df = pd.DataFrame(columns=ARCHIVE_INDEX_COLUMNS)
+    replica = get_replica()
+    with replica['lock']:
+        _replace_table(replica['conn'], 'archived_documents', index_df)
+    state['index_loaded_at'] = now
+
+def search_archive(index_sheet, limit=ARCHIVE_RESULT_LIMIT, **conditions):
+    """
+    在封存索引上查詢 (條件同 _search_conditions，關鍵字只比對主旨)
+    回傳 (符合的對話串數, 最多 limit 筆對話串的原始公文)
+    """
+    load_archive_index(index_sheet)
+    where, params = _search_conditions(**conditions)
+    roots = f'FROM archived_documents WHERE ID IN (SELECT Root_ID FROM archived_documents {where})'
+    total = int(query_replica(f'SELECT COUNT(*) AS n {roots}', params)['n'].iloc[0])
+    docs = query_replica(f'SELECT * {roots} ORDER BY Date DESC LIMIT ?', params + [int(limit)])
+    return total, docs
+
+@st.cache_data(ttl=600, max_entries=ARCHIVE_CACHED_FILES, show_spinner=False)
+def get_archive_file(_drive_service, file_id):
+    """下載並讀取一個年度的封存檔 (快取，展開同一年度的其他對話串不必重新下載)"""
+    return pd.read_parquet(io.BytesIO(fetch_drive_file(_drive_service, file_id)))
+
+def get_archived_thread(drive_service, root_id):
+    """從封存檔取出整個對話串 (格式同 get_conversation_thread_replica)，找不到時回傳空串列"""
+    located = query_replica(
+        'SELECT Archive_File_ID FROM archived_documents WHERE ID = ? LIMIT 1', (root_id,)
+    )
+    if located.empty:
+        return []
+    archive_df = get_archive_file(drive_service, located['Archive_File_ID'].iloc[0])
+    records = archive_df[archive_df['Root_ID'] == root_id].to_dict('records')
+    return order_thread_records(records, root_id)
+
+def find_archivable_threads(cutoff):
+    """
+    最後一筆公文的日期早於 cutoff 的對話串，回傳 {封存年度: [Root_ID]}
+    封存年度為對話串最後一筆公文的年度；有日期無法解析的公文的對話串不封存
+    """
+    df = query_replica(
+        """
+        SELECT Root_ID, substr(MAX(Date), 1, 4) AS Archive_Year
+        FROM documents
+        WHERE Root_ID IN (SELECT ID FROM documents)
+        GROUP BY Root_ID
+        HAVING MAX(Date) < ?
+           AND MIN(Date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*') = 1
+        """,
+        (cutoff,)
+    )
+    groups = {}
+    for root_id, year in zip(df['Root_ID'], df['Archive_Year']):
+        groups.setdefault(year, []).append(root_id)
+    return groups
+
+def write_archive_year(drive_service, archive_folder_id, year, new_df):
+    """
+    把公文寫入該年度的封存檔 (Parquet，zstd 壓縮)：已有封存檔時合併後覆寫內容 (同文號以新資料為準)，
+    沒有時建立。回傳封存檔的 Drive 檔案 ID
+    """
+    existing = query_replica(
+        'SELECT Archive_File_ID FROM archived_documents WHERE Archive_Year = ? LIMIT 1', (year,)
+    )
+    file_id = existing['Archive_File_ID'].iloc[0] if not existing.empty else None
+    if file_id:
+        old_df = pd.read_parquet(io.BytesIO(fetch_drive_file(drive_service, file_id)))
+        new_df = pd.concat([old_df[~old_df['ID'].isin(new_df['ID'])], new_df], ignore_index=True)
+    
+    buffer = io.BytesIO()
+    new_df.astype(str).to_parquet(buffer, compression='zstd', index=False)
+    if file_id:
+        replace_drive_file(drive_service, file_id, buffer.getvalue(), ARCHIVE_MIME_TYPE)
+        get_archive_file.clear()
+        return file_id
+    return create_drive_file(
+        drive_service, buffer.getvalue(), f"{ARCHIVE_FILE_PREFIX}{year}.parquet", archive_folder_id,
+        mimetype=ARCHIVE_MIME_TYPE
+    )
+
+def remove_ocr_texts(text_sheet, doc_ids):
+    """從 OCR文字 表刪除指定公文的列"""
+    wanted = set(doc_ids)
+    ids = text_sheet.col_values(1)
+    row_nums = [row_num for row_num, value in enumerate(ids, start=1) if row_num > 1 and value in wanted]
+    delete_worksheet_rows(text_sheet, row_nums)
+    note_sheet_write()
+    get_ocr_texts_by_ids.clear()
+    get_all_ocr_texts.clear()
+
+def archive_old_threads(docs_sheet, text_sheet, index_sheet, drive_service, root_folder_id, years=None):
+    """
+    把最後一筆公文早於 years 年 (預設 ARCHIVE_AFTER_YEARS 設定) 的對話串整串移到封存
+    每個封存年度依序：寫入封存檔 → 重新定位並確認內容 → 寫入封存索引 → 從公文資料與 OCR文字 刪除
+    寫檔期間被刪除或修改的公文整串留在公文資料，不寫索引，下次封存時再處理 (封存檔合併同文號，會以新內容覆蓋)
+    寫入索引後才發現內容變動時撤回該批索引，不會讓同一串同時出現在公文資料與封存搜尋
+    回傳 {封存年度: 公文筆數}
+    """
+    state = get_archive_state()
+    if not state['lock'].acquire(blocking=False):
+        raise RuntimeError("另一個封存作業正在執行")
+    try:
+        years = int(years if years is not None else get_setting('ARCHIVE_AFTER_YEARS', ARCHIVE_AFTER_YEARS))
+        cutoff = (datetime.now() - timedelta(days=365 * years)).strftime('%Y-%m-%d')
+        groups = find_archivable_threads(cutoff)
+        if not groups:
+            state['last_run'] = {'at': datetime.now().isoformat(), 'archived': {}}
+            return {}
+        
+        load_archive_index(index_sheet, force=True)
+        indexed = set(query_replica('SELECT ID FROM archived_documents')['ID'])
+        archive_folder_id = resolve_drive_folder(drive_service, root_folder_id, ARCHIVE_FOLDER_NAME)
+        headers = get_sheet_headers(docs_sheet, docs_sheet.id)
+        archived = {}
+        
+        for year, root_ids in sorted(groups.items()):
+            thread_ids = query_replica(
+                'SELECT ID FROM documents WHERE Root_ID IN (SELECT value FROM json_each(?))',
+                (json.dumps(root_ids),)
+            )['ID'].tolist()
+            located = locate_document_rows(docs_sheet, thread_ids)
+            if not located:
+                continue
+            
+            rows = [row_data + [''] * (len(headers) - len(row_data)) for _, row_data in located.values()]
+            archive_df = pd.DataFrame(rows, columns=headers).drop(columns=['OCR_Text'], errors='ignore')
+            ocr_texts = get_ocr_texts_by_ids(text_sheet, tuple(located))
+            archive_df['OCR_Text'] = archive_df['ID'].map(ocr_texts).fillna('')
+            file_id = write_archive_year(drive_service, archive_folder_id, year, archive_df)
+            
+            # 寫檔期間列號可能已位移，寫索引前重新定位；有公文被刪除或修改的對話串整串略過
+            current, changed = find_changed_documents(docs_sheet, located)
+            if changed:
+                skipped_roots = set(archive_df.loc[archive_df['ID'].isin(changed), 'Root_ID'])
+                print(f"封存 {year} 年時有公文被刪除或修改，略過 {len(skipped_roots)} 串，下次封存再處理：{', '.join(changed)}")
+                archive_df = archive_df[~archive_df['Root_ID'].isin(skipped_roots)]
+                located = {doc_id: current[doc_id] for doc_id in archive_df['ID']}
+                if not located:
+                    continue
+            
+            archived_at = datetime.now().isoformat()
+            index_rows = [
+                [str(record.get(col, '')) for col in ARCHIVE_INDEX_COLUMNS[:-3]] + [year, file_id, archived_at]
+                for record in archive_df.to_dict('records') if record['ID'] not in indexed
+            ]
+            if index_rows:
+                index_sheet.append_rows(index_rows, value_input_option='RAW')
+                note_sheet_write()
+                for index_row in index_rows:
+                    replica_insert('archived_documents', dict(zip(ARCHIVE_INDEX_COLUMNS, index_row)))
+            
+            try:
+                row_nums = relocate_document_rows(docs_sheet, located)
+            except Exception:
+                # 寫索引的同時又有變動：撤回這批索引，整年留待下次封存
+                withdraw_archive_index(index_sheet, [index_row[0] for index_row in index_rows])
+                raise
+            delete_document_rows(docs_sheet, row_nums)
+            for doc_id in located:
+                note_document_write(doc_id, deleted=True)
+            remove_ocr_texts(text_sheet, located)
+            archived[year] = len(located)
+        
+        state['last_run'] = {'at': datetime.now().isoformat(), 'archived': archived}
+        return archived
+    finally:
+        state['lock'].release()
+
+def withdraw_archive_index(index_sheet, doc_ids):
+    """從封存索引 (試算表與本機副本) 移除剛寫入的文號"""
+    if not doc_ids:
+        return
+    doc_ids = set(doc_ids)
+    row_nums = [i for i, value in enumerate(index_sheet.col_values(1), start=1) if i > 1 and value in doc_ids]
+    delete_worksheet_rows(index_sheet, row_nums)
+    note_sheet_write()
+    for doc_id in doc_ids:
+        replica_delete('archived_documents', 'ID', doc_id)
+
+@st.cache_resource
+def start_archive_scheduler(_spreadsheet, _credentials, root_folder_id):
+    """
+    設定 ARCHIVE_AUTO 時啟動背景執行緒，每 ARCHIVE_CHECK_INTERVAL 秒封存一次舊對話串
+    (每個行程只啟動一次)，讓熱資料維持在最近幾年的公文
+    每次封存前重新取得工作表，搬移到年度分片後會改從分片封存
+    """
+    def archive_loop():
+        while True:
+            try:
+                docs_sheet, _, _, text_sheet = init_all_sheets(_spreadsheet)
+                archive_old_threads(docs_sheet, text_sheet, get_archive_index_sheet(_spreadsheet),
+                                    build_drive_service(_credentials), root_folder_id)
+            except Exception as e:
+                print(f"自動封存失敗: {str(e)}")
+            time.sleep(ARCHIVE_CHECK_INTERVAL)
+    
+    thread = threading.Thread(target=archive_loop, name='document-archiver', daemon=True)
+    thread.start()
+    return thread
 
 def check_needs_tracking(df, doc_id, doc_type, doc_date):
     """檢查發文是否需要追蹤"""
@@ -615,10 +4086,9 @@ def check_needs_tracking(df, doc_id, doc_type, doc_date):
         return False
     
     try:
-        doc_date_obj = datetime.strptime(doc_date, '%Y-%m-%d')
-        days_passed = (datetime.now() - doc_date_obj).days
+        days_passed = days_since(doc_date)
         
-        if days_passed <= 7:
+        if days_passed is None or days_passed <= 7:
             return False
         
         replies = df[df['Parent_ID'] == doc_id]
@@ -702,15 +4172,15 @@ def filter_recent_documents(df, months=3):
         return df
     
     try:
-        from datetime import timedelta
-        
         # 計算日期門檻
         threshold_date = datetime.now() - timedelta(days=months * 30)
         
-        # 篩選近 N 個月的公文
-        recent_docs = df[
-            pd.to_datetime(df['Date'], errors='coerce') >= threshold_date
-        ]
+        # 篩選近 N 個月的公文 (型別化資料框直接使用已解析的日期)
+        if 'Date_Parsed' in df.columns:
+            dates = df['Date_Parsed']
+        else:
+            dates = pd.to_datetime(df['Date'], errors='coerce', format='ISO8601')
+        recent_docs = df[dates >= threshold_date]
         
         return recent_docs
     except Exception as e:
@@ -718,9 +4188,20 @@ def filter_recent_documents(df, months=3):
         return df
 
 # ===== OCR 相關函數 =====
+@st.cache_resource
+def get_vision_client():
+    """建立 Vision API 用戶端 (每個行程只建立一次)"""
+    from google.cloud import vision
+    from google.oauth2 import service_account
+    
+    credentials_dict = dict(st.secrets['gcp_service_account'])
+    credentials = service_account.Credentials.from_service_account_info(credentials_dict)
+    return vision.ImageAnnotatorClient(credentials=credentials)
+
 def ocr_pdf_from_drive(drive_service, file_id):
     """
-    從 Google Drive 下載 PDF 並進行 OCR 辨識
+    從 Google Drive 下載 PDF 並一次辨識整份 (不記錄進度)
+    辨識佇列改用 run_ocr_slice 逐頁記錄、分次完成
     """
     try:
         # 檢查是否有 Google Cloud Vision API 設定
@@ -728,71 +4209,191 @@ def ocr_pdf_from_drive(drive_service, file_id):
             print("OCR 辨識失敗: 未設定 Google Cloud Vision API")
             return None
         
-        from google.cloud import vision
-        from google.oauth2 import service_account
-        
-        # 使用 service account 認證
-        credentials_dict = dict(st.secrets['gcp_service_account'])
-        credentials = service_account.Credentials.from_service_account_info(credentials_dict)
-        
         # 1. 從 Drive 下載 PDF
         pdf_bytes = download_from_drive(drive_service, file_id)
         if not pdf_bytes:
             return None
         
         # 2. 使用 Vision API 辨識
-        client = vision.ImageAnnotatorClient(credentials=credentials)
+        client = get_vision_client()
         
-        # 將 PDF 轉成圖片並辨識每一頁
-        all_text = []
-        
-        # 使用 PyMuPDF 將 PDF 轉成圖片
+        # 使用 PyMuPDF 將 PDF 轉成圖片並辨識每一頁
         if not PDF_PREVIEW_AVAILABLE:
             return None
             
         import fitz
         doc = fitz.open(stream=pdf_bytes, filetype="pdf")
         
-        # 限制最多辨識 20 頁 (避免成本過高)
-        max_pages = min(20, len(doc))
-        
-        for page_num in range(max_pages):
-            # 取得頁面
-            page = doc[page_num]
-            
-            # 轉成圖片 (PNG, 300 DPI 提高準確度)
-            pix = page.get_pixmap(dpi=300)
-            img_bytes = pix.tobytes("png")
-            
-            # 呼叫 Vision API
-            image = vision.Image(content=img_bytes)
-            response = client.text_detection(image=image)
-            
-            if response.text_annotations:
-                # 第一個結果是完整的文字
-                page_text = response.text_annotations[0].description
-                all_text.append(f"--- 第 {page_num + 1} 頁 ---\n{page_text}")
-        
+        # 限制最多辨識的頁數 (避免成本過高)
+        page_limit = get_ocr_page_limit()
+        max_pages = min(page_limit, len(doc)) if page_limit else len(doc)
+        texts = {page_num: ocr_pdf_page(client, doc[page_num]) for page_num in range(max_pages)}
         doc.close()
         
         # 合併所有頁面的文字
-        full_text = "\n\n".join(all_text)
-        
-        # 限制字數 (Google Sheets 單一儲存格最多 50,000 字元)
-        if len(full_text) > 45000:
-            full_text = full_text[:45000] + "\n\n...(文字過長,已截斷)"
+        full_text = join_ocr_pages(texts, max_pages)
         
+        # 不需截斷：寫入時壓縮，單一儲存格放不下時分成多格 (見 encode_text_cells)
         return full_text
         
     except Exception as e:
         print(f"OCR 辨識失敗: {str(e)}")
         return None
 
+def ocr_status_kind(status):
+    """OCR_Status 的狀態部分 (去掉進度，例如 'pending 3/40' → 'pending')"""
+    return str(status or '').split(' ', 1)[0]
+
+def ocr_status_progress(status):
+    """OCR_Status 記錄的頁數進度 (已完成頁數, 總頁數)，沒有進度時回傳 None"""
+    parts = str(status or '').split(' ', 1)
+    if len(parts) < 2 or '/' not in parts[1]:
+        return None
+    done, total = parts[1].split('/', 1)
+    return int(done), int(total)
+
+def ocr_pdf_page(client, page):
+    """辨識 PDF 的一頁 (轉成 300 DPI 的 PNG 後呼叫 Vision API)，回傳文字 (沒有文字時為空字串)"""
+    from google.cloud import vision
+    
+    with timed_span('ocr.page') as page_span:
+        # 轉成圖片 (PNG, 300 DPI 提高準確度)
+        pix = page.get_pixmap(dpi=300)
+        img_bytes = pix.tobytes("png")
+        page_span['bytes'] = len(img_bytes)
+        
+        # 呼叫 Vision API
+        image = vision.Image(content=img_bytes)
+        with timed_span('vision.text_detection', service='vision', nbytes=len(img_bytes)):
+            response = client.text_detection(image=image)
+    
+    if response.text_annotations:
+        # 第一個結果是完整的文字
+        return response.text_annotations[0].description
+    return ''
+
+def join_ocr_pages(texts, total):
+    """合併各頁文字 (依頁序，略過沒有文字的頁面)"""
+    return "\n\n".join(
+        f"--- 第 {page_num + 1} 頁 ---\n{texts[page_num]}"
+        for page_num in range(total) if texts.get(page_num)
+    )
+
+def get_ocr_page_limit():
+    """每份公文最多辨識的頁數 (避免成本過高，0 為不限制)"""
+    return int(get_setting('OCR_MAX_PAGES', OCR_MAX_PAGES))
+
+@st.cache_resource
+def get_ocr_checkpoint_sheet(_spreadsheet):
+    """逐頁辨識的進度工作表 (沒有時建立)，每頁一列，Key 為 '文號#頁序'"""
+    try:
+        return _spreadsheet.worksheet(OCR_CHECKPOINT_TITLE)
+    except gspread.WorksheetNotFound:
+        checkpoint_sheet = _spreadsheet.add_worksheet(title=OCR_CHECKPOINT_TITLE, rows=1000, cols=5)
+        checkpoint_sheet.append_row(OCR_CHECKPOINT_HEADERS)
+        return checkpoint_sheet
+
+def _ocr_checkpoint_rows(checkpoint_sheet, doc_id):
+    """公文在進度表中的 {列號: 頁序}"""
+    prefix = f"{doc_id}#"
+    return {
+        row_num: int(key[len(prefix):])
+        for row_num, key in enumerate(checkpoint_sheet.col_values(1), start=1)
+        if row_num > 1 and key.startswith(prefix) and key[len(prefix):].isdigit()
+    }
+
+def load_ocr_checkpoints(checkpoint_sheet, doc_id):
+    """讀取公文已辨識完成的頁面，回傳 {頁序: 文字} (頁序從 0 起算)"""
+    rows = _ocr_checkpoint_rows(checkpoint_sheet, doc_id)
+    if not rows:
+        return {}
+    results = checkpoint_sheet.batch_get([f"{row_num}:{row_num}" for row_num in rows])
+    return {
+        page_num: decode_text_row(value_range[0]) if value_range and value_range[0] else ''
+        for page_num, value_range in zip(rows.values(), results)
+    }
+
+def save_ocr_checkpoint(checkpoint_sheet, doc_id, page_num, text):
+    """寫入一頁的辨識結果 (長文字同 OCR文字 表壓縮、分格)"""
+    row = build_text_row(f"{doc_id}#{page_num}", text, datetime.now().isoformat())
+    ensure_sheet_columns(checkpoint_sheet, len(row))
+    checkpoint_sheet.append_row(row, value_input_option='RAW')
+    note_sheet_write()
+
+def clear_ocr_checkpoints(checkpoint_sheet, doc_id):
+    """公文辨識完成後刪除它的逐頁進度"""
+    delete_worksheet_rows(checkpoint_sheet, list(_ocr_checkpoint_rows(checkpoint_sheet, doc_id)))
+    note_sheet_write()
+
+def run_ocr_slice(docs_sheet, text_sheet, drive_service, doc_id, file_id, deadline=None):
+    """
+    辨識一份公文直到 deadline (time.monotonic() 的時間點，預設為 OCR_SLICE_SECONDS 秒後)
+    每頁完成就寫入進度表，下次從第一個缺少的頁面繼續；全部完成後合併寫入 OCR文字 表並清除進度
+    OCR_Status 寫成 'pending 已完成頁數/總頁數' (時間用完) 或 'failed 已完成頁數/總頁數' (某頁失敗)，
+    回傳新的 OCR_Status
+    """
+    if deadline is None:
+        deadline = time.monotonic() + float(get_setting('OCR_SLICE_SECONDS', OCR_SLICE_SECONDS))
+    
+    if 'gcp_service_account' not in st.secrets or not PDF_PREVIEW_AVAILABLE:
+        print("OCR 辨識失敗: 未設定 Google Cloud Vision API 或未安裝 PyMuPDF")
+        update_ocr_result(docs_sheet, text_sheet, doc_id, None, "failed")
+        return "failed"
+    
+    try:
+        checkpoint_sheet = get_ocr_checkpoint_sheet(text_sheet.spreadsheet)
+        done = load_ocr_checkpoints(checkpoint_sheet, doc_id)
+        pdf_bytes = fetch_drive_file(drive_service, file_id)
+    except Exception as e:
+        print(f"OCR 辨識失敗: {str(e)}")
+        update_ocr_result(docs_sheet, text_sheet, doc_id, None, "failed")
+        return "failed"
+    
+    import fitz
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    page_limit = get_ocr_page_limit()
+    total = min(len(doc), page_limit) if page_limit else len(doc)
+    failed = False
+    page_num = 0
+    try:
+        client = get_vision_client()
+        for page_num in range(total):
+            if page_num in done:
+                continue
+            if time.monotonic() >= deadline:
+                break
+            text = ocr_pdf_page(client, doc[page_num])
+            save_ocr_checkpoint(checkpoint_sheet, doc_id, page_num, text)
+            done[page_num] = text
+    except Exception as e:
+        print(f"OCR 辨識失敗 ({doc_id} 第 {page_num + 1} 頁): {str(e)}")
+        failed = True
+    finally:
+        doc.close()
+    
+    pages_done = sum(1 for page_num in done if page_num < total)
+    if pages_done < total:
+        status = f"{'failed' if failed else 'pending'} {pages_done}/{total}"
+        update_ocr_result(docs_sheet, text_sheet, doc_id, None, status)
+        return status
+    
+    full_text = join_ocr_pages(done, total)
+    status = "completed" if full_text else "failed"
+    if update_ocr_result(docs_sheet, text_sheet, doc_id, full_text or None, status):
+        try:
+            clear_ocr_checkpoints(checkpoint_sheet, doc_id)
+        except Exception as e:
+            print(f"清除辨識進度失敗: {str(e)}")
+    return status
+
 # ===== Gemini AI 摘要相關函數 =====
-def generate_conversation_summary_prompt(conversation_data):
+def generate_conversation_summary_prompt(conversation_data, ocr_texts=None):
     """
     建立對話串摘要的 Prompt
+    ocr_texts 為 {ID: OCR 文字}，由 OCR文字 表依需要載入
     """
+    ocr_texts = ocr_texts or {}
+    
     prompt = "請以繁體中文分析以下政府公文對話串，提供結構化摘要：\n\n"
     
     for idx, item in enumerate(conversation_data, 1):
@@ -806,8 +4407,9 @@ def generate_conversation_summary_prompt(conversation_data):
         prompt += f"{indent}主旨: {doc['Subject']}\n"
         
         # 如果有 OCR 文字，加入前 500 字
-        if 'OCR_Text' in doc and doc['OCR_Text']:
-            ocr_preview = doc['OCR_Text'][:500]
+        ocr_text = ocr_texts.get(doc['ID'], '')
+        if ocr_text:
+            ocr_preview = ocr_text[:500]
             prompt += f"{indent}內容摘要: {ocr_preview}...\n"
         
         prompt += "\n"
@@ -835,8 +4437,14 @@ def generate_conversation_summary_prompt(conversation_data):
     
     return prompt
 
+@st.cache_resource
+def get_genai_client():
+    """建立 Gemini 用戶端 (每個行程只建立一次)"""
+    from google import genai
+    return genai.Client(api_key=st.secrets['GOOGLE_GEMINI_API_KEY'])
+
 @st.cache_data(ttl=3600, show_spinner=False)
-def get_ai_summary(conversation_ids_tuple, conversation_data):
+def get_ai_summary(conversation_ids_tuple, conversation_data, ocr_texts=None):
     """
     使用 Gemini API 產生對話串摘要
     """
@@ -845,20 +4453,18 @@ def get_ai_summary(conversation_ids_tuple, conversation_data):
         if 'GOOGLE_GEMINI_API_KEY' not in st.secrets:
             return None
         
-        from google import genai
-        from google.genai import types
-        
         # 建立客戶端
-        client = genai.Client(api_key=st.secrets['GOOGLE_GEMINI_API_KEY'])
+        client = get_genai_client()
         
         # 建立 prompt
-        prompt = generate_conversation_summary_prompt(conversation_data)
+        prompt = generate_conversation_summary_prompt(conversation_data, ocr_texts)
         
         # 呼叫 API - 使用最新的 Gemini 3.0
-        response = client.models.generate_content(
-            model='gemini-3.0-flash-preview',  # Gemini 3.0 最新模型
-            contents=prompt
-        )
+        with timed_span('gemini.generate_content', service='gemini', nbytes=len(prompt.encode('utf-8'))):
+            response = client.models.generate_content(
+                model='gemini-3.0-flash-preview',  # Gemini 3.0 最新模型
+                contents=prompt
+            )
         
         if response and response.text:
             return response.text
@@ -869,19 +4475,21 @@ def get_ai_summary(conversation_ids_tuple, conversation_data):
         print(f"AI 摘要失敗: {str(e)}")
         # 如果 Gemini 3.0 失敗，嘗試降級到 2.0
         try:
-            response = client.models.generate_content(
-                model='gemini-2.0-flash-exp',
-                contents=prompt
-            )
+            with timed_span('gemini.generate_content', service='gemini', nbytes=len(prompt.encode('utf-8'))):
+                response = client.models.generate_content(
+                    model='gemini-2.0-flash-exp',
+                    contents=prompt
+                )
             if response and response.text:
                 return response.text
         except:
             pass
         return None
 
-def update_ocr_result(worksheet, doc_id, ocr_text, status="completed"):
+def update_ocr_result(worksheet, text_sheet, doc_id, ocr_text, status="completed"):
     """
     更新 OCR 辨識結果到 Google Sheets
+    文字寫入 OCR文字 表，公文資料表只更新狀態與時間
     """
     try:
         # 找到該公文的行號
@@ -895,39 +4503,47 @@ def update_ocr_result(worksheet, doc_id, ocr_text, status="completed"):
         headers = worksheet.row_values(1)
         
         # 檢查是否有 OCR 欄位
-        if 'OCR_Text' not in headers:
+        if 'OCR_Status' not in headers:
             return False
             
-        ocr_text_col = headers.index('OCR_Text') + 1
         ocr_status_col = headers.index('OCR_Status') + 1
         ocr_date_col = headers.index('OCR_Date') + 1
         
         # 更新資料
-        worksheet.update_cell(row_num, ocr_text_col, ocr_text or '')
+        if ocr_text:
+            save_ocr_text(text_sheet, doc_id, ocr_text)
+        ocr_date = datetime.now().isoformat()
         worksheet.update_cell(row_num, ocr_status_col, status)
-        worksheet.update_cell(row_num, ocr_date_col, datetime.now().isoformat())
+        worksheet.update_cell(row_num, ocr_date_col, ocr_date)
+        note_document_write(doc_id, {'OCR_Status': status, 'OCR_Date': ocr_date})
         
         return True
     except Exception as e:
         print(f"更新 OCR 結果失敗: {str(e)}")
         return False
 
-def process_pending_ocr(docs_sheet, drive_service, limit=1):
+def process_pending_ocr(docs_sheet, text_sheet, drive_service, limit=1, time_budget=None):
     """
     處理待辨識的公文 (背景辨識)
+    最多 limit 份，共用 time_budget 秒 (預設 OCR_SLICE_SECONDS)；時間用完時未完成的公文
+    保留已辨識的頁面，下次從缺少的頁面繼續。回傳本次辨識完成的公文數
     """
     try:
-        df = get_all_documents(docs_sheet)
+        df = get_synced_documents(docs_sheet, drive_service, ['ID', 'Drive_File_ID', 'OCR_Status'])
         
-        # 找出待辨識的公文
+        # 找出待辨識的公文 (含辨識到一半的)
         if 'OCR_Status' in df.columns:
-            pending = df[df['OCR_Status'] == 'pending'].head(limit)
+            pending = df[df['OCR_Status'].map(ocr_status_kind) == 'pending'].head(limit)
         else:
             return 0
         
         if pending.empty:
             return 0
         
+        if time_budget is None:
+            time_budget = float(get_setting('OCR_SLICE_SECONDS', OCR_SLICE_SECONDS))
+        deadline = time.monotonic() + time_budget
+        
         processed = 0
         for _, doc in pending.iterrows():
             doc_id = doc['ID']
@@ -935,17 +4551,15 @@ def process_pending_ocr(docs_sheet, drive_service, limit=1):
             
             if not file_id:
                 # 沒有檔案,標記為跳過
-                update_ocr_result(docs_sheet, doc_id, None, "skipped")
+                update_ocr_result(docs_sheet, text_sheet, doc_id, None, "skipped")
                 continue
             
-            # 進行 OCR
-            ocr_text = ocr_pdf_from_drive(drive_service, file_id)
+            if time.monotonic() >= deadline:
+                break
             
-            if ocr_text:
-                update_ocr_result(docs_sheet, doc_id, ocr_text, "completed")
+            # 逐頁辨識到時間用完為止
+            if run_ocr_slice(docs_sheet, text_sheet, drive_service, doc_id, file_id, deadline) == "completed":
                 processed += 1
-            else:
-                update_ocr_result(docs_sheet, doc_id, None, "failed")
         
         return processed
         
@@ -953,6 +4567,7 @@ def process_pending_ocr(docs_sheet, drive_service, limit=1):
         print(f"處理待辨識公文失敗: {str(e)}")
         return 0
 
+@timed_operation('watermark.pdf')
 def add_watermark_to_pdf(pdf_bytes, watermark_text):
     """為 PDF 添加浮水印（支援中文）"""
     if not PDF_PREVIEW_AVAILABLE:
@@ -1020,6 +4635,7 @@ def add_watermark_to_pdf(pdf_bytes, watermark_text):
     except Exception as e:
         return pdf_bytes
 
+@timed_operation('watermark.image')
 def add_watermark_to_image(img_bytes, watermark_text):
     """為圖片添加浮水印（支援中文）"""
     try:
@@ -1111,6 +4727,7 @@ def add_watermark_to_image(img_bytes, watermark_text):
     except Exception as e:
         return img_bytes
 
+@timed_operation('preview.pdf')
 def display_pdf_from_bytes(pdf_bytes, watermark_text=None):
     """顯示 PDF 預覽（含浮水印）"""
     if not pdf_bytes:
@@ -1159,7 +4776,7 @@ def display_pdf_from_bytes(pdf_bytes, watermark_text=None):
         st.error(f"處理 PDF 失敗: {str(e)}")
 
 # ===== 追蹤回覆相關函數 =====
-def check_reply_status(df, doc_id, doc_type, doc_date):
+def check_reply_status(df, doc_id, doc_type, doc_date, agency=None):
     """
     檢查公文是否已有回覆
     """
@@ -1171,11 +4788,10 @@ def check_reply_status(df, doc_id, doc_type, doc_date):
         # 檢查是否有子公文 (回覆)
         replies = df[df['Parent_ID'] == doc_id]
         
-        # 計算等待天數
-        from datetime import datetime
-        doc_date_obj = datetime.strptime(doc_date, '%Y-%m-%d')
-        today = datetime.now()
-        days_waiting = (today - doc_date_obj).days
+        # 計算等待天數 (doc_date 可傳入已解析的 Date_Parsed)
+        days_waiting = days_since(doc_date)
+        if days_waiting is None:
+            return None
         
         # 檢查是否有政府回文
         gov_replies = replies[replies['Type'] == '收文']
@@ -1183,7 +4799,7 @@ def check_reply_status(df, doc_id, doc_type, doc_date):
         result = {
             'has_reply': len(gov_replies) > 0,
             'days_waiting': days_waiting,
-            'need_tracking': days_waiting > 7 and len(gov_replies) == 0,
+            'need_tracking': days_waiting > get_sla_days(agency, doc_type) and len(gov_replies) == 0,
             'reply_count': len(replies),
             'latest_reply_date': None
         }
@@ -1212,7 +4828,7 @@ def get_pending_replies(df):
         our_docs = df[df['Type'].isin(['發文', '函'])]
         
         for _, doc in our_docs.iterrows():
-            status = check_reply_status(df, doc['ID'], doc['Type'], doc['Date'])
+            status = check_reply_status(df, doc['ID'], doc['Type'], doc.get('Date_Parsed', doc['Date']), doc['Agency'])
             
             if status and not status['has_reply']:
                 doc_info = {
@@ -1264,8 +4880,7 @@ def login_page(users_sheet):
         if st.button("登入", type="primary", width="stretch"):
             if username and password:
                 with st.spinner("🔄 驗證中..."):
-                    users_df = get_all_users(users_sheet)
-                    user = check_login(users_df, username, password)
+                    user = check_login(get_user_directory(users_sheet), username, password)
                     
                     if user:
                         st.session_state.user = user
@@ -1293,9 +4908,12 @@ def user_management_page(users_sheet):
     
     tab1, tab2, tab3 = st.tabs(["📋 使用者列表", "➕ 新增使用者", "🔑 修改密碼"])
     
+    # 三個分頁共用同一份使用者目錄 (快取)
+    user_directory = get_user_directory(users_sheet)
+    users_df = pd.DataFrame(list(user_directory.values()), columns=USER_HEADERS)
+    
     # 使用者列表
     with tab1:
-        users_df = get_all_users(users_sheet)
         
         if users_df.empty:
             st.info("尚無使用者資料")
@@ -1343,8 +4961,7 @@ def user_management_page(users_sheet):
         if st.button("➕ 新增", type="primary"):
             if new_username and new_password and new_display_name:
                 # 檢查帳號是否已存在
-                users_df = get_all_users(users_sheet)
-                if new_username in users_df['Username'].values:
+                if new_username in user_directory:
                     st.error("❌ 此帳號已存在")
                 else:
                     user_data = {
@@ -1363,7 +4980,6 @@ def user_management_page(users_sheet):
     with tab3:
         st.subheader("修改使用者密碼")
         
-        users_df = get_all_users(users_sheet)
         user_to_change = st.selectbox(
             "選擇使用者",
             users_df['Username'].tolist(),
@@ -1382,14 +4998,30 @@ def user_management_page(users_sheet):
                         cell = users_sheet.find(user_to_change)
                         if cell:
                             users_sheet.update_cell(cell.row, 2, hash_password(new_pwd))
+                            note_sheet_write()
+                            replica_update('users', 'Username', user_to_change, {'Password': hash_password(new_pwd)})
+                            get_user_directory.clear()
                             st.success(f"✅ 已修改 {user_to_change} 的密碼")
                     except Exception as e:
                         st.error(f"修改失敗: {str(e)}")
             else:
                 st.warning("⚠️ 請輸入新密碼")
 
+@st.cache_resource
+def get_logo_html():
+    """Logo 轉成 base64 HTML (只讀取一次檔案)"""
+    try:
+        with open("logo.png", "rb") as f:
+            logo_bytes = f.read()
+        logo_base64 = base64.b64encode(logo_bytes).decode()
+        return f'<img src="data:image/png;base64,{logo_base64}" style="height: 60px; margin-right: 20px;">'
+    except:
+        return '<span style="font-size: 48px; margin-right: 20px;">🏢</span>'
+
 # ===== 主程式 =====
 def main():
+    setup_page()
+    
     # 初始化 session state
     if 'logged_in' not in st.session_state:
         st.session_state.logged_in = False
@@ -1404,19 +5036,14 @@ def main():
     
     # ===== 未登入:只初始化必要的服務以顯示登入頁面 =====
     if not st.session_state.logged_in:
-        # 只初始化最基本的服務
-        gc, drive_service, credentials = init_google_services()
+        # 只初始化最基本的服務 (不建立 Drive，不載入 pandas)
+        gc = init_sheets_client()
         spreadsheet = get_spreadsheet(gc, sheet_id)
         if not spreadsheet:
             st.stop()
         
         # 只初始化使用者工作表
-        existing_sheets = [ws.title for ws in spreadsheet.worksheets()]
-        if '使用者' not in existing_sheets:
-            # 如果沒有使用者表,才完整初始化
-            docs_sheet, deleted_sheet, users_sheet = init_all_sheets(spreadsheet)
-        else:
-            users_sheet = spreadsheet.worksheet('使用者')
+        users_sheet = get_users_sheet(spreadsheet)
         
         login_page(users_sheet)
         return
@@ -1425,21 +5052,24 @@ def main():
     # 初始化 Google Services
     gc, drive_service, credentials = init_google_services()
     
-    # 自動在主資料夾內建立「已刪除」子資料夾
-    deleted_folder_id = None
-    if folder_id:
-        if 'deleted_folder_id' not in st.session_state:
-            deleted_folder_id = get_or_create_subfolder(drive_service, folder_id, "已刪除公文")
-            st.session_state.deleted_folder_id = deleted_folder_id
-        else:
-            deleted_folder_id = st.session_state.deleted_folder_id
-    
     # 取得 Spreadsheet 並初始化所有工作表
     spreadsheet = get_spreadsheet(gc, sheet_id)
     if not spreadsheet:
         st.stop()
     
-    docs_sheet, deleted_sheet, users_sheet = init_all_sheets(spreadsheet)
+    docs_sheet, deleted_sheet, users_sheet, text_sheet = init_all_sheets(spreadsheet)
+    
+    # 本機副本 (查詢、追蹤、首頁直接查副本)
+    ensure_replica(docs_sheet, deleted_sheet, users_sheet, drive_service)
+    
+    # 自動在主資料夾內建立「已刪除」子資料夾 (資料夾 ID 由行程共用快取取得)，
+    # 並在背景把根資料夾內的舊附件搬到 年/年-月 資料夾；設定 ARCHIVE_AUTO 時定期封存舊對話串
+    deleted_folder_id = None
+    if folder_id:
+        deleted_folder_id = get_or_create_subfolder(drive_service, folder_id, "已刪除公文")
+        start_drive_folder_migration(credentials, folder_id)
+        if get_setting('ARCHIVE_AUTO', False):
+            start_archive_scheduler(spreadsheet, credentials, folder_id)
     
     # ===== 已登入的主介面 =====
     
@@ -1486,15 +5116,19 @@ def main():
             if st.button("📊 系統管理", key="nav_admin", use_container_width=True):
                 st.session_state.current_page = 'admin'
                 st.rerun()
+            
+            if st.button("📦 批次匯入", key="nav_bulk_import", use_container_width=True):
+                st.session_state.current_page = 'bulk_import'
+                st.rerun()
+            
+            # 繪製時間 (確認操作只重新執行對應的區塊)
+            st.checkbox("⏱️ 顯示繪製時間", key="show_render_timing")
+            if st.session_state.get('show_render_timing') and st.session_state.get('render_timings'):
+                for name, timing in st.session_state.render_timings.items():
+                    st.caption(f"{name}：{timing['ms']:.0f} ms ／ {timing['count']} 次 ／ {timing['at']}")
     
     # Header
-    try:
-        with open("logo.png", "rb") as f:
-            logo_bytes = f.read()
-        logo_base64 = base64.b64encode(logo_bytes).decode()
-        logo_html = f'<img src="data:image/png;base64,{logo_base64}" style="height: 60px; margin-right: 20px;">'
-    except:
-        logo_html = '<span style="font-size: 48px; margin-right: 20px;">🏢</span>'
+    logo_html = get_logo_html()
     
     st.markdown(
         f"""
@@ -1507,51 +5141,59 @@ def main():
     )
     
     # 根據 current_page 顯示不同頁面
-    if st.session_state.current_page == 'home':
+    page_start = time.perf_counter()
+    render_page(st.session_state.current_page, docs_sheet, deleted_sheet, users_sheet, text_sheet,
+                drive_service, folder_id, deleted_folder_id)
+    record_render_time("整頁", time.perf_counter() - page_start)
+
+def render_page(current_page, docs_sheet, deleted_sheet, users_sheet, text_sheet,
+                drive_service, folder_id, deleted_folder_id):
+    """依目前頁面呼叫對應的頁面函式"""
+    if current_page == 'home':
         show_home_page(docs_sheet, drive_service, deleted_folder_id)
     
-    elif st.session_state.current_page == 'add_document':
+    elif current_page == 'add_document':
         show_add_document_page(docs_sheet, drive_service, folder_id)
     
-    elif st.session_state.current_page == 'search':
-        show_search_page(docs_sheet, drive_service, deleted_sheet, deleted_folder_id, folder_id)
+    elif current_page == 'search':
+        show_search_page(docs_sheet, text_sheet, drive_service, deleted_sheet, deleted_folder_id, folder_id)
+    
+    elif current_page == 'tracking':
+        show_tracking_page(docs_sheet, drive_service)
     
-    elif st.session_state.current_page == 'tracking':
-        show_tracking_page(docs_sheet)
+    elif current_page == 'ocr':
+        show_ocr_page(docs_sheet, text_sheet, drive_service)
     
-    elif st.session_state.current_page == 'ocr':
-        show_ocr_page(docs_sheet, drive_service)
+    elif current_page == 'admin':
+        if is_admin():
+            show_admin_page(docs_sheet, deleted_sheet, users_sheet, text_sheet, drive_service, folder_id)
+        else:
+            st.error("❌ 您沒有權限訪問此頁面")
     
-    elif st.session_state.current_page == 'admin':
+    elif current_page == 'bulk_import':
         if is_admin():
-            show_admin_page(docs_sheet, deleted_sheet, users_sheet)
+            show_bulk_import_page(docs_sheet, folder_id)
         else:
             st.error("❌ 您沒有權限訪問此頁面")
 
 # ===== 首頁 =====
+@timed_operation('page.home')
 def show_home_page(docs_sheet, drive_service, deleted_folder_id):
     """顯示首頁 - 儀表板 + 功能磚塊"""
     
-    # 取得資料
-    df = get_all_documents(docs_sheet)
-    
-    # 計算統計數據
-    total_docs = len(df)
+    # 計算統計數據 (查詢本機副本)
+    total_docs = count_documents_replica()
     
-    # 待回覆統計
-    pending_replies = get_pending_replies(df)
-    urgent_count = len(pending_replies['urgent'])
-    normal_count = len(pending_replies['normal'])
-    total_pending = urgent_count + normal_count
+    # 待回覆統計 (讀取回覆追蹤佇列，不重新計算每份公文)
+    pending_replies = get_reply_queue_view(k=3)
+    urgent_count = pending_replies['overdue_count']
+    total_pending = pending_replies['total']
     
     # 已完成統計
     completed_count = total_docs - total_pending
     
     # OCR 待處理統計
-    if 'OCR_Status' in df.columns:
-        ocr_pending = len(df[df['OCR_Status'] == 'pending'])
-    else:
-        ocr_pending = 0
+    ocr_pending = count_documents_replica("WHERE OCR_Status = ? OR OCR_Status LIKE ?", ('pending', 'pending %'))
     
     # 統計卡片
     st.markdown("### 📊 系統概覽")
@@ -1567,7 +5209,7 @@ def show_home_page(docs_sheet, drive_service, deleted_folder_id):
         st.metric(
             label="⏳ 待回覆",
             value=total_pending,
-            delta=f"-{urgent_count} 筆超過7天" if urgent_count > 0 else "正常",
+            delta=f"-{urgent_count} 筆超過期限" if urgent_count > 0 else "正常",
             delta_color="inverse" if urgent_count > 0 else "off"
         )
     
@@ -1585,23 +5227,23 @@ def show_home_page(docs_sheet, drive_service, deleted_folder_id):
     
     st.markdown("---")
     
-    # 緊急警示 (如果有超過 7 天的公文)
+    # 緊急警示 (如果有超過回覆期限的公文)
     if urgent_count > 0:
         st.markdown(
             f"""
             <div class="alert-card">
-                <h3 style="margin: 0 0 12px 0; color: #EF4444;">⚠️ 緊急提醒：{urgent_count} 筆公文超過 7 天未回覆</h3>
+                <h3 style="margin: 0 0 12px 0; color: #EF4444;">⚠️ 緊急提醒：{urgent_count} 筆公文超過回覆期限</h3>
             """,
             unsafe_allow_html=True
         )
         
-        # 顯示前 3 筆
-        for doc in pending_replies['urgent'][:3]:
+        # 顯示最早到期的 3 筆
+        for doc in pending_replies['urgent']:
             st.markdown(
                 f"""
                 <div style="padding: 8px 0; border-bottom: 1px solid #FECACA;">
                     🔴 <strong>{doc['id']}</strong> | {doc['agency']} | 
-                    <span style="color: #EF4444; font-weight: 600;">{doc['days_waiting']} 天未回覆</span>
+                    <span style="color: #EF4444; font-weight: 600;">{doc['days_waiting']} 天未回覆 (期限 {doc['sla_days']} 天)</span>
                 </div>
                 """,
                 unsafe_allow_html=True
@@ -1698,11 +5340,13 @@ def show_home_page(docs_sheet, drive_service, deleted_folder_id):
     # 近期活動
     st.markdown("### 📋 近期活動 (最新 5 筆)")
     
-    if df.empty:
+    if total_docs == 0:
         st.info("尚無公文資料")
     else:
         # 取最新 5 筆
-        recent_docs = df.sort_values('Created_At', ascending=False).head(5)
+        recent_docs = query_replica(
+            f"SELECT {', '.join(HOME_COLUMNS)} FROM documents ORDER BY Created_At DESC LIMIT 5"
+        )
         
         for _, doc in recent_docs.iterrows():
             icon = "📤" if doc['Type'] in ['發文', '函'] else "📥"
@@ -1720,31 +5364,38 @@ def show_home_page(docs_sheet, drive_service, deleted_folder_id):
                     st.rerun()
 
 # ===== 追蹤回覆頁面 =====
-def show_tracking_page(docs_sheet):
+@timed_operation('page.tracking')
+def show_tracking_page(docs_sheet, drive_service):
     """追蹤回覆專頁"""
     
     st.markdown("## ⏰ 追蹤回覆")
     
-    df = get_all_documents(docs_sheet)
-    pending = get_pending_replies(df)
+    tracking_list_fragment()
+
+@timed_fragment("追蹤清單")
+def tracking_list_fragment():
+    """待回覆清單 (讀取回覆追蹤佇列的前 TRACKING_TOP_K 筆)"""
+    pending = get_reply_queue_view()
     
     # 統計卡片
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        st.metric("📊 總計", len(pending['urgent']) + len(pending['normal']))
+        st.metric("📊 總計", pending['total'])
     
     with col2:
-        st.metric("⚠️ 需追蹤", len(pending['urgent']))
+        st.metric("⚠️ 需追蹤", pending['overdue_count'])
     
     with col3:
-        st.metric("🟡 等待中", len(pending['normal']))
+        st.metric("🟡 等待中", pending['total'] - pending['overdue_count'])
     
     st.markdown("---")
     
     # 緊急追蹤區
     if pending['urgent']:
-        st.markdown("### 🔴 緊急追蹤 (超過 7 天)")
+        st.markdown("### 🔴 緊急追蹤 (超過回覆期限)")
+        if pending['overdue_count'] > len(pending['urgent']):
+            st.caption(f"顯示最早到期的 {len(pending['urgent'])} 筆 (共 {pending['overdue_count']} 筆)")
         
         for doc in pending['urgent']:
             st.markdown(
@@ -1752,7 +5403,8 @@ def show_tracking_page(docs_sheet):
                 <div class="alert-card">
                     <h4 style="margin: 0; color: #EF4444;">🔴 {doc['id']}</h4>
                     <p style="margin: 8px 0 0 0;">
-                        📅 發文日期: {doc['date']} | ⏰ 已等待: <strong style="color: #EF4444;">{doc['days_waiting']} 天</strong><br>
+                        📅 發文日期: {doc['date']} | ⏰ 已等待: <strong style="color: #EF4444;">{doc['days_waiting']} 天</strong>
+                        (期限 {doc['sla_days']} 天，{doc['due_date']} 到期)<br>
                         🏢 機關: {doc['agency']}<br>
                         📝 主旨: {doc['subject']}<br>
                         👤 建立者: {doc['created_by']}
@@ -1772,19 +5424,23 @@ def show_tracking_page(docs_sheet):
             
             st.markdown("")
     else:
-        st.success("✅ 目前沒有超過 7 天未回覆的公文")
+        st.success("✅ 目前沒有超過回覆期限的公文")
     
     st.markdown("---")
     
     # 正常等待區
     if pending['normal']:
-        st.markdown("### 🟡 正常等待 (7 天內)")
+        st.markdown("### 🟡 正常等待 (回覆期限內)")
+        waiting_count = pending['total'] - pending['overdue_count']
+        if waiting_count > len(pending['normal']):
+            st.caption(f"顯示最快到期的 {len(pending['normal'])} 筆 (共 {waiting_count} 筆)")
         
         for doc in pending['normal']:
             with st.expander(
-                f"🟡 {doc['id']} | {doc['agency']} | 已等待 {doc['days_waiting']} 天"
+                f"🟡 {doc['id']} | {doc['agency']} | 已等待 {doc['days_waiting']} 天 | 剩 {doc['days_left']} 天"
             ):
                 st.markdown(f"**發文日期**: {doc['date']}")
+                st.markdown(f"**回覆期限**: {doc['due_date']} ({doc['sla_days']} 天)")
                 st.markdown(f"**機關單位**: {doc['agency']}")
                 st.markdown(f"**主旨**: {doc['subject']}")
                 st.markdown(f"**建立者**: {doc['created_by']}")
@@ -1796,21 +5452,28 @@ def show_tracking_page(docs_sheet):
                     st.rerun()
 
 # ===== OCR 處理頁面 =====
-def show_ocr_page(docs_sheet, drive_service):
+@timed_operation('page.ocr')
+def show_ocr_page(docs_sheet, text_sheet, drive_service):
     """OCR 處理專頁"""
     
     st.markdown("## 📝 處理辨識")
     
-    df = get_all_documents(docs_sheet)
+    ocr_queue_fragment(docs_sheet, text_sheet, drive_service)
+
+@timed_fragment("辨識佇列")
+def ocr_queue_fragment(docs_sheet, text_sheet, drive_service):
+    """待辨識與失敗清單 (從同步快取讀取)，辨識完成只重新執行這一區"""
+    df = get_synced_documents(docs_sheet, drive_service, OCR_PAGE_COLUMNS)
     
     if 'OCR_Status' not in df.columns:
         st.warning("系統尚未啟用 OCR 功能")
         return
     
-    # 統計
-    pending_df = df[df['OCR_Status'] == 'pending']
-    completed_df = df[df['OCR_Status'] == 'completed']
-    failed_df = df[df['OCR_Status'] == 'failed']
+    # 統計 (辨識到一半的公文狀態帶有頁數進度，例如 'pending 3/40')
+    status_kind = df['OCR_Status'].map(ocr_status_kind)
+    pending_df = df[status_kind == 'pending']
+    completed_df = df[status_kind == 'completed']
+    failed_df = df[status_kind == 'failed']
     
     col1, col2, col3 = st.columns(3)
     
@@ -1834,27 +5497,23 @@ def show_ocr_page(docs_sheet, drive_service):
             
             with col_info:
                 st.markdown(f"**{doc['ID']}** | {doc['Date']} | {doc['Agency']} | {doc['Subject'][:40]}...")
+                progress = ocr_status_progress(doc['OCR_Status'])
+                if progress:
+                    st.progress(progress[0] / max(progress[1], 1), text=f"已完成 {progress[0]}/{progress[1]} 頁")
             
             with col_action:
                 if st.button("🔄 立即辨識", key=f"ocr_{doc['ID']}"):
                     with st.spinner("辨識中..."):
                         file_id = doc.get('Drive_File_ID')
                         if file_id:
-                            ocr_result = ocr_pdf_from_drive(drive_service, file_id)
-                            if ocr_result:
-                                update_ocr_result(docs_sheet, doc['ID'], ocr_result, "completed")
-                                st.success("✅ 辨識完成！")
-                                st.rerun()
-                            else:
-                                update_ocr_result(docs_sheet, doc['ID'], None, "failed")
-                                st.error("❌ 辨識失敗")
+                            render_ocr_slice_result(run_ocr_slice(docs_sheet, text_sheet, drive_service, doc['ID'], file_id))
         
         st.markdown("")
         if st.button("🔄 批次處理 (前 5 筆)", type="primary"):
             with st.spinner("批次辨識中..."):
-                processed = process_pending_ocr(docs_sheet, drive_service, limit=5)
+                processed = process_pending_ocr(docs_sheet, text_sheet, drive_service, limit=5)
                 st.success(f"✅ 已辨識 {processed} 份公文")
-                st.rerun()
+                rerun_fragment()
     else:
         st.success("✅ 所有公文已辨識完成")
     
@@ -1868,20 +5527,62 @@ def show_ocr_page(docs_sheet, drive_service):
             with st.expander(f"❌ {doc['ID']} | {doc['Agency']}"):
                 st.markdown(f"**日期**: {doc['Date']}")
                 st.markdown(f"**主旨**: {doc['Subject']}")
+                progress = ocr_status_progress(doc['OCR_Status'])
+                if progress:
+                    st.caption(f"已完成 {progress[0]}/{progress[1]} 頁，重新辨識會從第 {progress[0] + 1} 頁繼續")
                 
                 if st.button("🔄 重新辨識", key=f"retry_{doc['ID']}"):
                     with st.spinner("辨識中..."):
                         file_id = doc.get('Drive_File_ID')
                         if file_id:
-                            ocr_result = ocr_pdf_from_drive(drive_service, file_id)
-                            if ocr_result:
-                                update_ocr_result(docs_sheet, doc['ID'], ocr_result, "completed")
-                                st.success("✅ 辨識完成！")
-                                st.rerun()
-                            else:
-                                st.error("❌ 辨識仍然失敗，請檢查 PDF 品質")
+                            render_ocr_slice_result(run_ocr_slice(docs_sheet, text_sheet, drive_service, doc['ID'], file_id))
+
+def render_ocr_slice_result(status):
+    """顯示一次逐頁辨識的結果；有進展時重新執行辨識佇列區塊"""
+    progress = ocr_status_progress(status)
+    kind = ocr_status_kind(status)
+    if kind == 'completed':
+        st.success("✅ 辨識完成！")
+        rerun_fragment()
+    elif kind == 'pending' and progress:
+        st.info(f"⏳ 已完成 {progress[0]}/{progress[1]} 頁，再按一次或批次處理會繼續")
+        rerun_fragment()
+    elif progress:
+        st.error(f"❌ 辨識中斷 (已完成 {progress[0]}/{progress[1]} 頁)，已完成的頁面會保留，可稍後重新辨識")
+    else:
+        st.error("❌ 辨識失敗，請檢查 PDF 品質")
 
 # ===== 新增公文頁面 =====
+def parent_document_picker(label, success_prefix):
+    """以關鍵字搜尋並選擇要回覆的公文，回傳選到的文號"""
+    form_key = st.session_state.form_key
+    query = st.text_input(
+        "🔍 輸入文號、機關或主旨關鍵字",
+        placeholder="例：1131215 或 教育部",
+        key=f"parent_query_{form_key}"
+    )
+    
+    candidates = search_parent_candidates(query)
+    if candidates.empty:
+        st.warning("找不到符合的公文，請換個關鍵字或使用手動輸入")
+        return None
+    
+    docs_by_id = {doc['ID']: doc for doc in candidates.to_dict('records')}
+    selected = st.selectbox(
+        f"{label}（最多顯示 {PARENT_PICKER_LIMIT} 筆，請輸入關鍵字縮小範圍）",
+        list(docs_by_id.keys()),
+        format_func=lambda doc_id: (
+            f"{doc_id} | {docs_by_id[doc_id]['Date']} | {docs_by_id[doc_id]['Type']} | "
+            f"{docs_by_id[doc_id]['Agency']} | {docs_by_id[doc_id]['Subject'][:30]}..."
+        ),
+        key=f"parent_{form_key}"
+    )
+    
+    if selected:
+        st.success(f"{success_prefix}：**{selected}** - {docs_by_id[selected]['Subject']}")
+    return selected
+
+@timed_operation('page.add_document')
 def show_add_document_page(docs_sheet, drive_service, folder_id):
     """新增公文頁面 - 完整版"""
     
@@ -1935,31 +5636,12 @@ def show_add_document_page(docs_sheet, drive_service, folder_id):
             
             parent_input_mode = st.radio(
                 "選擇方式:",
-                ["從近三個月公文選擇", "手動輸入文號"],
+                ["搜尋公文選擇", "手動輸入文號"],
                 key=f"parent_input_mode1_{st.session_state.form_key}"
             )
             
-            if parent_input_mode == "從近三個月公文選擇":
-                df = get_all_documents(docs_sheet)
-                recent_df = filter_recent_documents(df, months=3)
-                
-                if not recent_df.empty:
-                    doc_options = [
-                        f"{row['ID']} | {row['Type']} | {row['Agency']} | {row['Subject'][:30]}..." 
-                        for _, row in recent_df.iterrows()
-                    ]
-                    selected = st.selectbox(
-                        "選擇原始公文（近三個月）", 
-                        doc_options, 
-                        key=f"parent_{st.session_state.form_key}"
-                    )
-                    parent_id = selected.split(" | ")[0] if selected else None
-                    
-                    if parent_id:
-                        selected_doc = df[df['ID'] == parent_id].iloc[0]
-                        st.success(f"✓ 回覆：**{parent_id}** - {selected_doc['Subject']}")
-                else:
-                    st.warning("近三個月沒有公文,請使用手動輸入")
+            if parent_input_mode == "搜尋公文選擇":
+                parent_id = parent_document_picker("選擇原始公文", "✓ 回覆")
             else:
                 parent_id = st.text_input(
                     "📝 請輸入原始公文文號",
@@ -1975,32 +5657,13 @@ def show_add_document_page(docs_sheet, drive_service, folder_id):
             
             parent_input_mode = st.radio(
                 "選擇要回覆的公文方式:",
-                ["從近三個月公文選擇", "手動輸入文號"],
+                ["搜尋公文選擇", "手動輸入文號"],
                 key=f"parent_input_mode2_{st.session_state.form_key}"
             )
             
-            if parent_input_mode == "從近三個月公文選擇":
-                df = get_all_documents(docs_sheet)
-                recent_df = filter_recent_documents(df, months=3)
-                
-                if not recent_df.empty:
-                    st.info("💡 選擇要回覆的政府公文（系統將自動產生流水號）")
-                    doc_options = [
-                        f"{row['ID']} | {row['Type']} | {row['Agency']} | {row['Subject'][:30]}..." 
-                        for _, row in recent_df.iterrows()
-                    ]
-                    selected = st.selectbox(
-                        "選擇要回覆的公文（近三個月）", 
-                        doc_options, 
-                        key=f"parent_{st.session_state.form_key}"
-                    )
-                    parent_id = selected.split(" | ")[0] if selected else None
-                    
-                    if parent_id:
-                        selected_doc = df[df['ID'] == parent_id].iloc[0]
-                        st.success(f"✓ 將回覆：**{parent_id}** - {selected_doc['Subject']}")
-                else:
-                    st.warning("近三個月沒有公文,請使用手動輸入")
+            if parent_input_mode == "搜尋公文選擇":
+                st.info("💡 選擇要回覆的政府公文（系統將自動產生流水號）")
+                parent_id = parent_document_picker("選擇要回覆的公文", "✓ 將回覆")
             else:
                 st.info("💡 請先到「查詢公文」搜尋舊公文,找到後輸入文號")
                 parent_id = st.text_input(
@@ -2018,32 +5681,13 @@ def show_add_document_page(docs_sheet, drive_service, folder_id):
         if is_reply:
             parent_input_mode = st.radio(
                 "選擇要回覆的公文方式:",
-                ["從近三個月公文選擇", "手動輸入文號"],
+                ["搜尋公文選擇", "手動輸入文號"],
                 key=f"parent_input_mode3_{st.session_state.form_key}"
             )
             
-            if parent_input_mode == "從近三個月公文選擇":
-                df = get_all_documents(docs_sheet)
-                recent_df = filter_recent_documents(df, months=3)
-                
-                if not recent_df.empty:
-                    st.info("💡 選擇要回覆的公文（可以是任何類型）")
-                    doc_options = [
-                        f"{row['ID']} | {row['Type']} | {row['Agency']} | {row['Subject'][:30]}..." 
-                        for _, row in recent_df.iterrows()
-                    ]
-                    selected = st.selectbox(
-                        "選擇原始公文（近三個月）", 
-                        doc_options, 
-                        key=f"parent_{st.session_state.form_key}"
-                    )
-                    parent_id = selected.split(" | ")[0] if selected else None
-                    
-                    if parent_id:
-                        selected_doc = df[df['ID'] == parent_id].iloc[0]
-                        st.success(f"✓ 將回覆：**{parent_id}** - {selected_doc['Subject']}")
-                else:
-                    st.warning("近三個月沒有公文,請使用手動輸入")
+            if parent_input_mode == "搜尋公文選擇":
+                st.info("💡 選擇要回覆的公文（可以是任何類型）")
+                parent_id = parent_document_picker("選擇原始公文", "✓ 將回覆")
             else:
                 st.info("💡 請先到「查詢公文」搜尋舊公文,找到後輸入文號")
                 parent_id = st.text_input(
@@ -2099,7 +5743,7 @@ def show_add_document_page(docs_sheet, drive_service, folder_id):
             with st.spinner("上傳中..."):
                 file_bytes = uploaded_file.read()
                 filename = f"{final_doc_id}_{agency}_{subject}.pdf"
-                file_id = upload_to_drive(drive_service, file_bytes, filename, folder_id)
+                file_id = upload_to_drive(drive_service, file_bytes, filename, folder_id, date_str)
                 
                 if file_id:
                     doc_data = {
@@ -2127,15 +5771,153 @@ def show_add_document_page(docs_sheet, drive_service, folder_id):
                 else:
                     st.error("❌ 上傳失敗")
 
+# ===== 批次匯入頁面 =====
+@timed_operation('page.bulk_import')
+def show_bulk_import_page(docs_sheet, folder_id):
+    """批次匯入頁面：上傳 PDF 的 ZIP 檔與中繼資料 CSV"""
+    
+    st.markdown("## 📦 批次匯入")
+    st.info(
+        "💡 上傳包含 PDF 的 ZIP 檔，以及描述每個檔案的 CSV。"
+        "伺服器上的資料夾可用指令 `python bulk_import.py --source 資料夾 --manifest 資料.csv` 匯入。"
+    )
+    
+    template = ','.join(BULK_REQUIRED_COLUMNS + BULK_OPTIONAL_COLUMNS) + '\n'
+    template += 'scan_001.pdf,2024-05-01,收文,教育部,補助計畫核定,,府教字第1130012345號\n'
+    st.download_button(
+        "📄 下載 CSV 範本",
+        data=template.encode('utf-8-sig'),
+        file_name="bulk_import_template.csv",
+        mime="text/csv"
+    )
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        zip_file = st.file_uploader("PDF 壓縮檔 (ZIP)", type=['zip'], key="bulk_zip")
+    with col2:
+        csv_file = st.file_uploader("中繼資料 (CSV)", type=['csv'], key="bulk_csv")
+    
+    if not zip_file or not csv_file:
+        return
+    
+    entries, errors = read_bulk_manifest(csv_file.getvalue())
+    try:
+        files = open_bulk_files(zip_file)
+    except ValueError as e:
+        st.error(f"❌ {str(e)}")
+        return
+    
+    for error in errors:
+        st.warning(f"⚠️ {error}")
+    
+    missing = [entry['filename'] for entry in entries if entry['filename'] not in files]
+    if missing:
+        st.warning(f"⚠️ ZIP 中找不到 {len(missing)} 個檔案：{', '.join(missing[:10])}")
+    
+    st.markdown(f"**共 {len(entries)} 筆可匯入** (ZIP 內有 {len(files)} 個 PDF)")
+    if entries:
+        st.dataframe(pd.DataFrame(entries), width="stretch", hide_index=True)
+    
+    if st.button("🚀 開始匯入", type="primary", disabled=not entries):
+        if not folder_id:
+            st.error("❌ 請先設定 Google Drive Folder ID")
+            return
+        
+        progress_bar = st.progress(0.0, text="上傳中...")
+        
+        def report(done, total):
+            progress_bar.progress(done / total, text=f"上傳中... {done}/{total}")
+        
+        result = run_bulk_import(
+            docs_sheet, get_google_credentials(), folder_id, entries, files,
+            st.session_state.user['display_name'], progress=report
+        )
+        progress_bar.progress(1.0, text="完成")
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("✅ 匯入", len(result['imported']))
+        with col2:
+            st.metric("❌ 失敗", len(result['failed']))
+        with col3:
+            st.metric("⚡ 每分鐘", f"{result['per_minute']:.0f} 筆")
+        
+        if result['imported']:
+            st.success(f"✅ 已匯入 {len(result['imported'])} 筆公文 (耗時 {result['seconds']:.1f} 秒)，已排入辨識佇列")
+        for filename, reason in result['failed']:
+            st.error(f"❌ {filename}：{reason}")
+
+# ===== 匯出控制項 =====
+def read_export_file(path):
+    """下載時才讀取匯出檔"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+def render_export_controls(key, root_where, root_params, scope_label):
+    """
+    匯出控制項：選擇格式與是否含附件
+    匯出檔逐批寫到暫存檔，產生過程不把資料留在記憶體
+    """
+    col1, col2 = st.columns(2)
+    with col1:
+        fmt = st.radio("格式", ['csv', 'parquet'], format_func=str.upper, horizontal=True, key=f"{key}_format")
+    with col2:
+        include_attachments = st.checkbox("📎 包含 PDF 附件 (ZIP)", key=f"{key}_attachments")
+    
+    if st.button(f"📤 匯出{scope_label}", key=f"{key}_run"):
+        suffix = 'zip' if include_attachments else fmt
+        handle, path = tempfile.mkstemp(prefix='documents_export_', suffix=f'.{suffix}')
+        progress_text = st.empty()
+        
+        def report(stage, done):
+            progress_text.caption(f"匯出中... {stage} {done} 筆")
+        
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                result = export_documents(
+                    f, fmt, include_attachments,
+                    credentials=get_google_credentials() if include_attachments else None,
+                    root_where=root_where, root_params=root_params, progress=report
+                )
+        except Exception as e:
+            os.remove(path)
+            st.error(f"匯出失敗: {str(e)}")
+            return
+        progress_text.empty()
+        
+        # 移除上一次的暫存檔
+        previous = st.session_state.get(f"{key}_file")
+        if previous and os.path.exists(previous['path']):
+            os.remove(previous['path'])
+        st.session_state[f"{key}_file"] = {
+            'path': path,
+            'name': f"documents_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{suffix}",
+            'mime': EXPORT_MIME_TYPES[suffix],
+            'result': result,
+        }
+    
+    export = st.session_state.get(f"{key}_file")
+    if export and os.path.exists(export['path']):
+        result = export['result']
+        st.caption(f"✅ 已匯出 {result['documents']} 筆公文、{result['attachments']} 個附件")
+        for doc_id, reason in result['failed']:
+            st.warning(f"⚠️ {doc_id} 附件下載失敗：{reason}")
+        st.download_button(
+            "⬇️ 下載匯出檔",
+            data=functools.partial(read_export_file, export['path']),
+            file_name=export['name'],
+            mime=export['mime'],
+            key=f"{key}_download"
+        )
+
 # ===== 查詢公文頁面 =====  
-def show_search_page(docs_sheet, drive_service, deleted_sheet, deleted_folder_id, folder_id=None):
+@timed_operation('page.search')
+def show_search_page(docs_sheet, text_sheet, drive_service, deleted_sheet, deleted_folder_id, folder_id=None):
     """查詢公文頁面 - 完整版"""
     
     st.markdown("## 🔍 查詢公文")
     
-    df = get_all_documents(docs_sheet)
-    
-    if df.empty:
+    if count_documents_replica() == 0:
         st.info("尚無公文資料")
         return
     
@@ -2165,49 +5947,151 @@ def show_search_page(docs_sheet, drive_service, deleted_sheet, deleted_folder_id
         help="勾選後會搜尋 OCR 辨識的文字內容"
     )
     
+    search_archive_docs = st.checkbox(
+        "🗄️ 同時查詢封存公文",
+        value=False,
+        key="search_archive",
+        help="封存的舊公文不在一般查詢結果內，勾選後另外列出符合條件的封存對話串"
+    )
+    
     if st.button("🔎 搜尋", type="primary"):
         st.session_state.search_performed = True
+        st.session_state.search_page = 1
+        # 新的搜尋清除分面篩選
+        for name in FACET_FIELDS:
+            st.session_state.pop(f"facet_{name}", None)
     
     st.markdown("---")
     
-    # 搜尋結果
-    if 'search_performed' in st.session_state and st.session_state.search_performed:
-        filtered_df = df.copy()
-        
-        # 日期篩選
-        if search_date_start:
-            filtered_df = filtered_df[pd.to_datetime(filtered_df['Date']) >= pd.to_datetime(search_date_start)]
-        if search_date_end:
-            filtered_df = filtered_df[pd.to_datetime(filtered_df['Date']) <= pd.to_datetime(search_date_end)]
-        
-        # 機關篩選
-        if search_agency:
-            filtered_df = filtered_df[filtered_df['Agency'].str.contains(search_agency, case=False, na=False)]
-        
-        # 類型篩選
-        if search_type != "全部":
-            filtered_df = filtered_df[filtered_df['Type'] == search_type]
+    # 搜尋結果與詳細資訊 (fragment：操作單一公文只重新執行這一區)
+    criteria = {
+        'date_start': search_date_start,
+        'date_end': search_date_end,
+        'agency': search_agency,
+        'doc_type': search_type if search_type != "全部" else None,
+        'keyword': search_keyword,
+        'fulltext': search_fulltext,
+        'archive': search_archive_docs,
+    }
+    search_results_fragment(criteria, docs_sheet, text_sheet, drive_service, deleted_sheet, deleted_folder_id, folder_id)
+
+def reset_search_page():
+    """排序、每頁筆數或分面篩選變更時回到第 1 頁"""
+    st.session_state.search_page = 1
+
+def render_search_facets(facet_counts, selected_facets):
+    """顯示各分面的筆數，選擇其中一個值即縮小查詢範圍"""
+    columns = st.columns(len(FACET_FIELDS))
+    for column, (name, (label, _)) in zip(columns, FACET_FIELDS.items()):
+        counts = dict(zip(facet_counts[name]['value'], facet_counts[name]['n']))
+        options = [''] + [value for value in counts if value]
+        if selected_facets.get(name) and selected_facets[name] not in options:
+            options.append(selected_facets[name])
+        with column:
+            st.selectbox(
+                label,
+                options,
+                format_func=lambda value, counts=counts: (
+                    "全部" if value == '' else f"{value} ({counts.get(value, 0)})"
+                ),
+                key=f"facet_{name}",
+                on_change=reset_search_page
+            )
+
+@timed_fragment("查詢結果")
+def search_results_fragment(criteria, docs_sheet, text_sheet, drive_service, deleted_sheet, deleted_folder_id, folder_id=None):
+    """查詢結果列表 (從本機副本讀取)"""
+    if st.session_state.get('search_performed'):
+        # 排序與每頁筆數 (變更時回到第 1 頁)
+        col_sort, col_size = st.columns([3, 1])
+        with col_sort:
+            sort_label = st.selectbox(
+                "排序方式", list(SEARCH_SORT_OPTIONS.keys()),
+                key="search_sort", on_change=reset_search_page
+            )
+        with col_size:
+            page_size = st.selectbox(
+                "每頁筆數", SEARCH_PAGE_SIZES, index=1,
+                key="search_page_size", on_change=reset_search_page
+            )
         
-        # 關鍵字篩選
-        if search_keyword:
-            if search_fulltext and 'OCR_Text' in filtered_df.columns:
-                filtered_df = filtered_df[filtered_df['OCR_Text'].str.contains(search_keyword, case=False, na=False)]
-            else:
-                filtered_df = filtered_df[filtered_df['Subject'].str.contains(search_keyword, case=False, na=False)]
+        # 日期、機關、類型、主旨關鍵字都在副本上以 SQL 篩選 (含回覆)，
+        # 符合的公文再經 Root_ID 對應到所屬對話串，列出對話串的原始公文
+        conditions = {
+            'date_start': criteria['date_start'],
+            'date_end': criteria['date_end'],
+            'agency': criteria['agency'],
+            'doc_type': criteria['doc_type'],
+            'keyword': criteria['keyword'] if not criteria['fulltext'] else None,
+        }
+        order_by = SEARCH_SORT_OPTIONS[sort_label]
+        selected_facets = {name: st.session_state.get(f"facet_{name}", '') for name in FACET_FIELDS}
+        
+        if criteria['keyword'] and criteria['fulltext']:
+            # 全文搜尋時才載入 OCR文字 表，比對後再統計分面與分頁
+            candidates = search_documents_replica(columns=SEARCH_COLUMNS + ['Root_ID'], **conditions)
+            ocr_texts = get_all_ocr_texts(text_sheet)
+            matched = candidates[candidates['ID'].map(ocr_texts).str.contains(criteria['keyword'], case=False, na=False)]
+            _, facet_counts, matched = get_frame_facets(matched, selected_facets)
+            matched = search_documents_replica(
+                columns=SEARCH_COLUMNS, order_by=order_by, ids=matched['Root_ID'].unique().tolist()
+            )
+            total = len(matched)
+        else:
+            # 總數與分面筆數一起取得 (沒有日期區間與關鍵字時直接讀彙總表)
+            matched = None
+            total, facet_counts = get_search_facets(selected_facets, threads=True, **conditions)
         
-        # 只顯示根節點（原始公文）
-        root_docs = filtered_df[filtered_df['Parent_ID'].isna() | (filtered_df['Parent_ID'] == '')]
+        st.subheader(f"📊 搜尋結果 (找到 {total} 個對話串)")
+        render_search_facets(facet_counts, selected_facets)
         
-        st.subheader(f"📊 搜尋結果 (找到 {len(root_docs)} 筆原始公文)")
+        if total > 0:
+            with st.expander("📤 匯出查詢結果"):
+                if matched is not None:
+                    root_where, root_params = export_root_filter(root_ids=matched['ID'].tolist())
+                else:
+                    root_where, root_params = export_root_filter(conditions, selected_facets)
+                render_export_controls("search_export", root_where, root_params, "查詢結果")
         
-        if root_docs.empty:
+        if total == 0:
             st.warning("沒有符合條件的公文")
         else:
-            # 顯示每個原始公文
-            for _, root_doc in root_docs.iterrows():
-                with st.expander(f"📤 {root_doc['ID']} | {root_doc['Date']} | {root_doc['Agency']} | {root_doc['Subject'][:40]}...", expanded=False):
+            # 分頁：只繪製目前這一頁
+            total_pages = (total + page_size - 1) // page_size
+            if st.session_state.get('search_page', 1) > total_pages:
+                st.session_state.search_page = total_pages
+            page = st.number_input(
+                f"頁次 (共 {total_pages} 頁)", min_value=1, max_value=total_pages,
+                step=1, key="search_page"
+            )
+            offset = (page - 1) * page_size
+            
+            if matched is not None:
+                page_docs = matched.iloc[offset:offset + page_size]
+            else:
+                page_docs = search_documents_replica(
+                    columns=SEARCH_COLUMNS, order_by=order_by, limit=page_size, offset=offset,
+                    threads=True, facets=selected_facets, **conditions
+                )
+            
+            if 'bulk_delete_result' in st.session_state:
+                st.success(st.session_state.pop('bulk_delete_result'))
+            with st.expander("🗑️ 批次刪除"):
+                render_bulk_delete(page_docs, docs_sheet, deleted_sheet, drive_service, deleted_folder_id, folder_id)
+            
+            # 顯示每個原始公文 (展開時才計算對話串)
+            for root_doc in page_docs.to_dict('records'):
+                thread_expander = st.expander(
+                    f"📤 {root_doc['ID']} | {root_doc['Date']} | {root_doc['Agency']} | {root_doc['Subject'][:40]}...",
+                    key=f"thread_{root_doc['ID']}",
+                    on_change="rerun"
+                )
+                with thread_expander:
+                    if not thread_expander.open:
+                        continue
+                    
                     # 取得對話串
-                    conversation = get_conversation_thread(df, root_doc['ID'])
+                    conversation = get_conversation_thread_replica(root_doc['ID'])
                     
                     st.markdown(f"**對話串** ({len(conversation)} 筆):")
                     
@@ -2225,7 +6109,7 @@ def show_search_page(docs_sheet, drive_service, deleted_sheet, deleted_folder_id
                             if st.button("👁️ 查看", key=f"view_{doc_data['ID']}_{idx}"):
                                 st.session_state.selected_doc_id = doc_data['ID']
                                 st.session_state.show_detail = True
-                                st.rerun()
+                                rerun_fragment()
                     
                     st.markdown("---")
                     
@@ -2239,12 +6123,15 @@ def show_search_page(docs_sheet, drive_service, deleted_sheet, deleted_folder_id
                                 # 建立 conversation_ids_tuple 用於快取
                                 conv_ids = tuple([doc['id'] for doc in conversation])
                                 
+                                # 只載入這個對話串的 OCR 文字
+                                ocr_texts = get_ocr_texts_by_ids(text_sheet, conv_ids)
+                                
                                 # 呼叫 Gemini API
-                                summary = get_ai_summary(conv_ids, conversation)
+                                summary = get_ai_summary(conv_ids, conversation, ocr_texts)
                                 
                                 if summary:
                                     st.session_state[summary_key] = summary
-                                    st.rerun()
+                                    rerun_fragment()
                                 else:
                                     st.error("❌ AI 摘要產生失敗。請確認已設定 GOOGLE_GEMINI_API_KEY")
                     else:
@@ -2255,18 +6142,149 @@ def show_search_page(docs_sheet, drive_service, deleted_sheet, deleted_folder_id
                         # 清除摘要按鈕
                         if st.button("🗑️ 清除摘要", key=f"clear_summary_{root_doc['ID']}"):
                             del st.session_state[summary_key]
-                            st.rerun()
+                            rerun_fragment()
+        
+        if criteria['archive']:
+            render_archive_results(criteria, docs_sheet, drive_service)
+    
+    document_detail_fragment(docs_sheet, text_sheet, drive_service, deleted_sheet, deleted_folder_id, folder_id)
+
+def render_archive_results(criteria, docs_sheet, drive_service):
+    """封存公文的查詢結果 (查封存索引；展開對話串時才下載該年度的封存檔)"""
+    st.markdown("---")
+    try:
+        total, roots = search_archive(
+            get_archive_index_sheet(docs_sheet.spreadsheet),
+            date_start=criteria['date_start'],
+            date_end=criteria['date_end'],
+            agency=criteria['agency'],
+            doc_type=criteria['doc_type'],
+            keyword=criteria['keyword'],
+        )
+    except Exception as e:
+        st.error(f"查詢封存公文失敗: {str(e)}")
+        return
+    
+    st.subheader(f"🗄️ 封存公文 (找到 {total} 個對話串)")
+    if criteria['fulltext']:
+        st.caption("封存公文的關鍵字只比對主旨")
+    if total > len(roots):
+        st.caption(f"只列出最近的 {len(roots)} 個對話串，請縮小查詢條件")
+    
+    for root_doc in roots.to_dict('records'):
+        thread_expander = st.expander(
+            f"🗄️ {root_doc['ID']} | {root_doc['Date']} | {root_doc['Agency']} | {root_doc['Subject'][:40]}...",
+            key=f"archived_thread_{root_doc['ID']}",
+            on_change="rerun"
+        )
+        with thread_expander:
+            if not thread_expander.open:
+                continue
+            
+            try:
+                conversation = get_archived_thread(drive_service, root_doc['ID'])
+            except Exception as e:
+                st.error(f"載入封存檔失敗: {str(e)}")
+                continue
+            
+            st.markdown(f"**對話串** ({len(conversation)} 筆，{root_doc['Archive_Year']} 年度封存):")
+            for idx, doc in enumerate(conversation):
+                doc_data = doc['doc']
+                indent = "　" * doc['level']
+                icon = "📤" if doc_data['Type'] in ['發文', '函'] else "📥"
+                
+                col_doc, col_btn = st.columns([4, 1])
+                with col_doc:
+                    st.markdown(f"{indent}{icon} **{doc_data['ID']}** | {doc_data['Date']} | {doc_data['Type']} | {doc_data['Agency']}")
+                with col_btn:
+                    if st.button("👁️ 查看", key=f"view_archived_{doc_data['ID']}_{idx}"):
+                        st.session_state.archived_doc = doc_data
+                        rerun_fragment()
+    
+    render_archived_detail(drive_service)
+
+def render_archived_detail(drive_service):
+    """封存公文的詳細資訊 (資料來自封存檔，附件仍在 Drive)"""
+    doc_data = st.session_state.get('archived_doc')
+    if not doc_data:
+        return
     
-    # 顯示詳細資訊
-    if 'show_detail' in st.session_state and st.session_state.show_detail and 'selected_doc_id' in st.session_state:
+    st.markdown("---")
+    st.markdown("### 🗄️ 封存公文詳細資訊")
+    col_info, col_action = st.columns([3, 1])
+    with col_info:
+        st.markdown(f"**公文字號：** `{doc_data['ID']}`")
+        st.markdown(f"**機關單位：** {doc_data['Agency']}")
+        st.markdown(f"**類型：** {doc_data['Type']}")
+        st.markdown(f"**主旨：** {doc_data['Subject']}")
+        st.markdown(f"**日期：** {doc_data['Date']}")
+        if doc_data.get('Parent_ID'):
+            st.markdown(f"**回覆：** `{doc_data['Parent_ID']}`")
+    with col_action:
+        if st.button("❌ 關閉", key="close_archived_doc"):
+            del st.session_state.archived_doc
+            rerun_fragment()
+    
+    if doc_data.get('OCR_Text'):
+        with st.expander("📝 辨識文字內容", expanded=False):
+            st.text_area("文字內容 (可複製)", doc_data['OCR_Text'], height=300, key=f"archived_ocr_{doc_data['ID']}")
+    
+    file_id = doc_data.get('Drive_File_ID')
+    if file_id:
+        st.markdown("### 📄 PDF 預覽")
+        try:
+            pdf_bytes = get_pdf_bytes(drive_service, file_id)
+            if pdf_bytes and PDF_PREVIEW_AVAILABLE:
+                display_pdf_from_bytes(pdf_bytes, f"預覽 - {doc_data['ID']}")
+            else:
+                st.info("PDF 預覽不可用")
+        except Exception as e:
+            st.error(f"載入 PDF 失敗: {str(e)}")
+
+def render_bulk_delete(page_docs, docs_sheet, deleted_sheet, drive_service, deleted_folder_id, folder_id=None):
+    """批次刪除本頁選取的公文 (刪除紀錄一次寫入、工作表一次刪除、附件一次批次移動)"""
+    st.warning("刪除後將移至刪除紀錄，無法從前台復原！回覆公文請從對話串的「查看」個別刪除")
+    labels = {
+        doc['ID']: f"{doc['ID']} | {doc['Date']} | {doc['Agency']} | {doc['Subject'][:30]}"
+        for doc in page_docs.to_dict('records')
+    }
+    selected = st.multiselect(
+        "選擇要刪除的公文 (本頁)", list(labels), format_func=labels.get, key="bulk_delete_ids"
+    )
+    confirmed = st.checkbox(f"確認刪除選取的 {len(selected)} 筆公文", key="bulk_delete_confirm")
+    
+    if st.button("🗑️ 刪除選取的公文", type="secondary", disabled=not (selected and confirmed), key="bulk_delete_btn"):
+        with st.spinner(f"刪除 {len(selected)} 筆公文..."):
+            deleted = soft_delete_documents(docs_sheet, deleted_sheet, selected, st.session_state.user['display_name'])
+            file_ids = [row.get('Drive_File_ID') for row in deleted.values() if row.get('Drive_File_ID')]
+            moved = []
+            if file_ids and deleted_folder_id:
+                results = move_files_to_folder(drive_service, file_ids, deleted_folder_id)
+                moved = [file_id for file_id, result in results.items() if result['ok']]
+        
+        if deleted:
+            st.session_state.bulk_delete_result = (
+                f"✅ 已刪除 {len(deleted)} 筆公文，移動 {len(moved)}/{len(file_ids)} 個附件到刪除資料夾"
+            )
+            missing = [doc_id for doc_id in selected if doc_id not in deleted]
+            if missing:
+                st.session_state.bulk_delete_result += f"；找不到 {', '.join(missing)}"
+            for key in ['bulk_delete_ids', 'bulk_delete_confirm']:
+                st.session_state.pop(key, None)
+            # 搜尋結果與統計都需要更新，整頁重新執行
+            st.rerun()
+
+@timed_fragment("公文詳細資訊")
+def document_detail_fragment(docs_sheet, text_sheet, drive_service, deleted_sheet, deleted_folder_id, folder_id=None):
+    """公文詳細資訊面板"""
+    if st.session_state.get('show_detail') and 'selected_doc_id' in st.session_state:
         st.markdown("---")
         st.markdown("### 👁️ 公文詳細資訊")
         
         selected_id = st.session_state.selected_doc_id
-        selected_row = df[df['ID'] == selected_id]
+        selected_row = get_document_replica(selected_id)
         
-        if not selected_row.empty:
-            selected_row = selected_row.iloc[0]
+        if selected_row is not None:
             
             col_info, col_action = st.columns([3, 1])
             
@@ -2285,20 +6303,25 @@ def show_search_page(docs_sheet, drive_service, deleted_sheet, deleted_folder_id
                 if st.button("❌ 關閉詳細資訊"):
                     st.session_state.show_detail = False
                     del st.session_state.selected_doc_id
-                    st.rerun()
+                    rerun_fragment()
             
             st.markdown("---")
             
             # OCR 文字顯示
-            ocr_status = selected_row.get('OCR_Status', 'pending')
-            ocr_text = selected_row.get('OCR_Text', '')
+            ocr_status = ocr_status_kind(selected_row.get('OCR_Status', 'pending'))
+            ocr_progress = ocr_status_progress(selected_row.get('OCR_Status'))
+            ocr_text = get_ocr_text(text_sheet, selected_id) if ocr_status == 'completed' else ''
             
             if ocr_status == 'completed' and ocr_text:
                 with st.expander("📝 辨識文字內容", expanded=False):
                     st.text_area("文字內容 (可複製)", ocr_text, height=300, key=f"ocr_text_{selected_id}")
                     st.caption(f"辨識時間: {selected_row.get('OCR_Date', '未知')}")
+            elif ocr_status == 'pending' and ocr_progress:
+                st.info(f"⏳ 文字辨識中 (已完成 {ocr_progress[0]}/{ocr_progress[1]} 頁)，請稍後查看...")
             elif ocr_status == 'pending':
                 st.info("⏳ 文字辨識中，請稍後查看...")
+            elif ocr_status == 'failed' and ocr_progress:
+                st.warning(f"❌ 文字辨識失敗 (已完成 {ocr_progress[0]}/{ocr_progress[1]} 頁，重新辨識會從第 {ocr_progress[0] + 1} 頁繼續)")
             elif ocr_status == 'failed':
                 st.warning("❌ 文字辨識失敗")
             elif ocr_status == 'skipped':
@@ -2311,7 +6334,7 @@ def show_search_page(docs_sheet, drive_service, deleted_sheet, deleted_folder_id
             if file_id:
                 st.markdown("### 📄 PDF 預覽")
                 try:
-                    pdf_bytes = download_from_drive(drive_service, file_id)
+                    pdf_bytes = get_pdf_bytes(drive_service, file_id)
                     if pdf_bytes and PDF_PREVIEW_AVAILABLE:
                         display_pdf_from_bytes(pdf_bytes, f"預覽 - {selected_row['ID']}")
                     else:
@@ -2336,25 +6359,91 @@ def show_search_page(docs_sheet, drive_service, deleted_sheet, deleted_folder_id
                         if soft_delete_document(docs_sheet, deleted_sheet, selected_row['ID'], st.session_state.user['display_name']):
                             # 移動檔案到刪除資料夾
                             if file_id and deleted_folder_id:
-                                try:
-                                    drive_service.files().update(
-                                        fileId=file_id,
-                                        addParents=deleted_folder_id,
-                                        removeParents=','.join([p for p in [folder_id] if p]),
-                                        fields='id, parents'
-                                    ).execute()
-                                except:
-                                    pass
+                                move_files_to_folder(drive_service, [file_id], deleted_folder_id)
                             
                             st.success("✅ 公文已刪除")
                             st.session_state.show_detail = False
                             del st.session_state.selected_doc_id
+                            # 搜尋結果也需要更新，整頁重新執行
                             st.rerun()
                     else:
                         st.error("❌ 公文字號不符，刪除失敗")
 
 # ===== 系統管理頁面 =====
-def show_admin_page(docs_sheet, deleted_sheet, users_sheet):
+def performance_page():
+    """效能監控：API 每分鐘呼叫數與配額、各操作耗時分布、匯出結構化紀錄"""
+    st.markdown("### ⏱️ 效能監控")
+    metrics = get_metrics()
+    st.caption(
+        f"自 {metrics['started_at'].strftime('%Y-%m-%d %H:%M:%S')} 起 (本行程所有使用者)，"
+        f"每種操作保留最近 {METRIC_SAMPLE_LIMIT} 筆耗時"
+    )
+    
+    # Google API 呼叫數與配額
+    st.markdown("**Google API 每分鐘呼叫數**")
+    quotas = get_api_quotas()
+    calls = get_api_calls_per_minute()
+    current = calls.iloc[-1] if not calls.empty else pd.Series(0, index=list(quotas))
+    quota_cols = st.columns(len(quotas))
+    for col, (service, quota) in zip(quota_cols, quotas.items()):
+        used = int(current.get(service, 0))
+        with col:
+            st.metric(f"{service} (本分鐘)", f"{used:,} / {quota:,}")
+            st.progress(min(used / quota, 1.0) if quota else 0.0)
+            if quota and used >= quota * 0.8:
+                st.warning("⚠️ 接近配額上限")
+    if not calls.empty:
+        st.line_chart(calls)
+    
+    st.markdown("---")
+    
+    # 各操作耗時分布
+    st.markdown("**各操作耗時**")
+    summary = summarize_metrics()
+    if summary.empty:
+        st.info("尚無量測資料")
+        return
+    
+    st.dataframe(
+        summary,
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            '平均 KB': st.column_config.NumberColumn(format="%.1f"),
+            'p50 (ms)': st.column_config.NumberColumn(format="%.1f"),
+            'p95 (ms)': st.column_config.NumberColumn(format="%.1f"),
+            'p99 (ms)': st.column_config.NumberColumn(format="%.1f"),
+        }
+    )
+    
+    operation = st.selectbox("耗時分布", summary['操作'].tolist(), key="perf_operation")
+    with metrics['lock']:
+        samples = pd.Series(list(metrics['durations'].get(operation, [])), dtype=float)
+    if not samples.empty:
+        bins = pd.cut(samples, bins=min(20, max(samples.nunique(), 1)))
+        histogram = bins.value_counts(sort=False)
+        histogram.index = [f"{interval.right:.0f}" for interval in histogram.index]
+        st.bar_chart(histogram.rename('次數'), x_label="耗時上限 (ms)", y_label="次數")
+    
+    st.markdown("---")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            "📥 匯出結構化紀錄 (JSON Lines)",
+            data=export_metrics_log,
+            file_name=f"metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl",
+            mime="application/x-ndjson",
+            key="export_metrics"
+        )
+        st.caption(f"最近 {METRIC_LOG_LIMIT:,} 筆：時間、操作、服務、耗時、位元組數、結果")
+    with col2:
+        if st.button("🧹 清除量測資料", key="reset_metrics"):
+            reset_metrics()
+            st.rerun()
+
+@timed_operation('page.admin')
+def show_admin_page(docs_sheet, deleted_sheet, users_sheet, text_sheet, drive_service=None, folder_id=None):
     """系統管理頁面 - 完整版"""
     
     st.markdown("## 📊 系統管理")
@@ -2362,7 +6451,7 @@ def show_admin_page(docs_sheet, deleted_sheet, users_sheet):
     # 功能選擇
     admin_tab = st.radio(
         "選擇功能",
-        ["👥 使用者管理", "🗑️ 刪除紀錄"],
+        ["👥 使用者管理", "🗑️ 刪除紀錄", "🧰 資料維護", "⏱️ 效能監控"],
         horizontal=True
     )
     
@@ -2385,6 +6474,81 @@ def show_admin_page(docs_sheet, deleted_sheet, users_sheet):
             )
             
             st.caption(f"共 {len(deleted_df)} 筆刪除紀錄")
+    
+    elif admin_tab == "🧰 資料維護":
+        st.markdown("### 🧰 資料維護")
+        
+        st.markdown("**OCR 文字搬移**")
+        st.caption("將公文資料表內殘留的 OCR 文字搬到「OCR文字」工作表，已搬過的公文會略過")
+        if st.button("🔁 執行搬移", key="migrate_ocr_text"):
+            with st.spinner("搬移中..."):
+                moved = migrate_ocr_text_to_sidecar(docs_sheet, text_sheet)
+            st.success(f"✅ 已搬移 {moved} 筆 OCR 文字")
+        
+        st.markdown("---")
+        st.markdown("**匯出全部公文**")
+        st.caption("匯出所有公文與對話串結構，可選擇一併打包 PDF 附件")
+        render_export_controls("corpus_export", *export_root_filter(), "全部公文")
+        
+        st.markdown("---")
+        st.markdown("**對話串欄位**")
+        st.caption("依 Parent_ID 重新計算每筆公文的 Root_ID 與 Depth (直接在試算表修改上層公文後使用)")
+        if st.button("🔁 重新計算", key="backfill_threads"):
+            with st.spinner("計算中..."):
+                updated = backfill_thread_columns(docs_sheet)
+            st.success(f"✅ 已更新 {updated} 筆公文")
+        
+        st.markdown("---")
+        st.markdown("**附件資料夾整理**")
+        st.caption("新附件依公文日期放在「年/年-月」子資料夾，根資料夾內的舊附件於背景自動搬移")
+        migration = get_drive_migration_state()
+        status_labels = {'idle': '尚未開始', 'running': '搬移中', 'done': '已完成', 'failed': '失敗'}
+        st.write(
+            f"狀態：{status_labels[migration['status']]}　"
+            f"已搬移 {migration['moved']} 個、失敗 {migration['failed']} 個、略過 {migration['skipped']} 個"
+        )
+        if migration['error']:
+            st.error(f"搬移失敗: {migration['error']}")
+        
+        st.markdown("---")
+        st.markdown("**公文分片**")
+        st.caption(f"依公文日期把公文分到「{shard_title('YYYY')}」年度工作表，讀取時自動合併各分片")
+        if isinstance(docs_sheet, ShardedWorksheet):
+            years = [year for year, _ in docs_sheet.shards if year]
+            st.write(f"目前分片：{'、'.join(years) if years else '無'}")
+        else:
+            st.write("目前分片：未啟用")
+        if st.button("🔁 搬移到年度分片", key="migrate_shards"):
+            with st.spinner("搬移中..."):
+                try:
+                    moved = migrate_documents_to_shards(docs_sheet)
+                    st.success(f"✅ 已搬移 {sum(moved.values())} 筆公文 ({len(moved)} 個年度)，已改用年度分片")
+                except Exception as e:
+                    st.error(f"搬移失敗: {str(e)}")
+        
+        st.markdown("---")
+        st.markdown("**封存舊公文**")
+        archive_years = int(get_setting('ARCHIVE_AFTER_YEARS', ARCHIVE_AFTER_YEARS))
+        st.caption(
+            f"最後一筆公文早於 {archive_years} 年前的對話串整串移到 Drive「{ARCHIVE_FOLDER_NAME}」資料夾的年度封存檔 "
+            f"(Parquet)，並記錄在「{ARCHIVE_INDEX_TITLE}」工作表；可在查詢公文頁勾選「同時查詢封存公文」查看"
+        )
+        last_run = get_archive_state()['last_run']
+        if last_run:
+            st.write(f"上次封存：{last_run['at'][:19]}，{sum(last_run['archived'].values())} 筆公文")
+        if st.button("🗄️ 立即封存", key="archive_old_threads", disabled=not folder_id):
+            with st.spinner("封存中..."):
+                try:
+                    archived = archive_old_threads(
+                        docs_sheet, text_sheet, get_archive_index_sheet(docs_sheet.spreadsheet),
+                        drive_service, folder_id
+                    )
+                    st.success(f"✅ 已封存 {sum(archived.values())} 筆公文 ({len(archived)} 個年度)")
+                except Exception as e:
+                    st.error(f"封存失敗: {str(e)}")
+    
+    elif admin_tab == "⏱️ 效能監控":
+        performance_page()
 
 if __name__ == "__main__":
     main()
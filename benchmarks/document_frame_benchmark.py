@@ -0,0 +1,120 @@
+"""
+型別化公文資料框效能測試
+
+以合成資料比較工作表原始字串資料框與 build_typed_documents 建立的型別化資料框：
+1. 記憶體用量 (memory_usage(deep=True))
+2. 建立型別化資料框的時間 (每份快照只需一次)
+3. 常用篩選的時間：近三個月、依類型、依機關、找回覆 (Parent_ID)
+
+用法：
+    python benchmarks/document_frame_benchmark.py
+    python benchmarks/document_frame_benchmark.py --rows 200000 --runs 5
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+import warnings
+from datetime import datetime, timedelta
+
+warnings.filterwarnings('ignore')
+# 在 streamlit run 以外匯入 app 會有大量警告，這裡不需要
+logging.disable(logging.WARNING)
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import app  # noqa: E402
+
+TYPES = ['發文', '收文', '函', '簽呈']
+AGENCIES = [f'機關{i:02d}' for i in range(40)]
+OCR_STATUSES = ['pending', 'completed', 'failed', 'skipped']
+
+
+def make_documents(rows, seed=0):
+    """產生與工作表相同格式的字串資料框 (以向量運算產生，百萬筆也只需數秒)"""
+    rng = np.random.default_rng(seed)
+    numbers = pd.Series(np.arange(rows)).astype(str).str.zfill(7)
+    dates = pd.Series(np.datetime64('2015-01-01') + rng.integers(0, 3800, rows).astype('timedelta64[D]'))
+    parents = pd.Series(np.floor(rng.random(rows) * np.arange(rows)).astype(int)).astype(str).str.zfill(7)
+    has_parent = (rng.random(rows) < 0.4) & (np.arange(rows) > 0)
+
+    df = pd.DataFrame({
+        'ID': 'DOC' + numbers,
+        'Date': dates.dt.strftime('%Y-%m-%d'),
+        'Type': np.array(TYPES)[rng.integers(0, len(TYPES), rows)],
+        'Agency': np.array(AGENCIES)[rng.integers(0, len(AGENCIES), rows)],
+        'Subject': '關於第 ' + numbers + ' 號案件之辦理情形說明',
+        'Parent_ID': ('DOC' + parents).where(has_parent, ''),
+        'Status': 'active',
+        'OCR_Status': np.array(OCR_STATUSES)[rng.integers(0, len(OCR_STATUSES), rows)],
+        'Created_At': (dates + pd.Timedelta(hours=9)).dt.strftime('%Y-%m-%dT%H:%M:%S'),
+        'OCR_Date': (dates + pd.Timedelta(days=1)).dt.strftime('%Y-%m-%dT%H:%M:%S'),
+    })
+    return df.astype(app.compact_string_dtype())
+
+
+def timed(func, runs):
+    """執行多次取中位數 (毫秒)"""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def filter_cases(df, typed):
+    """回傳 (名稱, 原始資料框寫法, 型別化資料框寫法)"""
+    threshold = datetime.now() - timedelta(days=90)
+    parent_id = df['ID'].iloc[len(df) // 2]
+    return [
+        ('近三個月',
+         lambda: df[pd.to_datetime(df['Date'], errors='coerce') >= threshold],
+         lambda: typed[typed['Date_Parsed'] >= threshold]),
+        ('類型 = 發文',
+         lambda: df[df['Type'] == '發文'],
+         lambda: typed[typed['Type'] == '發文']),
+        ('機關 = 機關07',
+         lambda: df[df['Agency'] == '機關07'],
+         lambda: typed[typed['Agency'] == '機關07']),
+        ('OCR 待辨識',
+         lambda: df[df['OCR_Status'] == 'pending'],
+         lambda: typed[typed['OCR_Status'] == 'pending']),
+        ('找回覆 (Parent_ID)',
+         lambda: df[df['Parent_ID'] == parent_id],
+         lambda: typed[typed['Parent_ID'] == parent_id]),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='型別化公文資料框效能測試')
+    parser.add_argument('--rows', type=int, default=100000, help='合成公文筆數')
+    parser.add_argument('--runs', type=int, default=5, help='每項量測重複次數 (取中位數)')
+    args = parser.parse_args()
+
+    df = make_documents(args.rows)
+    build_ms = timed(lambda: app.build_typed_documents(df), args.runs)
+    typed = app.build_typed_documents(df)
+
+    raw_bytes = df.memory_usage(deep=True).sum()
+    typed_bytes = typed.memory_usage(deep=True).sum()
+
+    print(f"[{args.rows:,} 筆公文]")
+    print(f"  記憶體 (原始字串)   : {raw_bytes / 1024 / 1024:8.1f} MB")
+    print(f"  記憶體 (型別化)     : {typed_bytes / 1024 / 1024:8.1f} MB  (含 *_Parsed 欄位)")
+    print(f"  建立型別化資料框    : {build_ms:8.1f} ms  (每份快照一次)")
+    print()
+    print(f"  {'篩選':<20}{'原始 (ms)':>12}{'型別化 (ms)':>14}")
+    for name, raw_filter, typed_filter in filter_cases(df, typed):
+        raw_ms = timed(raw_filter, args.runs)
+        typed_ms = timed(typed_filter, args.runs)
+        print(f"  {name:<20}{raw_ms:>12.2f}{typed_ms:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,574 @@
+"""
+離線替身：gspread 工作表、Drive v3 files API、Vision、Gemini
+
+全部在同一個行程內執行，不需要網路與憑證。每個服務可以設定：
+- 延遲：固定延遲 + 每 KB 傳輸延遲 + 隨機抖動 (毫秒)，latency_scale 可整體縮放
+- 配額：每分鐘呼叫次數上限，超過時拋出 QuotaExceeded 或等待 (quota_mode)
+並記錄各方法的呼叫次數、傳輸量與碰到配額的次數。
+
+用法：
+    backend = FakeBackend(latency_scale=0.1)
+    backend.spreadsheet.seed_worksheet('公文資料', rows)
+    with backend.install():
+        import app
+        ...
+    print(backend.stats())
+"""
+import contextlib
+import io
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from types import SimpleNamespace
+
+import gspread
+from gspread.utils import a1_range_to_grid_range, rowcol_to_a1
+
+# 估算傳輸量用的每格平均位元組數 (逐格計算會讓替身本身的耗時干擾量測)
+CELL_BYTES = 16
+SPREADSHEET_ID = 'BENCHMARK_SHEET'
+
+
+class QuotaExceeded(Exception):
+    """模擬 Google API 的 429 RESOURCE_EXHAUSTED"""
+
+
+class ServiceModel:
+    """單一服務的延遲與配額設定，並記錄呼叫統計"""
+
+    def __init__(self, name, latency_ms=0.0, per_kb_ms=0.0, jitter_ms=0.0,
+                 quota_per_minute=None, quota_mode='raise', seed=0):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.per_kb_ms = per_kb_ms
+        self.jitter_ms = jitter_ms
+        self.quota_per_minute = quota_per_minute
+        self.quota_mode = quota_mode
+        self.scale = 1.0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window = deque()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = defaultdict(int)
+            self.bytes = 0
+            self.quota_hits = 0
+            self._window.clear()
+
+    def _acquire_quota(self):
+        """滑動視窗配額：一分鐘內的呼叫數達上限時拋出例外或等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._window and now - self._window[0] >= 60:
+                    self._window.popleft()
+                if self.quota_per_minute is None or len(self._window) < self.quota_per_minute:
+                    self._window.append(now)
+                    return
+                self.quota_hits += 1
+                wait = 60 - (now - self._window[0])
+            if self.quota_mode != 'wait':
+                raise QuotaExceeded(f"429 RESOURCE_EXHAUSTED: {self.name} 超過每分鐘 {self.quota_per_minute} 次")
+            time.sleep(wait)
+
+    def call(self, method, nbytes=0):
+        """記錄一次呼叫並模擬延遲"""
+        self._acquire_quota()
+        with self._lock:
+            self.calls[method] += 1
+            self.bytes += nbytes
+            jitter = self._random.random() * self.jitter_ms
+        delay_ms = (self.latency_ms + self.per_kb_ms * nbytes / 1024 + jitter) * self.scale
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'calls': dict(self.calls),
+                'total_calls': sum(self.calls.values()),
+                'bytes': self.bytes,
+                'quota_hits': self.quota_hits,
+            }
+
+
+# ===== gspread =====
+class FakeCell:
+    def __init__(self, row, col, value):
+        self.row = row
+        self.col = col
+        self.value = value
+
+
+class FakeWorksheet:
+    """gspread.Worksheet 中 app.py 用到的方法"""
+
+    def __init__(self, spreadsheet, title, rows=None, sheet_id=0):
+        self.spreadsheet = spreadsheet
+        self.spreadsheet_id = spreadsheet.id
+        self.title = title
+        self.id = sheet_id
+        self.rows = [[str(value) for value in row] for row in (rows or [])]
+        self.version = 1
+
+    @property
+    def _service(self):
+        return self.spreadsheet.backend.sheets
+
+    def _width(self):
+        return max((len(row) for row in self.rows), default=0)
+
+    def _grid(self, a1_range):
+        grid = a1_range_to_grid_range(a1_range)
+        return (
+            grid.get('startRowIndex', 0),
+            grid.get('endRowIndex', len(self.rows)),
+            grid.get('startColumnIndex', 0),
+            grid.get('endColumnIndex', self._width()),
+        )
+
+    def _read(self, a1_range):
+        start_row, end_row, start_col, end_col = self._grid(a1_range)
+        values = []
+        for row in self.rows[start_row:end_row]:
+            cells = row[start_col:end_col]
+            while cells and cells[-1] == '':
+                cells.pop()
+            values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def _changed(self, method, cells):
+        self.version += 1
+        self._service.call(method, cells * CELL_BYTES)
+
+    def get_all_values(self):
+        width = self._width()
+        values = [row + [''] * (width - len(row)) for row in self.rows]
+        self._service.call('get_all_values', len(values) * width * CELL_BYTES)
+        return values
+
+    def get_all_records(self):
+        values = self.get_all_values()
+        if not values:
+            return []
+        return [dict(zip(values[0], row)) for row in values[1:]]
+
+    def row_values(self, row):
+        values = list(self.rows[row - 1]) if row <= len(self.rows) else []
+        while values and values[-1] == '':
+            values.pop()
+        self._service.call('row_values', len(values) * CELL_BYTES)
+        return values
+
+    def col_values(self, col):
+        values = [row[col - 1] if len(row) >= col else '' for row in self.rows]
+        while values and values[-1] == '':
+            values.pop()
+        self._service.call('col_values', len(values) * CELL_BYTES)
+        return values
+
+    def get(self, range_name=None, **kwargs):
+        values = self._read(range_name) if range_name else self.get_all_values()
+        self._service.call('get', sum(len(row) for row in values) * CELL_BYTES)
+        return values
+
+    def batch_get(self, ranges, **kwargs):
+        results = [self._read(a1_range) for a1_range in ranges]
+        cells = sum(len(values) for values in results)
+        self._service.call('batch_get', cells * CELL_BYTES)
+        return results
+
+    def batch_clear(self, ranges):
+        cells = 0
+        for a1_range in ranges:
+            start_row, end_row, start_col, end_col = self._grid(a1_range)
+            for row in self.rows[start_row:end_row]:
+                for col in range(start_col, min(end_col, len(row))):
+                    row[col] = ''
+                    cells += 1
+        self._changed('batch_clear', cells)
+
+    def append_row(self, values, **kwargs):
+        self.rows.append([str(value) for value in values])
+        self._changed('append_row', len(values))
+
+    def append_rows(self, values, **kwargs):
+        self.rows.extend([str(value) for value in row] for row in values)
+        self._changed('append_rows', sum(len(row) for row in values))
+
+    def find(self, query, in_column=None, in_row=None, **kwargs):
+        self._service.call('find', len(self.rows) * CELL_BYTES)
+        for row_index, row in enumerate(self.rows, start=1):
+            if in_row is not None and row_index != in_row:
+                continue
+            for col_index, value in enumerate(row, start=1):
+                if value == query and (in_column is None or col_index == in_column):
+                    return FakeCell(row_index, col_index, value)
+        return None
+
+    def update(self, values=None, range_name=None, **kwargs):
+        self._write(values, range_name)
+        self._changed('update', sum(len(row) for row in values))
+
+    def batch_update(self, data, **kwargs):
+        for item in data:
+            self._write(item['values'], item['range'])
+        self._changed('batch_update', sum(len(row) for item in data for row in item['values']))
+
+    def _write(self, values, range_name):
+        start_row, _, start_col, _ = self._grid(range_name)
+        for offset, row_values in enumerate(values):
+            while len(self.rows) <= start_row + offset:
+                self.rows.append([])
+            row = self.rows[start_row + offset]
+            for col_offset, value in enumerate(row_values):
+                while len(row) <= start_col + col_offset:
+                    row.append('')
+                row[start_col + col_offset] = str(value)
+
+    def update_cell(self, row, col, value):
+        self.update([[value]], rowcol_to_a1(row, col))
+
+    def delete_rows(self, start_index, end_index=None):
+        del self.rows[start_index - 1:(end_index or start_index)]
+        self._changed('delete_rows', 0)
+
+
+class FakeSpreadsheet:
+    def __init__(self, backend, spreadsheet_id=SPREADSHEET_ID):
+        self.backend = backend
+        self.id = spreadsheet_id
+        self._worksheets = {}
+
+    @property
+    def version(self):
+        """試算表版本 = 各工作表版本總和 (任何修改都會遞增)"""
+        return sum(worksheet.version for worksheet in self._worksheets.values())
+
+    def seed_worksheet(self, title, rows):
+        """直接建立工作表資料 (不計入 API 呼叫)"""
+        worksheet = FakeWorksheet(self, title, rows, sheet_id=len(self._worksheets) + 1)
+        self._worksheets[title] = worksheet
+        return worksheet
+
+    def worksheets(self):
+        self.backend.sheets.call('worksheets')
+        return list(self._worksheets.values())
+
+    def worksheet(self, title):
+        self.backend.sheets.call('worksheet')
+        if title not in self._worksheets:
+            raise gspread.WorksheetNotFound(title)
+        return self._worksheets[title]
+
+    def add_worksheet(self, title, rows=1000, cols=20, **kwargs):
+        self.backend.sheets.call('add_worksheet')
+        return self.seed_worksheet(title, [])
+
+    def batch_update(self, body):
+        """目前只支援 deleteDimension (刪除列)"""
+        self.backend.sheets.call('batch_update')
+        by_id = {worksheet.id: worksheet for worksheet in self._worksheets.values()}
+        for request in body.get('requests', []):
+            grid = request['deleteDimension']['range']
+            worksheet = by_id[grid['sheetId']]
+            del worksheet.rows[grid['startIndex']:grid['endIndex']]
+            worksheet.version += 1
+        return {'replies': []}
+
+
+class FakeSheetsClient:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def open_by_key(self, key):
+        self.backend.sheets.call('open_by_key')
+        return self.backend.spreadsheet
+
+
+# ===== Drive v3 =====
+class FakeRequest:
+    """googleapiclient 的 HttpRequest：execute() 時才計入呼叫"""
+
+    def __init__(self, service, method, handler, nbytes=0):
+        self._service = service
+        self._method = method
+        self._handler = handler
+        self._nbytes = nbytes
+
+    def execute(self, **kwargs):
+        self._service.call(self._method, self._nbytes)
+        return self._handler()
+
+
+class FakeHttpResponse(dict):
+    def __init__(self, status, headers):
+        super().__init__(headers)
+        self.status = status
+
+
+class FakeMediaHttp:
+    """提供給 MediaIoBaseDownload 的 http 物件，一次回傳整個檔案"""
+
+    def __init__(self, drive, file_id):
+        self._drive = drive
+        self._file_id = file_id
+
+    def request(self, uri, method='GET', headers=None, **kwargs):
+        content = self._drive.store[self._file_id]['content']
+        self._drive.backend.drive.call('get_media', len(content))
+        return FakeHttpResponse(200, {'content-length': str(len(content))}), content
+
+
+class FakeMediaRequest:
+    def __init__(self, drive, file_id):
+        self.uri = f'https://fake.drive/{file_id}?alt=media'
+        self.headers = {}
+        self.http = FakeMediaHttp(drive, file_id)
+
+
+class FakeDriveFiles:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def get(self, fileId=None, fields=None, **kwargs):
+        drive = self._drive
+
+        def handler():
+            if fileId == drive.backend.spreadsheet.id:
+                return {'id': fileId, 'version': str(drive.backend.spreadsheet.version)}
+            meta = drive.store[fileId]
+            return {'id': fileId, 'name': meta['name'], 'parents': list(meta['parents'])}
+        return FakeRequest(drive.backend.drive, 'files.get', handler)
+
+    def get_media(self, fileId=None, **kwargs):
+        return FakeMediaRequest(self._drive, fileId)
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        drive = self._drive
+        content = media_body.getbytes(0, media_body.size()) if media_body is not None else b''
+        return FakeRequest(drive.backend.drive, 'files.create',
+                           lambda: {'id': drive.add_file(body.get('name'), body.get('parents', []), content,
+                                                         body.get('mimeType', 'application/pdf'))},
+                           len(content))
+
+    def update(self, fileId=None, addParents=None, removeParents=None, body=None, media_body=None,
+               fields=None, **kwargs):
+        drive = self._drive
+        content = media_body.getbytes(0, media_body.size()) if media_body is not None else None
+
+        def handler():
+            meta = drive.store[fileId]
+            if content is not None:
+                meta['content'] = content
+            if removeParents:
+                meta['parents'] = [p for p in meta['parents'] if p not in removeParents.split(',')]
+            if addParents:
+                meta['parents'] += addParents.split(',')
+            if body and 'name' in body:
+                meta['name'] = body['name']
+            return {'id': fileId, 'parents': list(meta['parents'])}
+        return FakeRequest(drive.backend.drive, 'files.update', handler, len(content or b''))
+
+    def list(self, q='', fields=None, **kwargs):
+        drive = self._drive
+
+        def handler():
+            matches = [
+                {'id': file_id, 'name': meta['name']}
+                for file_id, meta in drive.store.items()
+                if f"name='{meta['name']}'" in q and any(f"'{p}' in parents" in q for p in meta['parents'])
+            ]
+            return {'files': matches}
+        return FakeRequest(drive.backend.drive, 'files.list', handler)
+
+
+class FakeBatchRequest:
+    """BatchHttpRequest：整批只計入一次呼叫，再逐一回呼"""
+
+    def __init__(self, service, callback=None):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        request_id = request_id or str(len(self._requests) + 1)
+        self._requests.append((request_id, request, callback or self._callback))
+
+    def execute(self, **kwargs):
+        self._service.call('batch', sum(request._nbytes for _, request, _ in self._requests))
+        for request_id, request, callback in self._requests:
+            try:
+                response, exception = request._handler(), None
+            except Exception as e:
+                response, exception = None, e
+            if callback:
+                callback(request_id, response, exception)
+
+
+class FakeDrivePermissions:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def create(self, fileId=None, body=None, **kwargs):
+        drive = self._drive
+
+        def handler():
+            permissions = drive.store[fileId].setdefault('permissions', [])
+            permissions.append(dict(body or {}))
+            return {'id': f'PERM{len(permissions)}'}
+        return FakeRequest(drive.backend.drive, 'permissions.create', handler)
+
+
+class FakeDrive:
+    """Drive v3 服務：檔案內容存在記憶體"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @property
+    def store(self):
+        return self.backend.drive_store
+
+    def add_file(self, name, parents, content=b'', mime_type='application/pdf'):
+        with self.backend.drive_lock:
+            file_id = f'FILE{len(self.store) + 1:07d}'
+            self.store[file_id] = {'name': name, 'parents': list(parents), 'content': content, 'mimeType': mime_type}
+        return file_id
+
+    def files(self):
+        return FakeDriveFiles(self)
+
+    def permissions(self):
+        return FakeDrivePermissions(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatchRequest(self.backend.drive, callback)
+
+
+# ===== Vision =====
+class FakeVisionClient:
+    """vision.ImageAnnotatorClient：每張圖回傳固定的辨識文字"""
+
+    backend = None
+
+    def __init__(self, credentials=None, **kwargs):
+        pass
+
+    def text_detection(self, image=None, **kwargs):
+        content = getattr(image, 'content', b'') or b''
+        self.backend.vision.call('text_detection', len(content))
+        text = f"模擬辨識文字 {len(content)} bytes\n" + "主旨：關於補助計畫辦理情形。" * 20
+        return SimpleNamespace(text_annotations=[SimpleNamespace(description=text)])
+
+    document_text_detection = text_detection
+
+
+# ===== Gemini =====
+class FakeGenAIModels:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def generate_content(self, model=None, contents=None, **kwargs):
+        prompt = contents if isinstance(contents, str) else str(contents)
+        self._backend.gemini.call('generate_content', len(prompt.encode('utf-8')))
+        return SimpleNamespace(text=f"【模擬摘要】{model}：共 {len(prompt)} 字的對話串，目前等待對方回覆。")
+
+
+class FakeGenAIClient:
+    backend = None
+
+    def __init__(self, api_key=None, **kwargs):
+        self.models = FakeGenAIModels(self.backend)
+
+
+# ===== 整組替身 =====
+class FakeBackend:
+    """整組替身共用的資料與統計"""
+
+    def __init__(self, latency_scale=1.0, sheets=None, drive=None, vision=None, gemini=None):
+        # 預設延遲接近實際 API 的數量級；預設不限配額，要模擬 Sheets 每位使用者每分鐘 60 次讀取的限制時
+        # 傳入 sheets=ServiceModel('sheets', ..., quota_per_minute=60)
+        self.sheets = sheets or ServiceModel('sheets', latency_ms=80, per_kb_ms=0.05, jitter_ms=40)
+        self.drive = drive or ServiceModel('drive', latency_ms=60, per_kb_ms=0.02, jitter_ms=30)
+        self.vision = vision or ServiceModel('vision', latency_ms=350, per_kb_ms=0.01, jitter_ms=150)
+        self.gemini = gemini or ServiceModel('gemini', latency_ms=900, per_kb_ms=0.05, jitter_ms=300)
+        self.set_latency_scale(latency_scale)
+        self.spreadsheet = FakeSpreadsheet(self)
+        self.drive_store = {}
+        self.drive_lock = threading.Lock()
+
+    @property
+    def services(self):
+        return {'sheets': self.sheets, 'drive': self.drive, 'vision': self.vision, 'gemini': self.gemini}
+
+    def set_latency_scale(self, scale):
+        for service in self.services.values():
+            service.scale = scale
+
+    def reset_stats(self):
+        for service in self.services.values():
+            service.reset()
+
+    def stats(self):
+        return {name: service.snapshot() for name, service in self.services.items()}
+
+    def total_calls(self):
+        return {name: snapshot['total_calls'] for name, snapshot in self.stats().items()}
+
+    def add_drive_file(self, name, parents, content):
+        """直接放入 Drive 檔案 (不計入 API 呼叫)"""
+        return FakeDrive(self).add_file(name, parents, content)
+
+    @contextlib.contextmanager
+    def install(self):
+        """把 gspread、googleapiclient、Vision、Gemini 與服務帳號憑證換成替身"""
+        import google.auth.credentials
+        import googleapiclient.discovery
+        import gspread
+        from google import genai
+        from google.cloud import vision
+        from google.oauth2 import service_account
+
+        FakeVisionClient.backend = self
+        FakeGenAIClient.backend = self
+        anonymous = classmethod(lambda cls, *args, **kwargs: google.auth.credentials.AnonymousCredentials())
+        patches = [
+            (service_account.Credentials, 'from_service_account_info', anonymous),
+            (service_account.Credentials, 'from_service_account_file', anonymous),
+            (gspread, 'authorize', lambda *args, **kwargs: FakeSheetsClient(self)),
+            (googleapiclient.discovery, 'build', lambda *args, **kwargs: FakeDrive(self)),
+            (vision, 'ImageAnnotatorClient', FakeVisionClient),
+            (genai, 'Client', FakeGenAIClient),
+        ]
+        missing = object()
+        originals = [(target, name, vars(target).get(name, missing)) for target, name, _ in patches]
+        for target, name, replacement in patches:
+            setattr(target, name, replacement)
+        try:
+            yield self
+        finally:
+            for target, name, original in originals:
+                if original is missing:
+                    delattr(target, name)
+                else:
+                    setattr(target, name, original)
+
+
+def make_pdf(pages=3, text='公文內容'):
+    """產生測試用的 PDF (需要 PyMuPDF)"""
+    import fitz
+
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"{text} - page {page_num + 1}", fontsize=14)
+        page.draw_rect(fitz.Rect(72, 100, 520, 700), color=(0, 0, 0), width=0.5)
+    buffer = io.BytesIO(doc.tobytes())
+    doc.close()
+    return buffer.getvalue()
@@ -0,0 +1,79 @@
+"""
+公文資料記憶體用量測試
+
+以 10k / 100k / 1M 筆合成公文，比較每筆公文佔用的位元組數：
+1. object：每格一個 Python 字串 (舊版 pandas 的預設，也是原本的表示法)
+2. Arrow 字串：read_document_rows 讀出的同步快取
+3. 型別化：build_typed_documents 額外產生的欄位 (日期、category、Parent_ID)，
+   其餘欄位與同步快取共用，不重複計算
+
+用法：
+    python benchmarks/memory_benchmark.py
+    python benchmarks/memory_benchmark.py --sizes 10000 100000
+"""
+import argparse
+import gc
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from document_frame_benchmark import app, make_documents, pd  # noqa: E402
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+
+def object_bytes(df):
+    """逐欄轉成 object 後量測，避免同時保留整份 object 資料框"""
+    total = 0
+    for col in df.columns:
+        column = df[col].astype(object)
+        total += column.memory_usage(deep=True, index=False)
+        del column
+        gc.collect()
+    return total
+
+
+def typed_extra_bytes(raw, typed):
+    """型別化資料框中不與同步快取共用的欄位大小"""
+    replaced = set(app.DATE_COLUMNS.values()) | set(app.CATEGORY_COLUMNS) | {'Parent_ID'}
+    return sum(
+        typed[col].memory_usage(deep=True, index=False)
+        for col in typed.columns
+        if col in replaced or col not in raw.columns
+    )
+
+
+def measure(rows):
+    raw = make_documents(rows)
+    typed = app.build_typed_documents(raw)
+    result = {
+        'object': object_bytes(raw),
+        'arrow': raw.memory_usage(deep=True, index=False).sum(),
+        'typed_extra': typed_extra_bytes(raw, typed),
+    }
+    del raw, typed
+    gc.collect()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='公文資料記憶體用量測試')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='合成公文筆數')
+    args = parser.parse_args()
+
+    print(f"{'筆數':>10}{'object':>14}{'Arrow 字串':>14}{'+型別化欄位':>14}{'合計':>12}   (位元組/筆)")
+    for rows in args.sizes:
+        result = measure(rows)
+        total = result['arrow'] + result['typed_extra']
+        print(
+            f"{rows:>10,}"
+            f"{result['object'] / rows:>14.0f}"
+            f"{result['arrow'] / rows:>14.0f}"
+            f"{result['typed_extra'] / rows:>14.0f}"
+            f"{total / rows:>12.0f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+離線效能測試
+
+以 benchmarks/fakes.py 的替身取代 Google Sheets、Drive、Vision 與 Gemini，
+不需要網路與憑證，在 1k / 10k / 100k 筆合成公文上量測：
+- 讀取：get_all_documents、sync_documents (完整重載 / 版本檢查)、refresh_replica
+- 追蹤：get_pending_replies (pandas 逐筆) 與回覆追蹤佇列的前 k 筆
+- 對話串：get_conversation_thread 與 get_conversation_thread_replica
+- 查詢：search_documents_replica + get_search_facets、search_parent_candidates
+- OCR、浮水印、PDF 預覽、AI 摘要 (與資料量無關，每個資料量都量一次)
+
+每個情境回報 p50 / p95 / p99 延遲與每次執行的 API 呼叫數，
+可存成基準檔，之後比較是否退步。
+
+用法：
+    python benchmarks/offline_benchmark.py
+    python benchmarks/offline_benchmark.py --sizes 1000 --runs 3 --latency-scale 0
+    python benchmarks/offline_benchmark.py --save-baseline baseline.json
+    python benchmarks/offline_benchmark.py --compare baseline.json --fail-on-regression
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+warnings.filterwarnings('ignore')
+# 在 streamlit run 以外匯入 app 會有大量警告，這裡不需要
+logging.disable(logging.WARNING)
+
+# st.secrets 從目前目錄的 .streamlit/secrets.toml 讀取，必須在匯入 streamlit 前切換目錄
+START_DIR = os.getcwd()
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix='offline_benchmark_')
+os.makedirs(os.path.join(WORK_DIR, '.streamlit'))
+with open(os.path.join(WORK_DIR, '.streamlit', 'secrets.toml'), 'w', encoding='utf-8') as f:
+    f.write(
+        'SHEET_ID = "BENCHMARK_SHEET"\n'
+        'DRIVE_FOLDER_ID = "BENCHMARK_FOLDER"\n'
+        'GOOGLE_GEMINI_API_KEY = "offline"\n'
+        '[gcp_service_account]\n'
+        'type = "service_account"\n'
+    )
+os.chdir(WORK_DIR)
+
+import numpy as np  # noqa: E402
+import streamlit as st  # noqa: E402
+
+from document_frame_benchmark import app, make_documents  # noqa: E402
+from fakes import FakeBackend, make_pdf  # noqa: E402
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+DOC_HEADERS = ['ID', 'Date', 'Type', 'Agency', 'Subject', 'Parent_ID',
+               'Drive_File_ID', 'Created_At', 'Created_By', 'Status',
+               'OCR_Text', 'OCR_Status', 'OCR_Date']
+DELETED_HEADERS = ['ID', 'Date', 'Type', 'Agency', 'Subject', 'Parent_ID',
+                   'Drive_File_ID', 'Created_At', 'Created_By', 'Deleted_At', 'Deleted_By']
+USER_HEADERS = ['Username', 'Password', 'Display_Name', 'Role', 'Created_At']
+PDF_PAGES = 3
+
+
+def seed_backend(backend, rows):
+    """建立四張工作表與測試用 PDF，回傳 PDF 的 Drive 檔案 ID"""
+    file_id = backend.add_drive_file('benchmark.pdf', ['BENCHMARK_FOLDER'], make_pdf(PDF_PAGES))
+    df = make_documents(rows).assign(Drive_File_ID=file_id, Created_By='benchmark', OCR_Text='')
+    spreadsheet = backend.spreadsheet
+    spreadsheet.seed_worksheet('公文資料', [DOC_HEADERS] + df[DOC_HEADERS].values.tolist())
+    spreadsheet.seed_worksheet('刪除紀錄', [DELETED_HEADERS])
+    spreadsheet.seed_worksheet('使用者', [
+        USER_HEADERS,
+        ['admin', app.hash_password('admin123'), '系統管理員', 'admin', '2024-01-01T00:00:00'],
+    ])
+    spreadsheet.seed_worksheet('OCR文字', [app.OCR_TEXT_HEADERS])
+    return file_id
+
+
+def pick_thread_root(docs):
+    """找一個有回覆的根公文 (合成資料中 Parent_ID 指向較早的公文)"""
+    replied = set(docs.loc[docs['Parent_ID'] != '', 'Parent_ID'])
+    roots = docs[(docs['Parent_ID'] == '') & docs['ID'].isin(replied)]
+    return roots['ID'].iloc[len(roots) // 2] if not roots.empty else docs['ID'].iloc[0]
+
+
+def build_scenarios(size, services, file_id, legacy_max):
+    """回傳 [(名稱, 函數)]；pandas 逐筆版本在資料量超過 legacy_max 時略過"""
+    docs_sheet, deleted_sheet, users_sheet, text_sheet, drive_service = services
+    state = app.get_document_sync_state()
+    typed = app.get_typed_documents(docs_sheet, drive_service)
+    root_id = pick_thread_root(typed)
+    agency = typed['Agency'].iloc[0]
+    pdf_bytes = make_pdf(PDF_PAGES)
+    conversation = app.get_conversation_thread_replica(root_id)
+    app.rebuild_reply_queue()
+
+    def sync_revision_check():
+        state['checked_at'] = 0.0
+        app.sync_documents(docs_sheet, drive_service)
+
+    def refresh_replica_cold():
+        app.get_replica()['docs_source'] = None
+        app.refresh_replica(docs_sheet, deleted_sheet, users_sheet, drive_service)
+
+    def refresh_replica_after_edit():
+        app.note_document_write(root_id, {'OCR_Status': 'completed'})
+        app.refresh_replica(docs_sheet, deleted_sheet, users_sheet, drive_service)
+
+    def search():
+        conditions = {'agency': agency, 'keyword': '辦理'}
+        app.search_documents_replica(order_by=app.SEARCH_SORT_OPTIONS['日期 (新→舊)'], limit=20, threads=True, **conditions)
+        app.get_search_facets(threads=True, **conditions)
+
+    def ai_summary():
+        app.get_ai_summary.clear()
+        app.get_ai_summary(tuple(item['id'] for item in conversation), conversation)
+
+    scenarios = [
+        ('get_all_documents', lambda: app.get_all_documents(docs_sheet)),
+        ('sync_documents (完整重載)', lambda: app.sync_documents(docs_sheet, drive_service, force_full=True)),
+        ('sync_documents (版本檢查)', sync_revision_check),
+        ('refresh_replica (重建)', refresh_replica_cold),
+        ('refresh_replica (本機修改後)', refresh_replica_after_edit),
+        ('get_reply_queue_view', app.get_reply_queue_view),
+        ('get_conversation_thread_replica', lambda: app.get_conversation_thread_replica(root_id)),
+        ('search + facets', search),
+        ('search_parent_candidates', lambda: app.search_parent_candidates('機關0')),
+        ('ocr_pdf_from_drive', lambda: app.ocr_pdf_from_drive(drive_service, file_id)),
+        ('add_watermark_to_pdf', lambda: app.add_watermark_to_pdf(pdf_bytes, 'benchmark 2024-01-01')),
+        ('display_pdf_from_bytes', lambda: app.display_pdf_from_bytes(pdf_bytes, 'benchmark 2024-01-01')),
+        ('get_ai_summary', ai_summary),
+    ]
+    if size <= legacy_max:
+        scenarios[5:5] = [
+            ('get_pending_replies (pandas)', lambda: app.get_pending_replies(typed)),
+            ('get_conversation_thread (pandas)', lambda: app.get_conversation_thread(typed, root_id)),
+        ]
+    return scenarios
+
+
+def run_scenario(backend, func, runs):
+    """執行多次，回傳延遲百分位 (毫秒) 與平均每次的 API 呼叫數"""
+    samples = []
+    backend.reset_stats()
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    calls = {name: count / runs for name, count in backend.total_calls().items() if count}
+    return {'p50': p50, 'p95': p95, 'p99': p99, 'calls': calls}
+
+
+def run_size(size, args):
+    """建立一組全新的替身與快取，量測單一資料量"""
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    app.REPLICA_PATH = os.path.join(WORK_DIR, f'replica_{size}.sqlite3')
+
+    backend = FakeBackend(latency_scale=0)
+    file_id = seed_backend(backend, size)
+    with backend.install():
+        gc, drive_service, _ = app.init_google_services()
+        spreadsheet = app.get_spreadsheet(gc, app.get_setting('SHEET_ID'))
+        sheets = app.init_all_sheets(spreadsheet)
+        # 第一次載入 (建立同步快取與副本) 不計時
+        app.refresh_replica(*sheets[:3], drive_service)
+        scenarios = build_scenarios(size, (*sheets, drive_service), file_id, args.legacy_max)
+
+        backend.set_latency_scale(args.latency_scale)
+        results = {}
+        for name, func in scenarios:
+            if args.scenarios and not any(key in name for key in args.scenarios):
+                continue
+            results[name] = run_scenario(backend, func, args.runs)
+    return results
+
+
+def format_calls(calls):
+    return ', '.join(f"{name} {count:g}" for name, count in calls.items()) or '-'
+
+
+def print_results(size, results):
+    print(f"[{size:,} 筆公文]")
+    print(f"  {'情境':<34}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}   API 呼叫/次")
+    for name, result in results.items():
+        print(
+            f"  {name:<34}{result['p50']:>10.1f}{result['p95']:>10.1f}{result['p99']:>10.1f}"
+            f"   {format_calls(result['calls'])}"
+        )
+    print()
+
+
+def compare_results(all_results, baseline, threshold):
+    """與基準比較，回傳退步的項目數 (p95 超過門檻或 API 呼叫數增加)"""
+    regressions = 0
+    print(f"與基準比較 (p95 增加超過 {threshold:.0%} 或 API 呼叫數增加視為退步)")
+    for size, results in all_results.items():
+        base_results = baseline.get('results', {}).get(str(size), {})
+        for name, result in results.items():
+            base = base_results.get(name)
+            if not base:
+                continue
+            delta = (result['p95'] - base['p95']) / base['p95'] if base['p95'] else 0.0
+            calls = sum(result['calls'].values())
+            base_calls = sum(base['calls'].values())
+            regressed = delta > threshold or calls > base_calls
+            regressions += regressed
+            mark = '❌' if regressed else '✅'
+            print(
+                f"  {mark} {size:>8,} {name:<34} p95 {base['p95']:8.1f} → {result['p95']:8.1f} ms ({delta:+.0%})"
+                f"   API {base_calls:g} → {calls:g}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='離線效能測試 (Google API 以替身取代)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='合成公文筆數')
+    parser.add_argument('--runs', type=int, default=5, help='每個情境重複次數')
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='模擬 API 延遲的倍數 (0 = 不延遲)')
+    parser.add_argument('--legacy-max', type=int, default=10_000, help='pandas 逐筆版本最多測到幾筆')
+    parser.add_argument('--scenarios', nargs='+', help='只執行名稱包含這些字的情境')
+    parser.add_argument('--save-baseline', help='把結果存成基準檔 (JSON)')
+    parser.add_argument('--compare', help='與基準檔比較')
+    parser.add_argument('--threshold', type=float, default=0.2, help='p95 增加多少視為退步')
+    parser.add_argument('--fail-on-regression', action='store_true', help='有退步時以非 0 結束')
+    args = parser.parse_args()
+
+    all_results = {}
+    for size in args.sizes:
+        all_results[size] = run_size(size, args)
+        print_results(size, all_results[size])
+
+    if args.save_baseline:
+        baseline = {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'runs': args.runs,
+            'latency_scale': args.latency_scale,
+            'results': {str(size): results for size, results in all_results.items()},
+        }
+        with open(os.path.join(START_DIR, args.save_baseline), 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f"已儲存基準: {args.save_baseline}")
+
+    if args.compare:
+        with open(os.path.join(START_DIR, args.compare), encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('latency_scale') != args.latency_scale:
+            print(f"⚠️ 基準的延遲倍數為 {baseline.get('latency_scale')}，與本次 ({args.latency_scale}) 不同")
+        regressions = compare_results(all_results, baseline, args.threshold)
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+冷啟動效能測試
+
+量測兩件事 (每次都在全新的 Python 行程中執行，避免模組快取影響結果)：
+1. import app 所需時間，以及 import 後實際載入了哪些大型模組
+2. 登入頁第一次繪製完成的時間 (使用 streamlit.testing 的 AppTest，
+   Google 憑證與 gspread 以本機替身取代，不需要連網)
+
+用法：
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --runs 5 --compare-rev HEAD~1
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['pandas', 'googleapiclient', 'fitz', 'google.cloud.vision', 'google.genai']
+
+IMPORT_PROBE = r"""
+import json, sys, time, warnings
+warnings.filterwarnings('ignore')
+sys.path.insert(0, {app_dir!r})
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+loaded = [
+    name for name in {heavy!r}
+    if name in sys.modules and type(sys.modules[name]).__name__ != '_LazyModule'
+]
+print(json.dumps({{'seconds': elapsed, 'loaded': loaded}}))
+"""
+
+LOGIN_PROBE = r"""
+import json, sys, time, warnings
+warnings.filterwarnings('ignore')
+start = time.perf_counter()
+
+import gspread
+import google.auth.credentials
+from google.oauth2 import service_account
+from streamlit.testing.v1 import AppTest
+
+class StubWorksheet:
+    def __init__(self, title):
+        self.title = title
+        self.id = abs(hash(title)) % 100000
+
+class StubSpreadsheet:
+    def worksheets(self):
+        return [StubWorksheet('使用者')]
+    def worksheet(self, title):
+        return StubWorksheet(title)
+
+class StubClient:
+    def open_by_key(self, key):
+        return StubSpreadsheet()
+
+service_account.Credentials.from_service_account_info = classmethod(
+    lambda cls, info, **kwargs: google.auth.credentials.AnonymousCredentials()
+)
+gspread.authorize = lambda credentials, *args, **kwargs: StubClient()
+
+at = AppTest.from_file({app_path!r}, default_timeout=120)
+at.secrets['SHEET_ID'] = 'benchmark'
+at.secrets['gcp_service_account'] = {{'type': 'service_account'}}
+at.run()
+elapsed = time.perf_counter() - start
+
+labels = [widget.label for widget in at.text_input]
+print(json.dumps({{
+    'seconds': elapsed,
+    'rendered': any('帳號' in label for label in labels),
+    'errors': [error.value for error in at.error],
+}}))
+"""
+
+
+def run_probe(code, cwd):
+    """在新的行程中執行量測程式，回傳最後一行的 JSON 結果"""
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(app_dir, runs):
+    """量測指定目錄下 app.py 的 import 時間與登入頁繪製時間"""
+    import_runs = []
+    login_runs = []
+    loaded = []
+    login_ok = True
+    errors = []
+
+    for _ in range(runs):
+        probe = run_probe(IMPORT_PROBE.format(app_dir=app_dir, heavy=HEAVY_MODULES), app_dir)
+        import_runs.append(probe['seconds'])
+        loaded = probe['loaded']
+
+        probe = run_probe(LOGIN_PROBE.format(app_path=os.path.join(app_dir, 'app.py')), app_dir)
+        login_runs.append(probe['seconds'])
+        login_ok = login_ok and probe['rendered']
+        errors = probe['errors']
+
+    return {
+        'import_median': statistics.median(import_runs),
+        'login_median': statistics.median(login_runs),
+        'loaded': loaded,
+        'login_rendered': login_ok,
+        'errors': errors,
+    }
+
+
+def export_revision(rev, target_dir):
+    """把指定 git 版本的 app.py 匯出到暫存目錄"""
+    source = subprocess.run(
+        ['git', 'show', f'{rev}:app.py'],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        check=True,
+    ).stdout
+    with open(os.path.join(target_dir, 'app.py'), 'wb') as f:
+        f.write(source)
+
+
+def print_report(label, result):
+    print(f"[{label}]")
+    print(f"  import app           : {result['import_median'] * 1000:8.1f} ms")
+    print(f"  登入頁首次繪製       : {result['login_median'] * 1000:8.1f} ms")
+    print(f"  import 時載入的大型模組: {', '.join(result['loaded']) or '(無)'}")
+    print(f"  登入表單已顯示       : {'是' if result['login_rendered'] else '否'}")
+    if result['errors']:
+        print(f"  頁面錯誤訊息         : {result['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='冷啟動效能測試')
+    parser.add_argument('--runs', type=int, default=3, help='每項量測重複次數 (取中位數)')
+    parser.add_argument('--compare-rev', help='另外量測指定 git 版本的 app.py 作為對照')
+    args = parser.parse_args()
+
+    print_report('目前版本', measure(REPO_ROOT, args.runs))
+
+    if args.compare_rev:
+        with tempfile.TemporaryDirectory() as tmp:
+            export_revision(args.compare_rev, tmp)
+            print_report(args.compare_rev, measure(tmp, args.runs))
+
+
+if __name__ == '__main__':
+    main()
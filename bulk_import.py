@@ -0,0 +1,85 @@
+"""
+批次匯入公文 (指令列版)
+
+從資料夾或 ZIP 讀取 PDF，依中繼資料 CSV 新增公文。
+設定 (SHEET_ID、DRIVE_FOLDER_ID、gcp_service_account) 與網頁版相同，
+從 .streamlit/secrets.toml 或 credentials.json 讀取。
+
+CSV 欄位：filename, date (YYYY-MM-DD), type, agency, subject，選填 parent_id, doc_id
+
+用法：
+    python bulk_import.py --source scans/ --manifest metadata.csv
+    python bulk_import.py --source scans.zip --manifest metadata.csv --workers 16 --dry-run
+"""
+import argparse
+import logging
+import sys
+import warnings
+
+warnings.filterwarnings('ignore')
+# 在 streamlit run 以外匯入 app 會有大量警告，這裡不需要
+logging.disable(logging.WARNING)
+
+import app  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批次匯入公文')
+    parser.add_argument('--source', required=True, help='PDF 所在的資料夾或 ZIP 檔')
+    parser.add_argument('--manifest', required=True, help='中繼資料 CSV')
+    parser.add_argument('--workers', type=int, default=app.BULK_UPLOAD_WORKERS, help='同時上傳的數量')
+    parser.add_argument('--created-by', default='批次匯入', help='建立者名稱')
+    parser.add_argument('--dry-run', action='store_true', help='只檢查 CSV 與檔案，不上傳')
+    args = parser.parse_args()
+
+    entries, errors = app.read_bulk_manifest(args.manifest)
+    try:
+        files = app.open_bulk_files(args.source)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    for error in errors:
+        print(f"⚠️ {error}")
+    missing = [entry['filename'] for entry in entries if entry['filename'] not in files]
+    for filename in missing:
+        print(f"⚠️ 找不到檔案: {filename}")
+    print(f"共 {len(entries)} 筆可匯入 (來源內有 {len(files)} 個 PDF)")
+
+    if args.dry_run or not entries:
+        return 0
+
+    sheet_id = app.get_setting('SHEET_ID')
+    folder_id = app.get_setting('DRIVE_FOLDER_ID')
+    if not sheet_id or not folder_id:
+        print("❌ 請先在 secrets 設定 SHEET_ID 與 DRIVE_FOLDER_ID")
+        return 1
+
+    gc, drive_service, credentials = app.init_google_services()
+    if not gc:
+        print("❌ 無法連線 Google 服務")
+        return 1
+    spreadsheet = app.get_spreadsheet(gc, sheet_id)
+    if not spreadsheet:
+        print("❌ 無法開啟試算表")
+        return 1
+    docs_sheet = app.init_all_sheets(spreadsheet)[0]
+
+    def report(done, total):
+        print(f"\r上傳中... {done}/{total}", end='', flush=True)
+
+    result = app.run_bulk_import(
+        docs_sheet, credentials, folder_id, entries, files, args.created_by,
+        workers=args.workers, progress=report
+    )
+    print()
+    for filename, reason in result['failed']:
+        print(f"❌ {filename}: {reason}")
+    print(
+        f"✅ 匯入 {len(result['imported'])} 筆，失敗 {len(result['failed'])} 筆，"
+        f"耗時 {result['seconds']:.1f} 秒 ({result['per_minute']:.0f} 筆/分鐘)"
+    )
+    return 0 if not result['failed'] else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())